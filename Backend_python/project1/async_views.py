@@ -0,0 +1,125 @@
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.db import close_old_connections
+from django.http import JsonResponse
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+
+from . import profile
+from .authentication import CachedJWTAuthentication
+from .engagement import serialize_posts
+from .feed import feed_deps, feed_engine, read_feed
+from .pagination import InvalidCursor, get_page_params, split_page
+from .response_cache import acached_response, post_deps, response_key, version_key
+from .timeline import merge_timeline, read_inbox, read_pulled, timeline_limit
+
+# Async versions of get_following_feed and user_profile for the ASGI
+# deployment (see the README). Same responses, same cache entries, but the
+# independent queries of a request run at the same time.
+
+
+def _own_connection(func, *args):
+    # Runs in an executor thread on that thread's own database connection,
+    # closed again afterwards the way it would be at the end of a request
+    def run():
+        try:
+            return func(*args)
+        finally:
+            close_old_connections()
+    return run
+
+
+async def gather_queries(*calls):
+    """
+    Run (func, *args) calls concurrently and return their results in order.
+    Each one gets its own thread and so its own connection: the async ORM
+    methods all go through the one thread of the request and can't overlap.
+    """
+    return await asyncio.gather(*(
+        sync_to_async(_own_connection(*call), thread_sensitive=False)() for call in calls
+    ))
+
+
+async def request_user(request):
+    # These aren't DRF views, so the JWT is checked by hand. None when anonymous.
+    def authenticate():
+        result = CachedJWTAuthentication().authenticate(request)
+        return result[0] if result else None
+    return await sync_to_async(authenticate)()
+
+
+async def get_following_feed_async(request, username):
+    try:
+        user = await User.objects.aget(username=username)
+        page = get_page_params(request)
+    except User.DoesNotExist:
+        return JsonResponse({'error': 'User not found'}, status=404)
+    except InvalidCursor as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    engine = feed_engine()
+
+    async def build():
+        limit, cursor = page or (None, None)
+        if engine == 'timeline':
+            # The inbox scan and the pull path read are independent
+            limit = timeline_limit(limit)
+            inbox, pulled = await gather_queries(
+                (read_inbox, user.id, limit + 1, cursor),
+                (read_pulled, user.id, limit + 1, cursor),
+            )
+            posts, next_cursor = split_page(merge_timeline(inbox, pulled, limit + 1), limit)
+            post_info = await sync_to_async(serialize_posts)(posts, user.id)
+        else:
+            post_info, next_cursor = await sync_to_async(read_feed)(user.id, limit, cursor, engine)
+        if page:
+            return {'results': post_info, 'next_cursor': next_cursor}, post_deps(post_info)
+        return post_info, post_deps(post_info)
+
+    try:
+        deps = await sync_to_async(feed_deps)(user.id, engine)
+        key = response_key('feed', request, user.id, engine)
+        return await acached_response('feed', request, key, deps, build)
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=500)
+
+
+async def user_profile_async(request, username):
+    try:
+        profile_user = await User.objects.aget(username=username)
+        page = get_page_params(request)
+        viewer = await request_user(request)
+    except User.DoesNotExist:
+        return JsonResponse({'error': 'User not found'}, status=404)
+    except InvalidCursor as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    except (InvalidToken, AuthenticationFailed) as e:
+        return JsonResponse({'detail': str(e)}, status=401)
+    viewer_id = viewer.id if viewer else None
+
+    async def build():
+        calls = [
+            (profile.follow_state, profile_user.id, viewer_id),
+            (profile.posts_page, profile_user.id, page),
+            (profile.posts_count, profile_user.id),
+            (profile.picture, profile_user.id),
+        ]
+        # Liked and retweeted lists are only shown to signed in users
+        if viewer_id is not None:
+            calls += [(profile.liked_posts, profile_user.id), (profile.retweeted_posts, profile_user.id)]
+        follow, (posts, next_cursor), count, pic, *lists = await gather_queries(*calls)
+        liked, retweeted = lists or ([], [])
+        return await sync_to_async(profile.assemble_profile)(
+            profile_user, viewer_id, follow, posts, next_cursor, count, liked, retweeted, pic,
+        )
+
+    try:
+        # The viewer's own likes/follows change the flags they see here
+        deps = [version_key(kind, profile_user.id) for kind in ('posts', 'activity', 'profile')]
+        if viewer_id is not None:
+            deps.append(version_key('activity', viewer_id))
+        key = response_key('profile', request, profile_user.id, viewer_id)
+        return await acached_response('profile', request, key, deps, build)
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=500)
@@ -0,0 +1,98 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+
+class AuthUserCache:
+    """
+    Process-local user id -> User for authenticating requests, so a JWT
+    request from someone this process saw in the last AUTH_USER_CACHE_TTL
+    seconds doesn't read auth_user again. Entries are dropped by the
+    post_save/post_delete signals on User (a password change is how a JWT
+    gets revoked), and on logout or when their authtoken is deleted.
+    Changes made by other processes show up once the entry expires.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        # Bumped by every invalidate, a user read from before it may be stale
+        self._generation = 0
+
+    def _max_users(self):
+        return getattr(settings, 'AUTH_USER_CACHE_MAX_USERS', 50000)
+
+    def _ttl(self):
+        return getattr(settings, 'AUTH_USER_CACHE_TTL', 60)
+
+    def get(self, user_id):
+        """
+        The user with this id, None if there is none. Each call gets its
+        own copy, views are free to change request.user.
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(user_id)
+                return copy.copy(entry[1])
+            generation = self._generation
+
+        user = User.objects.filter(**{api_settings.USER_ID_FIELD: user_id}).first()
+        if user is None:
+            return None
+        with self._lock:
+            if generation == self._generation:
+                self._entries[user_id] = (now + self._ttl(), user)
+                self._entries.move_to_end(user_id)
+                while len(self._entries) > self._max_users():
+                    self._entries.popitem(last=False)
+        return copy.copy(user)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+            self._generation += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._generation += 1
+
+
+auth_users = AuthUserCache()
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    JWTAuthentication with the token's user taken from auth_users instead of
+    a query per request. Same checks and errors: unknown and inactive users
+    are refused, and so are tokens from before a password change when
+    SIMPLE_JWT's CHECK_REVOKE_TOKEN is on.
+    """
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_('Token contained no recognizable user identification'))
+
+        user = auth_users.get(user_id)
+        if user is None:
+            raise AuthenticationFailed(_('User not found'), code='user_not_found')
+        if not user.is_active:
+            raise AuthenticationFailed(_('User is inactive'), code='user_inactive')
+        if api_settings.CHECK_REVOKE_TOKEN and (
+            validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != get_md5_hash_password(user.password)
+        ):
+            raise AuthenticationFailed(_("The user's password has been changed."), code='password_changed')
+        return user
@@ -0,0 +1,140 @@
+from django.contrib.auth.models import User
+from django.db import IntegrityError, transaction
+
+from .models import Follows, IdempotencyKeys, Likes, Posts, Retweets
+from .response_cache import bump, version_key
+from .timeline import fan_out_post
+from .toggles import follow_changed, set_row
+from .write_behind import buffered, engagement_buffer, write_events
+
+# Mutations the app queues while offline and replays through api/batch/.
+# Engagement and follow mutations set an end state rather than flip it, so
+# replaying one is harmless; every mutation also carries the client's
+# idempotency key, and a key this user already sent gets its stored result
+# back instead of being applied again (a post isn't posted twice).
+
+# op: (table, end state), None for 'post'
+OPS = {
+    'like': (Likes, True),
+    'unlike': (Likes, False),
+    'reyeet': (Retweets, True),
+    'unreyeet': (Retweets, False),
+    'follow': (Follows, True),
+    'unfollow': (Follows, False),
+    'post': None,
+}
+
+
+class BatchConflict(Exception):
+    """Another request stored some of the same idempotency keys first."""
+
+
+def _error(key, op, message):
+    return {'key': key, 'op': op, 'status': 'error', 'error': message}
+
+
+def _check(user, mutation, post_ids, user_ids):
+    # Why a mutation can't be applied, None if it can
+    op = mutation.get('op')
+    if op not in OPS:
+        return f"op must be one of {', '.join(OPS)}"
+    if op == 'post':
+        content = mutation.get('content')
+        if not isinstance(content, str) or not content.strip():
+            return 'content is required'
+        for field in ('latitude', 'longitude'):
+            if mutation.get(field) is not None and not isinstance(mutation[field], (int, float)):
+                return f'{field} must be a number'
+        location_name = mutation.get('location_name')
+        if location_name is not None and (not isinstance(location_name, str) or len(location_name) > 100):
+            return 'location_name must be text of at most 100 characters'
+    elif OPS[op][0] is Follows:
+        if mutation.get('username') not in user_ids:
+            return 'User not found'
+        if user_ids[mutation['username']] == user.id:
+            return "You can't follow yourself"
+    elif mutation.get('post_id') not in post_ids:
+        return 'Post not found'
+    return None
+
+
+def apply_batch(user, mutations):
+    """
+    Apply a user's mutations in order, all in one transaction, and return a
+    result per mutation in the same order. Mutations that can't be applied
+    get an error result and don't stop the others. Likes and reyeets are
+    written together through write_events; for the same post or user only
+    the last mutation of the batch counts. Raises BatchConflict, having
+    applied nothing, when a concurrent request sent the same keys.
+    """
+    keys = [mutation.get('key') if isinstance(mutation, dict) else None for mutation in mutations]
+    stored = dict(
+        IdempotencyKeys.objects.filter(user_id=user.id, key__in=[key for key in keys if isinstance(key, str)])
+        .values_list('key', 'result')
+    )
+    post_ids = set(Posts.objects.filter(post_id__in=[
+        mutation.get('post_id') for mutation in mutations
+        if isinstance(mutation, dict) and isinstance(mutation.get('post_id'), int)
+    ]).values_list('post_id', flat=True))
+    user_ids = dict(User.objects.filter(username__in=[
+        mutation.get('username') for mutation in mutations
+        if isinstance(mutation, dict) and isinstance(mutation.get('username'), str)
+    ]).values_list('username', 'id'))
+
+    results, new_keys, replays = [], {}, []
+    engagement, follows, posts = {}, {}, []
+    for key, mutation in zip(keys, mutations):
+        if not isinstance(key, str) or not key or len(key) > IdempotencyKeys.KEY_LENGTH:
+            results.append(_error(key, None, f'key must be text of 1 to {IdempotencyKeys.KEY_LENGTH} characters'))
+            continue
+        if key in stored or key in new_keys:
+            # Filled in at the end, a post only gets its id once it's saved
+            replays.append((len(results), key))
+            results.append(None)
+            continue
+        op = mutation.get('op')
+        problem = _check(user, mutation, post_ids, user_ids)
+        if problem:
+            result = _error(key, op, problem)
+        elif op == 'post':
+            result = {'key': key, 'op': op, 'status': 'applied'}
+            posts.append((result, Posts(
+                user_id=user.id, content=mutation['content'], latitude=mutation.get('latitude'),
+                longitude=mutation.get('longitude'), location_name=mutation.get('location_name'),
+            )))
+        else:
+            model, wanted = OPS[op]
+            if model is Follows:
+                target = user_ids[mutation['username']]
+                follows[target] = wanted
+                result = {'key': key, 'op': op, 'status': 'applied', 'username': mutation['username']}
+            else:
+                engagement[model, user.id, mutation['post_id']] = wanted
+                result = {'key': key, 'op': op, 'status': 'applied', 'post_id': mutation['post_id']}
+        results.append(result)
+        new_keys[key] = result
+
+    if buffered():
+        # Older buffered toggles of this user must not land on top of the batch
+        engagement_buffer.flush()
+    with transaction.atomic():
+        write_events(engagement)
+        for followed_id, wanted in follows.items():
+            change = set_row(Follows, wanted, user_id=user.id, following_user_id=followed_id)
+            follow_changed(user.id, followed_id, change)
+        for result, post in posts:
+            # One by one, MySQL can't hand back the ids of a bulk insert
+            post.save()
+            fan_out_post(post)
+            result['post_id'] = post.post_id
+        if posts:
+            bump(version_key('posts', user.id), version_key('feed', user.id))
+        try:
+            IdempotencyKeys.objects.bulk_create(
+                IdempotencyKeys(user_id=user.id, key=key, result=result) for key, result in new_keys.items()
+            )
+        except IntegrityError:
+            raise BatchConflict
+    for index, key in replays:
+        results[index] = {**(stored.get(key) or new_keys[key]), 'replayed': True}
+    return results
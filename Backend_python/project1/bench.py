@@ -0,0 +1,45 @@
+import math
+
+from django.contrib.auth.models import User
+from django.core.management.base import CommandError
+from django.db.models import Count
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from .models import Posts
+
+
+def percentile(sorted_values, pct):
+    # Nearest rank percentile of an already sorted list
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def latency_summary(seconds):
+    """
+    p50/p95/p99/max in milliseconds for a list of request durations in seconds.
+    """
+    values = sorted(seconds)
+    summary = {'requests': len(values)}
+    for name, pct in (('p50_ms', 50), ('p95_ms', 95), ('p99_ms', 99), ('max_ms', 100)):
+        value = percentile(values, pct)
+        summary[name] = round(value * 1000, 2) if value is not None else None
+    return summary
+
+
+def pick_targets():
+    """
+    (viewer, author, bearer token of the viewer) to point a benchmark at:
+    the author with the most posts and someone else to read as.
+    """
+    author_id = (
+        Posts.objects.values('user_id').annotate(n=Count('post_id'))
+        .order_by('-n').values_list('user_id', flat=True).first()
+    )
+    if author_id is None:
+        raise CommandError('No posts to benchmark against, use --seed')
+    author = User.objects.get(id=author_id)
+    viewer = User.objects.exclude(id=author_id).order_by('id').first() or author
+    token = f'Bearer {RefreshToken.for_user(viewer).access_token}'
+    return viewer, author, token
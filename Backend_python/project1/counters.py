@@ -0,0 +1,109 @@
+import random
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F, Sum
+
+from .models import PostCounterShards, Posts
+
+# Like/retweet counters of hot posts. Every toggle of a post moves the same
+# Posts row, and when a post goes viral its likers queue up on that row's
+# lock. A post that takes COUNTER_SHARD_PROMOTE_WRITES counter writes within
+# COUNTER_SHARD_WINDOW_SECONDS is promoted: it gets COUNTER_SHARDS rows in
+# post_counter_shards and each later write moves one of them at random.
+# Reads add up the shards (the sums are cached for COUNTER_SHARD_SUM_SECONDS)
+# on top of the Posts columns, which keep what was counted before.
+#
+# Which posts are sharded is remembered in the cache. A worker that doesn't
+# know (or forgot) keeps writing the Posts row, which is still counted, until
+# the post crosses the threshold there too and it promotes it again.
+
+
+def _shards_key(post_id):
+    return f'counter_shards:{post_id}'
+
+
+def _sums_key(post_id):
+    return f'counter_sums:{post_id}'
+
+
+def _crossed_threshold(post_id, writes):
+    # True for the write that takes the post past the promotion threshold in this window
+    window = settings.COUNTER_SHARD_WINDOW_SECONDS
+    key = f'counter_rate:{post_id}:{int(time.time() // window)}'
+    cache.add(key, 0, window * 2)
+    try:
+        total = cache.incr(key, writes)
+    except ValueError:
+        # Evicted between the add and the incr, the window starts over
+        return False
+    return total >= settings.COUNTER_SHARD_PROMOTE_WRITES > total - writes
+
+
+def add(post_id, writes=1, **deltas):
+    """
+    Move a post's counters by deltas ({'like_count': 1}): a random shard if
+    the post is sharded, the Posts row if not. writes is how many toggles
+    the deltas stand for, for the promotion rate. Promotes the post once
+    the surrounding transaction commits when it gets hot.
+    """
+    updates = {counter: F(counter) + delta for counter, delta in deltas.items()}
+    shards = cache.get(_shards_key(post_id))
+    if shards and PostCounterShards.objects.filter(post_id=post_id, shard=random.randrange(shards)).update(**updates):
+        return
+    Posts.objects.filter(post_id=post_id).update(**updates)
+    if _crossed_threshold(post_id, writes):
+        transaction.on_commit(lambda: promote(post_id))
+
+
+def promote(post_id, shards=None):
+    # Give a post its shard rows and start writing to them, harmless to repeat
+    shards = shards or settings.COUNTER_SHARDS
+    with transaction.atomic():
+        if not Posts.objects.filter(post_id=post_id).update(counter_shards=shards):
+            return
+        PostCounterShards.objects.bulk_create(
+            [PostCounterShards(post_id=post_id, shard=shard) for shard in range(shards)],
+            ignore_conflicts=True,
+        )
+    cache.set(_shards_key(post_id), shards, None)
+
+
+def summed_shards(post_ids):
+    # {post_id: (likes, retweets)} straight from the shard rows, posts without any left out
+    rows = (
+        PostCounterShards.objects.filter(post_id__in=post_ids)
+        .values('post_id').annotate(likes=Sum('like_count'), retweets=Sum('retweet_count')).order_by()
+    )
+    return {row['post_id']: (row['likes'], row['retweets']) for row in rows}
+
+
+def shard_sums(post_ids):
+    # summed_shards through the cache, one query for the posts it doesn't have
+    post_ids = list(set(post_ids))
+    if not post_ids:
+        return {}
+    cached = cache.get_many([_sums_key(post_id) for post_id in post_ids])
+    sums = {post_id: tuple(cached[_sums_key(post_id)]) for post_id in post_ids if _sums_key(post_id) in cached}
+    missing = [post_id for post_id in post_ids if post_id not in sums]
+    if missing:
+        fresh = {post_id: (0, 0) for post_id in missing}
+        fresh.update(summed_shards(missing))
+        cache.set_many({_sums_key(post_id): sum_ for post_id, sum_ in fresh.items()},
+                       settings.COUNTER_SHARD_SUM_SECONDS)
+        sums.update(fresh)
+    return sums
+
+
+def with_shards(counts, sharded_ids):
+    """
+    Add the shards of the sharded posts to {post_id: (like_count,
+    retweet_count)} taken off the Posts columns. No query when none of the
+    posts are sharded.
+    """
+    for post_id, (likes, retweets) in shard_sums(sharded_ids).items():
+        like_count, retweet_count = counts[post_id]
+        counts[post_id] = (like_count + likes, retweet_count + retweets)
+    return counts
@@ -0,0 +1,115 @@
+from django.db.models import Count
+
+from .counters import summed_shards, with_shards
+from .models import Likes, Posts, Retweets
+
+
+def _viewer_post_ids(model, post_ids, viewer_id):
+    # Which of these posts the viewer has a row for, one (user_id, post_id) seek
+    if viewer_id is None:
+        return set()
+    return set(
+        model.objects.filter(user_id=viewer_id, post_id__in=post_ids)
+        .values_list('post_id', flat=True)
+    )
+
+
+def hydrate_engagement(post_ids, viewer_id=None, posts=None):
+    """
+    Like/retweet counts and viewer flags for a batch of posts in a constant
+    number of queries. Counts come from the like_count/retweet_count columns,
+    taken off `posts` when the caller already has them loaded, plus the
+    shards of hot posts (project1/counters.py). Returns
+    {post_id: {...}} with the same keys get_like_data and get_retweet_data return.
+    """
+    post_ids = list(set(post_ids))
+    if not post_ids:
+        return {}
+
+    if posts is not None:
+        counts = {post.post_id: (post.like_count, post.retweet_count) for post in posts}
+        sharded = [post.post_id for post in posts if post.counter_shards]
+    else:
+        counts, sharded = {}, []
+        for post_id, like_count, retweet_count, counter_shards in (
+            Posts.objects.filter(post_id__in=post_ids)
+            .values_list('post_id', 'like_count', 'retweet_count', 'counter_shards')
+        ):
+            counts[post_id] = (like_count, retweet_count)
+            if counter_shards:
+                sharded.append(post_id)
+    with_shards(counts, sharded)
+    liked = _viewer_post_ids(Likes, post_ids, viewer_id)
+    retweeted = _viewer_post_ids(Retweets, post_ids, viewer_id)
+
+    engagement = {}
+    for post_id in post_ids:
+        like_count, retweet_count = counts.get(post_id, (0, 0))
+        engagement[post_id] = {
+            'like_count': like_count,
+            'liked_by_user': post_id in liked,
+            'retweet_count': retweet_count,
+            'retweeted_by_user': post_id in retweeted,
+        }
+    return engagement
+
+
+def serialize_posts(posts, viewer_id=None, engagement=None):
+    """
+    Build the post dicts the app expects for a list of posts (with `user`
+    already loaded through select_related), hydrating engagement in bulk.
+    Pass `engagement` to reuse one hydrate_engagement call for several lists.
+    """
+    posts = list(posts)
+    if engagement is None:
+        engagement = hydrate_engagement([post.post_id for post in posts], viewer_id, posts)
+    return [
+        {
+            'user_id': post.user_id,
+            'username': post.user.username if post.user_id else None,
+            'post_id': post.post_id,
+            'post_content': post.content,
+            'post_timestamp': post.created_at,
+            'latitude': post.latitude,
+            'longitude': post.longitude,
+            'location_name': post.location_name,
+            **engagement[post.post_id],
+        }
+        for post in posts
+    ]
+
+
+def _grouped_counts(model, post_ids):
+    rows = (
+        model.objects.filter(post_id__in=post_ids)
+        .values('post_id').annotate(total=Count('pk')).order_by()
+    )
+    return {row['post_id']: row['total'] for row in rows}
+
+
+def rebuild_counters(posts, fix=True):
+    """
+    Recount likes/retweets for a chunk of posts and compare them with the
+    stored counters. Wrong counters are saved back unless fix is False.
+    A sharded post's columns hold what its shards don't, so they're checked
+    against the count minus the shards. Returns the posts whose counters
+    were wrong.
+    """
+    posts = list(posts)
+    post_ids = [post.post_id for post in posts]
+    likes = _grouped_counts(Likes, post_ids)
+    retweets = _grouped_counts(Retweets, post_ids)
+    shards = summed_shards([post.post_id for post in posts if post.counter_shards])
+
+    wrong = []
+    for post in posts:
+        sharded_likes, sharded_retweets = shards.get(post.post_id, (0, 0))
+        like_count = likes.get(post.post_id, 0) - sharded_likes
+        retweet_count = retweets.get(post.post_id, 0) - sharded_retweets
+        if post.like_count != like_count or post.retweet_count != retweet_count:
+            post.like_count = like_count
+            post.retweet_count = retweet_count
+            wrong.append(post)
+    if fix and wrong:
+        Posts.objects.bulk_update(wrong, ['like_count', 'retweet_count'])
+    return wrong
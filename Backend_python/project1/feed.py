@@ -0,0 +1,285 @@
+from collections import namedtuple
+from heapq import merge
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db.models import Exists, OuterRef, Q, Subquery
+
+from .counters import with_shards
+from .engagement import serialize_posts
+from .graph import social_graph
+from .models import Follows, Likes, Posts, Retweets
+from .pagination import encode_cursor, keyset_filter, split_page
+from .response_cache import version_key
+from .timeline import followed_pull_authors_of, read_timeline, timeline_limit
+
+# How get_following_feed builds a page, picked with FEED_ENGINE:
+#   timeline - read the home_timeline rows written at post time (fan-out on write)
+#   sql      - one statement joining follows to posts at read time (fan-out on read)
+#   merge    - followed users' posts and reyeets, merged newest first out of per-author streams
+# Every engine takes (viewer_id, limit, cursor) and returns (post dicts, next_cursor).
+
+
+def feed_engine():
+    return getattr(settings, 'FEED_ENGINE', 'timeline')
+
+
+def timeline_feed(viewer_id, limit, cursor=None):
+    posts, next_cursor = split_page(read_timeline(viewer_id, limit + 1, cursor), limit)
+    return serialize_posts(posts, viewer_id), next_cursor
+
+
+def sql_feed_queryset(viewer_id):
+    """
+    The whole feed as one statement: posts JOIN follows on the author,
+    newest first, with the stored like/retweet counters and the viewer's
+    flags as EXISTS subqueries on the (post, user) unique keys.
+    """
+    return (
+        Posts.objects.filter(user__follower_edges__user_id=viewer_id)
+        .select_related('user')
+        .annotate(
+            liked_by_user=Exists(Likes.objects.filter(post_id=OuterRef('post_id'), user_id=viewer_id)),
+            retweeted_by_user=Exists(Retweets.objects.filter(post_id=OuterRef('post_id'), user_id=viewer_id)),
+        )
+    )
+
+
+def sql_feed(viewer_id, limit, cursor=None):
+    posts, next_cursor = split_page(keyset_filter(sql_feed_queryset(viewer_id), cursor)[:limit + 1], limit)
+    # Everything engagement needs is already on the rows, but for the shards of hot posts
+    counts = with_shards(
+        {post.post_id: (post.like_count, post.retweet_count) for post in posts},
+        [post.post_id for post in posts if post.counter_shards],
+    )
+    engagement = {
+        post.post_id: {
+            'like_count': counts[post.post_id][0],
+            'liked_by_user': post.liked_by_user,
+            'retweet_count': counts[post.post_id][1],
+            'retweeted_by_user': post.retweeted_by_user,
+        }
+        for post in posts
+    }
+    return serialize_posts(posts, viewer_id, engagement), next_cursor
+
+
+# One entry of the merge feed. sort_id breaks timestamp ties and keeps posts
+# and reyeets apart in the cursor: post_id for posts, -retweet_id for reyeets.
+FeedItem = namedtuple('FeedItem', 'time sort_id post reyeeted_by')
+
+
+def _post_item(post):
+    return FeedItem(post.created_at, post.post_id, post, None)
+
+
+def _reyeet_item(retweet):
+    return FeedItem(retweet.retweet_timestamp, -retweet.retweet_id, retweet.post, retweet.user)
+
+
+def _item_order(item):
+    return (item.time, item.sort_id)
+
+
+def posts_after(queryset, cursor):
+    return keyset_filter(queryset, cursor)
+
+
+def reyeets_after(queryset, cursor):
+    # Newest first, then by retweet_id ascending so -retweet_id keeps descending
+    queryset = queryset.order_by('-retweet_timestamp', 'retweet_id')
+    if cursor is None:
+        return queryset
+    time, sort_id = cursor
+    if sort_id > 0:
+        # The cursor is on a post, and reyeets sort after posts of the same time
+        return queryset.filter(retweet_timestamp__lte=time)
+    return queryset.filter(Q(retweet_timestamp__lt=time) | Q(retweet_timestamp=time, retweet_id__gt=-sort_id))
+
+
+def newest_authors(queryset, viewer_id, time_field, batch_size, posts):
+    """
+    The viewer's followees whose rows (the queryset's, newest first) can
+    make it onto a page of posts - 1 items, as [(author_id, cutoff)] where
+    cutoff is the time of their batch_size-th row (None if they have fewer).
+    One statement over the viewer's follows rows, whatever their number,
+    with a few seeks on each followee's (user, time) index. Authors are
+    taken newest head row first until their heads cover `posts` different
+    posts, plus any tied with the last one: every row of the others is
+    older than that many posts, so none of them can reach the page.
+    """
+    per_author = queryset.filter(user_id=OuterRef('following_user_id'))
+    heads = Follows.objects.filter(user_id=viewer_id).annotate(
+        head=Subquery(per_author.values(time_field)[:1]),
+        head_post=Subquery(per_author.values('post_id')[:1]),
+        cutoff=Subquery(per_author.values(time_field)[batch_size - 1:batch_size]),
+    ).values_list('following_user_id', 'head', 'head_post', 'cutoff')
+    heads = sorted((row for row in heads if row[1] is not None), key=lambda row: row[1], reverse=True)
+    authors, seen, last_head = [], set(), None
+    for author_id, head, head_post, cutoff in heads:
+        if len(seen) >= posts and head < last_head:
+            break
+        authors.append((author_id, cutoff))
+        seen.add(head_post)
+        last_head = head
+    return authors
+
+
+def first_batches(queryset, viewer_id, time_field, batch_size, posts):
+    """
+    The first batch_size rows, in the queryset's order (newest first), of
+    the followees newest_authors() picks for a page of posts - 1 items,
+    reading about that many rows per author. Rows sharing the cutoff time
+    past the batch are dropped here. The statement grows with the page,
+    not with the number of followees. Returns {author_id: [rows]}.
+    """
+    cutoffs = newest_authors(queryset, viewer_id, time_field, batch_size, posts)
+    if not cutoffs:
+        return {}
+    # Authors with less than a batch are read whole, the rest only down to their cutoff
+    within = Q(user_id__in=[author_id for author_id, cutoff in cutoffs if cutoff is None])
+    for author_id, cutoff in cutoffs:
+        if cutoff is not None:
+            within |= Q(user_id=author_id, **{f'{time_field}__gte': cutoff})
+    batches = {}
+    for row in queryset.filter(within):
+        batch = batches.setdefault(row.user_id, [])
+        if len(batch) < batch_size:
+            batch.append(row)
+    return batches
+
+
+def author_stream(batch, batch_size, more, make_item):
+    """
+    One author's posts or reyeets, newest first. Starts on the rows
+    first_batches() already has and only asks more(last_row) for the next
+    batch when the merge gets past them.
+    """
+    while batch:
+        yield from map(make_item, batch)
+        if len(batch) < batch_size:
+            return
+        batch = list(more(batch[-1])[:batch_size])
+
+
+def latest_appearances(items, viewer_id):
+    """
+    Keep the items that are their post's first appearance in the feed's
+    order, (time, sort_id) newest first, and drop the others, which are on
+    an earlier page or a later one. A post appears as itself if the viewer
+    follows its author, and as each followee's reyeet of it; on a timestamp
+    tie the post goes before its reyeets, and reyeets by retweet_id.
+    """
+    if not items:
+        return []
+    reyeets = Retweets.objects.filter(
+        post_id=OuterRef('post_id'), retweet_timestamp__isnull=False, user__follower_edges__user_id=viewer_id,
+    ).order_by('-retweet_timestamp', 'retweet_id')
+    rows = Posts.objects.filter(post_id__in={item.post.post_id for item in items}).annotate(
+        reyeeted_at=Subquery(reyeets.values('retweet_timestamp')[:1]),
+        reyeet_id=Subquery(reyeets.values('retweet_id')[:1]),
+        followed=Exists(Follows.objects.filter(user_id=viewer_id, following_user_id=OuterRef('user_id'))),
+    ).values_list('post_id', 'created_at', 'reyeeted_at', 'reyeet_id', 'followed')
+    first = {}
+    for post_id, created_at, reyeeted_at, reyeet_id, followed in rows:
+        appearances = []
+        if followed and created_at is not None:
+            appearances.append((created_at, post_id))
+        if reyeeted_at is not None:
+            appearances.append((reyeeted_at, -reyeet_id))
+        if appearances:
+            first[post_id] = max(appearances)
+    return [item for item in items if _item_order(item) >= first.get(item.post.post_id, _item_order(item))]
+
+
+def merge_feed(viewer_id, limit, cursor=None):
+    """
+    Interleave the posts and reyeets of everyone the viewer follows with a
+    heap over per-author streams. Only the followees whose newest rows can
+    reach the page get a stream, each starting on a batch of at most
+    FEED_MERGE_BATCH rows read by first_batches. The heap holds one row per
+    stream and the merge stops as soon as the page is full, so the rows read
+    depend on the page size, not on how much the followees ever posted. A
+    post shows up once, at its newest appearance, across pages too.
+    """
+    if not social_graph.following_count(viewer_id):
+        return [], None
+    batch_size = min(limit + 1, getattr(settings, 'FEED_MERGE_BATCH', 10))
+
+    def authored(**author):
+        return Posts.objects.filter(created_at__isnull=False, **author).select_related('user')
+
+    def reyeeted(**author):
+        return Retweets.objects.filter(
+            post__isnull=False, retweet_timestamp__isnull=False, **author,
+        ).select_related('user', 'post__user')
+
+    streams = []
+    batches = first_batches(posts_after(authored(), cursor), viewer_id, 'created_at', batch_size, limit + 1)
+    for author_id, batch in batches.items():
+        more = lambda last, author_id=author_id: posts_after(
+            authored(user_id=author_id), (last.created_at, last.post_id),
+        )
+        streams.append(author_stream(batch, batch_size, more, _post_item))
+    batches = first_batches(reyeets_after(reyeeted(), cursor), viewer_id, 'retweet_timestamp', batch_size, limit + 1)
+    for author_id, batch in batches.items():
+        more = lambda last, author_id=author_id: reyeets_after(
+            reyeeted(user_id=author_id), (last.retweet_timestamp, -last.retweet_id),
+        )
+        streams.append(author_stream(batch, batch_size, more, _reyeet_item))
+
+    items, pending, seen = [], [], set()
+    for item in merge(*streams, key=_item_order, reverse=True):
+        # Reyeeted by several followees, or a reyeet of a post already on the page
+        if item.post.post_id in seen:
+            continue
+        seen.add(item.post.post_id)
+        pending.append(item)
+        if len(items) + len(pending) > limit:
+            items += latest_appearances(pending, viewer_id)
+            pending = []
+            if len(items) > limit:
+                break
+    else:
+        items += latest_appearances(pending, viewer_id)
+
+    page = items[:limit]
+    next_cursor = encode_cursor(page[-1].time, page[-1].sort_id) if len(items) > limit else None
+    post_info = serialize_posts([item.post for item in page], viewer_id)
+    for data, item in zip(post_info, page):
+        data['reyeeted_by'] = item.reyeeted_by.username if item.reyeeted_by else None
+        data['reyeeted_at'] = item.time if item.reyeeted_by else None
+    return post_info, next_cursor
+
+
+FEED_ENGINES = {
+    'timeline': timeline_feed,
+    'sql': sql_feed,
+    'merge': merge_feed,
+}
+
+
+def read_feed(viewer_id, limit=None, cursor=None, engine=None):
+    """
+    One page of the viewer's home feed from the configured engine. Without
+    a limit it's the whole feed up to TIMELINE_SIZE.
+    """
+    engine = engine or feed_engine()
+    if engine not in FEED_ENGINES:
+        raise ImproperlyConfigured(f"FEED_ENGINE must be one of {', '.join(FEED_ENGINES)}, not {engine!r}")
+    return FEED_ENGINES[engine](viewer_id, timeline_limit(limit), cursor)
+
+
+def feed_deps(viewer_id, engine=None):
+    """
+    Version keys a cached feed depends on before its posts are known:
+    inbox pushes, the viewer's own activity and the followed pull authors'
+    posts. The merge feed also shows what those authors reyeet.
+    """
+    engine = engine or feed_engine()
+    pull_authors = followed_pull_authors_of(viewer_id)
+    deps = [version_key('feed', viewer_id), version_key('activity', viewer_id)]
+    deps += [version_key('posts', author_id) for author_id in pull_authors]
+    if engine == 'merge':
+        deps += [version_key('activity', author_id) for author_id in pull_authors]
+    return deps
@@ -0,0 +1,196 @@
+import random
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import Follows
+
+# The other workers' follows and unfollows reach this process through
+# versions in the shared cache: one per user, bumped by every follow/unfollow
+# touching them, and an epoch bumped by bulk writes. Versions start from a
+# random number, so one that was evicted comes back different and the lists
+# loaded under it are reloaded instead of trusted.
+EPOCH_KEY = 'social_graph:epoch'
+
+
+def version_key(user_id):
+    return f'social_graph:user:{user_id}'
+
+
+def _new_version():
+    return random.getrandbits(48)
+
+
+def _contains(ids, user_id):
+    i = bisect_left(ids, user_id)
+    return i < len(ids) and ids[i] == user_id
+
+
+def _inserted(ids, user_id):
+    # A new array with user_id in place, the old one may still be iterated by a reader
+    i = bisect_left(ids, user_id)
+    return ids[:i] + array('q', [user_id]) + ids[i:]
+
+
+def _removed(ids, user_id):
+    i = bisect_left(ids, user_id)
+    return ids[:i] + ids[i + 1:]
+
+
+class _Entry:
+    # One user's loaded adjacency, and the (epoch, user version) it was loaded or last checked under
+    __slots__ = ('ids', 'version', 'loaded_at', 'checked_at')
+
+    def __init__(self, ids, version, now):
+        self.ids = ids
+        self.version = version
+        self.loaded_at = self.checked_at = now
+
+
+class SocialGraph:
+    """
+    Process-local follower/followee index. Each user's adjacency is a sorted
+    array of ids, loaded from the follows table the first time it's needed
+    and kept in step by follow_added/follow_removed. A loaded user's version
+    is checked at most once per SOCIAL_GRAPH_VERSION_CHECK_SECONDS, and the
+    ids are reloaded when it moved or after SOCIAL_GRAPH_TTL seconds either
+    way. Least recently used users are evicted past SOCIAL_GRAPH_MAX_USERS
+    per direction. A loaded array is never changed in place, follows and
+    unfollows swap a new one in, so callers can iterate what they got
+    without the lock.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._followees = OrderedDict()
+        self._followers = OrderedDict()
+
+    def _max_users(self):
+        return getattr(settings, 'SOCIAL_GRAPH_MAX_USERS', 50000)
+
+    def _current_version(self, user_id):
+        # (epoch, user version) from the shared cache, starting both if they're missing
+        keys = [EPOCH_KEY, version_key(user_id)]
+        versions = cache.get_many(keys)
+        for key in keys:
+            if key not in versions:
+                cache.add(key, _new_version(), None)
+                versions[key] = cache.get(key)
+        return versions[EPOCH_KEY], versions[version_key(user_id)]
+
+    def _adjacency(self, table, user_id):
+        now = time.monotonic()
+        with self._lock:
+            entry = table.get(user_id)
+            if entry is not None and now - entry.loaded_at < getattr(settings, 'SOCIAL_GRAPH_TTL', 300):
+                table.move_to_end(user_id)
+                if now - entry.checked_at < getattr(settings, 'SOCIAL_GRAPH_VERSION_CHECK_SECONDS', 1.0):
+                    return entry.ids
+            else:
+                entry = None
+
+        # Read before loading, so a follow that lands meanwhile shows up as a newer version
+        version = self._current_version(user_id)
+        if entry is not None and entry.version == version:
+            with self._lock:
+                entry.checked_at = now
+            return entry.ids
+
+        # Cold or stale: one indexed range scan on the follows table
+        if table is self._followees:
+            rows = Follows.objects.filter(user_id=user_id).values_list('following_user_id', flat=True)
+        else:
+            rows = Follows.objects.filter(following_user_id=user_id).values_list('user_id', flat=True)
+        ids = array('q', sorted(rows))
+
+        with self._lock:
+            table[user_id] = _Entry(ids, version, now)
+            table.move_to_end(user_id)
+            while len(table) > self._max_users():
+                table.popitem(last=False)
+        return ids
+
+    def followees(self, user_id):
+        return self._adjacency(self._followees, user_id)
+
+    def followers(self, user_id):
+        return self._adjacency(self._followers, user_id)
+
+    def is_following(self, user_id, other_id):
+        return _contains(self.followees(user_id), other_id)
+
+    def following_count(self, user_id):
+        return len(self.followees(user_id))
+
+    def follower_count(self, user_id):
+        return len(self.followers(user_id))
+
+    def mutuals(self, user_id):
+        # Users that follow user_id back
+        followers = self.followers(user_id)
+        return [other_id for other_id in self.followees(user_id) if _contains(followers, other_id)]
+
+    def _bump(self, user_id):
+        """
+        Give user_id a new version for everyone else to see, and keep this
+        process's own entries of the user when nobody else changed them
+        since they were loaded. Call it holding the lock, after applying
+        the change to the loaded lists.
+        """
+        key = version_key(user_id)
+        cache.add(key, _new_version(), None)
+        try:
+            version = cache.incr(key)
+        except ValueError:
+            # Evicted in between, start over under a version nobody has loaded
+            version = _new_version()
+            cache.set(key, version, None)
+        for table in (self._followees, self._followers):
+            entry = table.get(user_id)
+            if entry is None:
+                continue
+            epoch, loaded = entry.version
+            if loaded == version - 1:
+                entry.version = (epoch, version)
+            else:
+                del table[user_id]
+
+    def follow_added(self, user_id, followed_id):
+        with self._lock:
+            entry = self._followees.get(user_id)
+            if entry is not None and not _contains(entry.ids, followed_id):
+                entry.ids = _inserted(entry.ids, followed_id)
+            entry = self._followers.get(followed_id)
+            if entry is not None and not _contains(entry.ids, user_id):
+                entry.ids = _inserted(entry.ids, user_id)
+            self._bump(user_id)
+            self._bump(followed_id)
+
+    def follow_removed(self, user_id, followed_id):
+        with self._lock:
+            entry = self._followees.get(user_id)
+            if entry is not None and _contains(entry.ids, followed_id):
+                entry.ids = _removed(entry.ids, followed_id)
+            entry = self._followers.get(followed_id)
+            if entry is not None and _contains(entry.ids, user_id):
+                entry.ids = _removed(entry.ids, user_id)
+            self._bump(user_id)
+            self._bump(followed_id)
+
+    def invalidate(self):
+        # For bulk writes that bypass follow_added/follow_removed: every process reloads everyone
+        cache.set(EPOCH_KEY, _new_version(), None)
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self._followees.clear()
+            self._followers.clear()
+
+
+social_graph = SocialGraph()
@@ -0,0 +1,138 @@
+import asyncio
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.test import AsyncClient, Client
+from django.test.utils import override_settings
+
+from project1.bench import latency_summary, pick_targets
+from project1.seed import seed_dataset
+
+SEED_PREFIX = 'bench_seed'
+
+
+class PeakThreads:
+    # Samples threading.active_count() in the background while a run is going
+    def __init__(self):
+        self.peak = threading.active_count()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def _sample(self):
+        while not self._stop.wait(0.005):
+            self.peak = max(self.peak, threading.active_count())
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+class Command(BaseCommand):
+    help = (
+        'Put the same load on the sync (WSGI) and async (ASGI) feed and profile views '
+        'and compare tail latency and how many threads each needs for the concurrency'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help='Requests per view and mode')
+        parser.add_argument('--concurrency', type=int, default=16,
+                            help='Requests in flight: WSGI worker threads, or concurrent ASGI requests')
+        parser.add_argument('--seed', type=int, default=0, metavar='USERS',
+                            help=f'Seed this many {SEED_PREFIX}* users first if there are none (kept, other '
+                                 'threads have to see them)')
+        parser.add_argument('--cache', action='store_true',
+                            help='Leave the response cache on (by default every request runs its queries)')
+        parser.add_argument('--json', action='store_true', help='Print the report as JSON')
+
+    def run_wsgi(self, url, token, total, concurrency):
+        # One thread per WSGI worker, each with its own test client
+        local = threading.local()
+
+        def request(url):
+            if not hasattr(local, 'client'):
+                local.client = Client(raise_request_exception=False, HTTP_HOST='localhost')
+            started = time.perf_counter()
+            response = local.client.get(url, HTTP_AUTHORIZATION=token)
+            return time.perf_counter() - started, response.status_code
+
+        with PeakThreads() as threads, ThreadPoolExecutor(max_workers=concurrency) as pool:
+            started = time.perf_counter()
+            results = list(pool.map(request, [url] * total))
+            elapsed = time.perf_counter() - started
+        return results, elapsed, threads.peak, concurrency
+
+    def run_asgi(self, url, token, total, concurrency):
+        # One event loop, up to `concurrency` requests in flight on it
+        async def run():
+            client = AsyncClient(raise_request_exception=False, headers={'host': 'localhost'})
+            gate = asyncio.Semaphore(concurrency)
+            in_flight = peak_in_flight = 0
+
+            async def request(url):
+                nonlocal in_flight, peak_in_flight
+                async with gate:
+                    in_flight += 1
+                    peak_in_flight = max(peak_in_flight, in_flight)
+                    started = time.perf_counter()
+                    response = await client.get(url, headers={'authorization': token})
+                    in_flight -= 1
+                    return time.perf_counter() - started, response.status_code
+
+            results = await asyncio.gather(*(request(url) for _ in range(total)))
+            return list(results), peak_in_flight
+
+        with PeakThreads() as threads:
+            started = time.perf_counter()
+            results, peak_in_flight = asyncio.run(run())
+            elapsed = time.perf_counter() - started
+        return results, elapsed, threads.peak, peak_in_flight
+
+    def handle(self, *args, **options):
+        if options['seed'] and not User.objects.filter(username__startswith=SEED_PREFIX).exists():
+            seed_dataset(users=options['seed'], prefix=SEED_PREFIX)
+        viewer, author, token = pick_targets()
+        total, concurrency = options['requests'], options['concurrency']
+
+        views = {
+            'get_following_feed': {
+                'wsgi': f'/api/follow_feed/{viewer.username}/?limit=20',
+                'asgi': f'/api/async/follow_feed/{viewer.username}/?limit=20',
+            },
+            'user_profile': {
+                'wsgi': f'/user_profile/{author.username}/?limit=20',
+                'asgi': f'/async/user_profile/{author.username}/?limit=20',
+            },
+        }
+        report = {}
+        with override_settings(RESPONSE_CACHE_ENABLED=options['cache']):
+            for view, modes in views.items():
+                report[view] = {}
+                for mode, runner in (('wsgi', self.run_wsgi), ('asgi', self.run_asgi)):
+                    results, elapsed, peak_threads, peak_in_flight = runner(modes[mode], token, total, concurrency)
+                    report[view][mode] = {
+                        **latency_summary([duration for duration, _ in results]),
+                        'errors': sum(1 for _, status in results if status != 200),
+                        'requests_per_second': round(len(results) / elapsed, 1),
+                        'peak_in_flight': peak_in_flight,
+                        'peak_threads': peak_threads,
+                    }
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+        for view, modes in report.items():
+            self.stdout.write(view)
+            for mode, row in modes.items():
+                self.stdout.write(
+                    f"  {mode}: p50={row['p50_ms']}ms p95={row['p95_ms']}ms p99={row['p99_ms']}ms "
+                    f"max={row['max_ms']}ms rps={row['requests_per_second']} errors={row['errors']} "
+                    f"in_flight={row['peak_in_flight']} threads={row['peak_threads']}"
+                )
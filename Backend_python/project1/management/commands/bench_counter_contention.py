@@ -0,0 +1,104 @@
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, connection
+from django.test.utils import override_settings
+
+from project1.bench import latency_summary
+from project1.counters import promote, summed_shards
+from project1.engagement import hydrate_engagement
+from project1.models import Likes, PostCounterShards, Posts
+from project1.seed import seed_dataset
+from project1.toggles import toggle_engagement
+
+SEED_PREFIX = 'bench_seed'
+# Far past anything a run writes, so 'row' never promotes its post
+NEVER = 10 ** 9
+
+
+class Command(BaseCommand):
+    help = (
+        'Many writers liking and unliking one post at once, with its counter on the posts row, '
+        'on shard rows, and promoted automatically, to compare throughput and tail latency. '
+        'Run it against MySQL: SQLite locks the whole database on every write, shards or not.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--writers', type=int, default=32, help='Concurrent writers, each a different user')
+        parser.add_argument('--toggles', type=int, default=50, help='Like/unlike toggles per writer and mode')
+        parser.add_argument('--shards', type=int, default=None, help='Shard rows in sharded mode (COUNTER_SHARDS)')
+        parser.add_argument('--modes', nargs='+', choices=('row', 'sharded', 'auto'), default=['row', 'sharded', 'auto'])
+        parser.add_argument('--seed', type=int, default=0, metavar='USERS',
+                            help=f'Seed this many {SEED_PREFIX}* users first if there are none')
+        parser.add_argument('--json', action='store_true', help='Print the report as JSON')
+
+    def run_mode(self, mode, post, user_ids, toggles, shards):
+        if mode == 'sharded':
+            promote(post.post_id, shards)
+
+        def write(user_id):
+            durations, errors = [], 0
+            try:
+                for _ in range(toggles):
+                    started = time.perf_counter()
+                    try:
+                        toggle_engagement(Likes, user_id, post.post_id)
+                    except DatabaseError:
+                        # Lock wait timeouts and deadlocks, what contention costs at its worst
+                        errors += 1
+                    durations.append(time.perf_counter() - started)
+            finally:
+                connection.close()
+            return durations, errors
+
+        overrides = {'COUNTER_SHARD_PROMOTE_WRITES': NEVER} if mode == 'row' else {}
+        with override_settings(**overrides), ThreadPoolExecutor(max_workers=len(user_ids)) as pool:
+            started = time.perf_counter()
+            results = list(pool.map(write, user_ids))
+            elapsed = time.perf_counter() - started
+
+        durations = [duration for thread_durations, _ in results for duration in thread_durations]
+        # What the app shows may be a cached shard sum, 'counted' adds the shard rows up now
+        shown = hydrate_engagement([post.post_id])[post.post_id]['like_count']
+        sharded_likes, _ = summed_shards([post.post_id]).get(post.post_id, (0, 0))
+        return {
+            **latency_summary(durations),
+            'errors': sum(errors for _, errors in results),
+            'toggles_per_second': round(len(durations) / elapsed, 1),
+            'shards': PostCounterShards.objects.filter(post_id=post.post_id).count(),
+            'likes': Likes.objects.filter(post_id=post.post_id).count(),
+            'counted': Posts.objects.get(post_id=post.post_id).like_count + sharded_likes,
+            'shown': shown,
+        }
+
+    def handle(self, *args, **options):
+        if options['seed'] and not User.objects.filter(username__startswith=SEED_PREFIX).exists():
+            seed_dataset(users=options['seed'], prefix=SEED_PREFIX, build_timelines=False)
+        user_ids = list(User.objects.order_by('id').values_list('id', flat=True)[:options['writers']])
+        if len(user_ids) < options['writers']:
+            raise CommandError(f"{options['writers']} writers need as many users, use --seed")
+
+        report = {}
+        for mode in options['modes']:
+            post = Posts.objects.create(user_id=user_ids[0], content=f'counter contention bench ({mode})')
+            try:
+                report[mode] = self.run_mode(mode, post, user_ids, options['toggles'], options['shards'])
+            finally:
+                Likes.objects.filter(post_id=post.post_id).delete()
+                PostCounterShards.objects.filter(post_id=post.post_id).delete()
+                post.delete()
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+        for mode, row in report.items():
+            correct = row['likes'] == row['counted']
+            self.stdout.write(
+                f"{mode}: p50={row['p50_ms']}ms p95={row['p95_ms']}ms p99={row['p99_ms']}ms max={row['max_ms']}ms "
+                f"toggles/s={row['toggles_per_second']} errors={row['errors']} shards={row['shards']} "
+                f"likes={row['likes']} counted={row['counted']} shown={row['shown']}"
+                + ('' if correct else ' COUNTER MISMATCH')
+            )
@@ -0,0 +1,242 @@
+import json
+import logging
+import platform
+import subprocess
+import time
+import tracemalloc
+from contextlib import nullcontext
+from urllib.parse import urlencode
+
+import django
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import URLPattern, resolve
+from django.utils import timezone
+from django.views.static import serve
+
+from project1 import metrics, urls as project_urls
+from project1.bench import latency_summary, pick_targets
+from project1.models import Follows, Posts
+from project1.seed import SCALES, seed_dataset
+
+SEED_PREFIX = 'bench_seed'
+
+
+def endpoint_requests(viewer, author):
+    """
+    What to send to each route of project1/urls.py, as
+    [(method, path, body, writes)]. Routes that write are run inside a
+    transaction that is rolled back afterwards.
+    """
+    post = Posts.objects.filter(user_id=author.id).order_by('-post_id').first()
+    follow = Follows.objects.order_by('follow_id').first()
+    some_ids = ','.join(map(str, User.objects.order_by('id').values_list('id', flat=True)[:20]))
+    toggle = {'username': viewer.username, 'post_id': post.post_id}
+    page = '?' + urlencode({'limit': 20})
+    listing = '?' + urlencode({'limit': 100})
+    return [
+        ('GET', '/all_users/', None, False),
+        ('POST', '/check_user/', {'email': author.email}, False),
+        ('POST', '/validate_new_user/', {'username': f'{SEED_PREFIX}_new', 'email': 'new@example.com'}, False),
+        ('GET', '/all_posts/' + listing, None, False),
+        ('GET', '/view_all_posts/' + listing, None, False),
+        ('GET', f'/api/user/{author.username}/Following/', None, False),
+        ('GET', '/api/users/' + listing, None, False),
+        ('GET', '/api/follows/' + listing, None, False),
+        ('GET', f'/api/username/{author.id}/', None, False),
+        ('GET', '/api/usernames/?' + urlencode({'ids': some_ids}), None, False),
+        ('GET', f'/api/follow-usernames/{follow.follow_id if follow else 0}/', None, False),
+        ('POST', '/auth/google-login/', {'email': author.email}, False),
+        ('GET', f'/api/follow_feed/{viewer.username}/' + page, None, False),
+        ('POST', '/api/like_unlike/', toggle, True),
+        ('POST', '/api/reyeet_unreyeet/', toggle, True),
+        ('POST', '/api/post_yeet/', {'username': author.username, 'post_content': 'bench yeet'}, True),
+        ('GET', f'/api/user_posts/{author.username}/' + page, None, False),
+        ('GET', '/api/profile_pic/?' + urlencode({'user_id': author.id}), None, False),
+        ('GET', '/search_users/?' + urlencode({'query': author.username[:3]}), None, False),
+        ('GET', f'/user_profile/{author.username}/' + page, None, False),
+        ('POST', '/follow_toggle/', {'username': author.username}, True),
+        ('POST', '/api/batch/', {'mutations': [
+            {'key': 'bench-like', 'op': 'like', 'post_id': post.post_id},
+            {'key': 'bench-reyeet', 'op': 'reyeet', 'post_id': post.post_id},
+            {'key': 'bench-follow', 'op': 'follow', 'username': author.username},
+            {'key': 'bench-post', 'op': 'post', 'content': 'bench batch yeet'},
+        ]}, True),
+        ('GET', f'/api/async/follow_feed/{viewer.username}/' + page, None, False),
+        ('GET', f'/async/user_profile/{author.username}/' + page, None, False),
+        ('POST', '/api/feedback/', {'likes_app': True, 'selected_reasons': ['Performance']}, True),
+        ('GET', '/api/feedback/stats/', None, False),
+        ('GET', '/api/cache_stats/', None, False),
+        ('GET', '/api/metrics/', None, False),
+        ('GET', '/api/slow_queries/', None, False),
+        ('GET', '/api/profiles/', None, False),
+        ('GET', '/api/profiles/latest/', None, False),
+    ]
+
+
+def route_of(path):
+    # Same name the metrics middleware files the request under
+    return resolve(path.split('?')[0]).view_name
+
+
+def route_queries(route):
+    recorded = metrics.registry.snapshot().get(route)
+    return recorded.queries.sum if recorded else 0
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = (
+        'Request every route of project1/urls.py through the test client and report latency '
+        'percentiles, queries per request and peak memory, as JSON to compare across commits'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=20, help='Timed requests per route')
+        parser.add_argument('--warmup', type=int, default=2, help='Untimed requests per route first')
+        parser.add_argument('--seed', metavar='USERS_OR_SCALE',
+                            help=f"Seed {SEED_PREFIX}* users first if there are none: a number or one of "
+                                 f"{', '.join(SCALES)} (kept, the async views read on other connections)")
+        parser.add_argument('--routes', nargs='*', help='Only the routes whose name contains one of these')
+        parser.add_argument('--cache', action='store_true',
+                            help='Leave the response cache on (by default every request runs its queries)')
+        parser.add_argument('--json', action='store_true', help='Print the report as JSON')
+        parser.add_argument('--output', help='Also write the JSON report to this file')
+
+    def seed(self, size):
+        if User.objects.filter(username__startswith=SEED_PREFIX).exists():
+            return
+        if size in SCALES:
+            params = SCALES[size]
+        elif size.isdigit():
+            params = {'users': int(size)}
+        else:
+            raise CommandError(f"--seed takes a number of users or one of {', '.join(SCALES)}")
+        seed_dataset(prefix=SEED_PREFIX, **params)
+
+    def send(self, client, method, path, body, token):
+        if method == 'GET':
+            response = client.get(path, HTTP_AUTHORIZATION=token)
+        else:
+            response = client.post(path, body, content_type='application/json', HTTP_AUTHORIZATION=token)
+        # Streamed bodies are only produced while they are read
+        return response, response.getvalue()
+
+    def bench_route(self, client, method, path, body, token, requests, warmup):
+        route = route_of(path)
+        durations, queries = [], []
+        for n in range(warmup + requests):
+            before = route_queries(route)
+            started = time.perf_counter()
+            response, content = self.send(client, method, path, body, token)
+            elapsed = time.perf_counter() - started
+            if n >= warmup:
+                durations.append(elapsed)
+                queries.append(route_queries(route) - before)
+
+        # One more request with allocations traced, kept out of the timings
+        tracemalloc.start()
+        baseline = tracemalloc.get_traced_memory()[0]
+        self.send(client, method, path, body, token)
+        peak = tracemalloc.get_traced_memory()[1] - baseline
+        tracemalloc.stop()
+
+        return route, {
+            'method': method,
+            'path': path,
+            'status': response.status_code,
+            **latency_summary(durations),
+            'queries_mean': round(sum(queries) / len(queries), 1) if queries else None,
+            'queries_max': max(queries, default=None),
+            'response_bytes': len(content),
+            'peak_memory_kb': round(peak / 1024, 1),
+        }
+
+    def run_routes(self, client, planned, token, routes, options):
+        with override_settings(RESPONSE_CACHE_ENABLED=options['cache']):
+            for method, path, body, writes in planned:
+                # Writes are rolled back, leaving the data as it was for the next route and the next run
+                with transaction.atomic() if writes else nullcontext():
+                    route, row = self.bench_route(
+                        client, method, path, body, token, options['requests'], options['warmup'],
+                    )
+                    if writes:
+                        transaction.set_rollback(True)
+                routes[route] = row
+
+    def handle(self, *args, **options):
+        if not getattr(settings, 'METRICS_ENABLED', True):
+            raise CommandError('Query counts come from the metrics middleware, turn METRICS_ENABLED on')
+        if options['seed']:
+            self.seed(options['seed'])
+        viewer, author, token = pick_targets()
+
+        planned = endpoint_requests(viewer, author)
+        if options['routes']:
+            planned = [req for req in planned if any(part in route_of(req[1]) for part in options['routes'])]
+        covered = {resolve(path.split('?')[0]).func for _, path, _, _ in endpoint_requests(viewer, author)}
+        not_benchmarked = [
+            str(pattern.pattern) for pattern in project_urls.urlpatterns
+            if isinstance(pattern, URLPattern) and pattern.callback not in covered and pattern.callback is not serve
+        ]
+
+        client = Client(raise_request_exception=False)
+        routes = {}
+        # The staff only routes answer 403 for the bench user, no need to log every one
+        request_log = logging.getLogger('django.request')
+        log_level = request_log.level
+        request_log.setLevel(logging.ERROR)
+        try:
+            self.run_routes(client, planned, token, routes, options)
+        finally:
+            request_log.setLevel(log_level)
+
+        report = {
+            'meta': {
+                'commit': git_commit(),
+                'started_at': timezone.now().isoformat(),
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'database': connection.vendor,
+                'users': User.objects.count(),
+                'posts': Posts.objects.count(),
+                'follows': Follows.objects.count(),
+                'requests_per_route': options['requests'],
+                'response_cache': options['cache'],
+            },
+            'routes': routes,
+            'not_benchmarked': not_benchmarked,
+        }
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+
+        meta = report['meta']
+        self.stdout.write(
+            f"{meta['database']} at {meta['commit']}: {meta['users']:,} users, {meta['posts']:,} posts, "
+            f"{meta['follows']:,} follows"
+        )
+        for route, row in routes.items():
+            self.stdout.write(
+                f"  {route}: {row['status']} p50={row['p50_ms']}ms p95={row['p95_ms']}ms p99={row['p99_ms']}ms "
+                f"queries={row['queries_mean']} (max {row['queries_max']}) bytes={row['response_bytes']} "
+                f"peak_mem={row['peak_memory_kb']}KB"
+            )
+        if not_benchmarked:
+            self.stdout.write(f"  not benchmarked: {', '.join(not_benchmarked)}")
@@ -0,0 +1,92 @@
+import json
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from project1.bench import latency_summary
+from project1.feed import FEED_ENGINES, read_feed
+from project1.graph import social_graph
+from project1.models import Follows
+from project1.pagination import decode_cursor
+from project1.seed import seed_dataset
+
+
+class Command(BaseCommand):
+    help = 'Read the same home feeds with every FEED_ENGINE and compare latency, query counts and results'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=0, metavar='USERS',
+                            help='Seed this many synthetic users first (rolled back afterwards)')
+        parser.add_argument('--users', type=int, default=20, help='How many followers to read the feed of')
+        parser.add_argument('--limit', type=int, default=20, help='Page size')
+        parser.add_argument('--pages', type=int, default=3, help='Pages to walk per user')
+        parser.add_argument('--json', action='store_true', help='Print the report as JSON')
+
+    def walk(self, engine, user_id, limit, pages):
+        # Page through one user's feed, returning post ids and per page timings/query counts
+        post_ids, durations, queries = [], [], []
+        cursor = None
+        for _ in range(pages):
+            with CaptureQueriesContext(connection) as captured:
+                started = time.perf_counter()
+                posts, next_cursor = read_feed(user_id, limit, cursor, engine)
+                durations.append(time.perf_counter() - started)
+            queries.append(len(captured))
+            post_ids += [post['post_id'] for post in posts]
+            if not next_cursor:
+                break
+            cursor = decode_cursor(next_cursor)
+        return post_ids, durations, queries
+
+    def handle(self, *args, **options):
+        report = {}
+        with transaction.atomic():
+            if options['seed']:
+                seed_dataset(users=options['seed'], prefix='feed_seed')
+            user_ids = list(
+                Follows.objects.values_list('user_id', flat=True).distinct().order_by('user_id')[:options['users']]
+            )
+            if not user_ids:
+                raise CommandError('Nobody follows anyone yet, use --seed')
+
+            results = {}
+            for engine in FEED_ENGINES:
+                durations, queries, results[engine] = [], [], {}
+                for user_id in user_ids:
+                    social_graph.clear()
+                    ids, page_durations, page_queries = self.walk(engine, user_id, options['limit'], options['pages'])
+                    results[engine][user_id] = ids
+                    durations += page_durations
+                    queries += page_queries
+                report[engine] = {
+                    **latency_summary(durations),
+                    'queries_per_page': round(sum(queries) / len(queries), 2),
+                    'max_queries_per_page': max(queries),
+                }
+
+            # The timeline engine only backfills recent posts on follow, so compare first pages
+            baseline = results['timeline']
+            for engine in FEED_ENGINES:
+                report[engine]['same_first_page_as_timeline'] = sum(
+                    1 for user_id in user_ids
+                    if results[engine][user_id][:options['limit']] == baseline[user_id][:options['limit']]
+                )
+                report[engine]['users'] = len(user_ids)
+
+            if options['seed']:
+                transaction.set_rollback(True)
+        if options['seed']:
+            social_graph.invalidate()
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+        for engine, row in report.items():
+            self.stdout.write(
+                f"{engine}: p50={row['p50_ms']}ms p95={row['p95_ms']}ms p99={row['p99_ms']}ms "
+                f"queries/page={row['queries_per_page']} (max {row['max_queries_per_page']}) "
+                f"same first page as timeline: {row['same_first_page_as_timeline']}/{row['users']}"
+            )
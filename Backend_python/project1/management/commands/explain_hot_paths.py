@@ -0,0 +1,123 @@
+import json
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from project1.graph import social_graph
+from project1.models import Posts
+from project1.seed import seed_dataset
+
+
+def explain(sql):
+    """
+    Run EXPLAIN on one captured query and return (plan lines, full scan tables).
+    SQLite reports "SCAN <table>" without an index for a table scan, MySQL
+    reports access type ALL.
+    """
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+            plan = [row[-1] for row in cursor.fetchall()]
+            full_scans = [
+                line.split()[1] for line in plan
+                if line.startswith('SCAN ') and 'INDEX' not in line
+            ]
+        else:
+            cursor.execute('EXPLAIN ' + sql)
+            columns = [col[0] for col in cursor.description]
+            rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+            plan = [f"{row.get('table')}: type={row.get('type')} key={row.get('key')}" for row in rows]
+            full_scans = [row.get('table') for row in rows if row.get('type') == 'ALL']
+    return plan, full_scans
+
+
+class Command(BaseCommand):
+    help = 'EXPLAIN every query the hot views run and fail if any of them does a full table scan'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=0, metavar='USERS',
+                            help='Seed this many synthetic users first (rolled back afterwards)')
+        parser.add_argument('--json', action='store_true', help='Print the report as JSON')
+
+    def hot_paths(self, viewer, author, post_id):
+        auth = {'HTTP_AUTHORIZATION': f'Bearer {RefreshToken.for_user(viewer).access_token}'}
+        toggle = json.dumps({'username': viewer.username, 'post_id': post_id})
+        # (view, method, url, body, headers, settings overrides)
+        return [
+            ('get_following_feed', 'get', f'/api/follow_feed/{viewer.username}/?limit=20', None, {}, {}),
+            ('get_following_feed (sql engine)', 'get', f'/api/follow_feed/{viewer.username}/?limit=20', None, {},
+             {'FEED_ENGINE': 'sql'}),
+            ('get_user_posts', 'get', f'/api/user_posts/{author.username}/?limit=20', None, {}, {}),
+            ('user_profile', 'get', f'/user_profile/{author.username}/?limit=20', None, auth, {}),
+            ('get_user_info', 'get', f'/api/user/{author.username}/Follows/', None, {}, {}),
+            ('get_user_info', 'get', f'/api/user/{author.username}/Following/', None, {}, {}),
+            ('search_users', 'get', f'/search_users/?query={author.username[:4]}', None, auth, {}),
+            ('search_users', 'get', f'/search_users/?query={author.username[2:6]}', None, auth, {}),
+            # toggled twice so the data ends up where it started
+            ('like_toggle', 'post', '/api/like_unlike/', toggle, {}, {}),
+            ('like_toggle', 'post', '/api/like_unlike/', toggle, {}, {}),
+            ('reyeet_toggle', 'post', '/api/reyeet_unreyeet/', toggle, {}, {}),
+            ('reyeet_toggle', 'post', '/api/reyeet_unreyeet/', toggle, {}, {}),
+        ]
+
+    def handle(self, *args, **options):
+        client = Client(raise_request_exception=False, HTTP_HOST='localhost')
+        report = []
+
+        with transaction.atomic():
+            if options['seed']:
+                seed_dataset(users=options['seed'], prefix='explain_seed')
+
+            author_id = (
+                Posts.objects.values('user_id').annotate(n=Count('post_id'))
+                .order_by('-n').values_list('user_id', flat=True).first()
+            )
+            if author_id is None:
+                raise CommandError('No posts to explain against, use --seed')
+            author = User.objects.get(id=author_id)
+            viewer = User.objects.exclude(id=author_id).first() or author
+            post_id = Posts.objects.filter(user_id=author_id).values_list('post_id', flat=True).first()
+
+            for view, method, url, body, extra, overrides in self.hot_paths(viewer, author, post_id):
+                # explain the cold path too, where the social graph loads from the follows table
+                # and the response cache doesn't answer for the view
+                social_graph.clear()
+                with override_settings(RESPONSE_CACHE_ENABLED=False, **overrides), \
+                        CaptureQueriesContext(connection) as queries:
+                    if method == 'get':
+                        client.get(url, **extra)
+                    else:
+                        client.post(url, body, content_type='application/json', **extra)
+                for query in queries.captured_queries:
+                    sql = query['sql']
+                    if not sql.lstrip().upper().startswith('SELECT'):
+                        continue
+                    plan, full_scans = explain(sql)
+                    report.append({'view': view, 'sql': sql, 'plan': plan, 'full_scans': full_scans})
+
+            if options['seed']:
+                transaction.set_rollback(True)
+        if options['seed']:
+            social_graph.invalidate()
+
+        offenders = [entry for entry in report if entry['full_scans']]
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+        else:
+            for entry in report:
+                marker = 'FULL SCAN' if entry['full_scans'] else 'ok'
+                self.stdout.write(f"[{marker}] {entry['view']}: {entry['sql'][:160]}")
+                for line in entry['plan']:
+                    self.stdout.write(f'    {line}')
+
+        if offenders:
+            raise CommandError(
+                f'{len(offenders)} of {len(report)} queries do a full scan: '
+                + ', '.join(sorted({f"{e['view']} ({', '.join(e['full_scans'])})" for e in offenders}))
+            )
+        self.stdout.write(self.style.SUCCESS(f'{len(report)} queries explained, no full scans'))
@@ -0,0 +1,16 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from project1.profiling import make_token
+
+
+class Command(BaseCommand):
+    help = 'Print a signed header that makes the server profile a request (needs PROFILING_ENABLED)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--label', default='staff', help='Who the token is for, only kept in the signature')
+
+    def handle(self, *args, **options):
+        header = getattr(settings, 'PROFILING_HEADER', 'X-Profile-Request')
+        self.stdout.write(f"{header}: {make_token(options['label'])}")
+        self.stderr.write(f"Valid for {getattr(settings, 'PROFILING_TOKEN_MAX_AGE', 3600)} seconds")
@@ -0,0 +1,30 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from project1.models import IdempotencyKeys
+
+
+class Command(BaseCommand):
+    help = "Delete the batch endpoint's idempotency keys older than IDEMPOTENCY_KEY_MAX_AGE_DAYS"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.IDEMPOTENCY_KEY_MAX_AGE_DAYS,
+                            help='Keep keys younger than this many days')
+        parser.add_argument('--chunk-size', type=int, default=10000)
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        deleted = 0
+        # In chunks by primary key, a big delete would hold its locks for too long
+        while True:
+            ids = list(
+                IdempotencyKeys.objects.filter(created_at__lt=cutoff)
+                .order_by('idempotency_id').values_list('idempotency_id', flat=True)[:options['chunk_size']]
+            )
+            if not ids:
+                break
+            deleted += IdempotencyKeys.objects.filter(idempotency_id__in=ids).delete()[0]
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} idempotency keys older than {options["days"]} days'))
@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from project1.engagement import rebuild_counters
+from project1.models import Posts
+
+
+class Command(BaseCommand):
+    help = 'Recount Posts.like_count / retweet_count from the likes and retweets tables'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000)
+        parser.add_argument('--check', action='store_true',
+                            help="Only report wrong counters, don't fix them (exits 1 if any are wrong)")
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        fix = not options['check']
+        checked = wrong = 0
+        last_id = 0
+
+        # Walk the posts table by primary key so every chunk is a range scan
+        while True:
+            with transaction.atomic():
+                chunk = list(
+                    Posts.objects.filter(post_id__gt=last_id)
+                    .order_by('post_id')
+                    .only('post_id', 'like_count', 'retweet_count', 'counter_shards')[:chunk_size]
+                )
+                if not chunk:
+                    break
+                for post in rebuild_counters(chunk, fix=fix):
+                    wrong += 1
+                    self.stdout.write(f'post {post.post_id}: likes={post.like_count} retweets={post.retweet_count}')
+            checked += len(chunk)
+            last_id = chunk[-1].post_id
+
+        if not fix and wrong:
+            raise CommandError(f'{wrong} of {checked} posts have wrong counters')
+        action = 'fixed' if fix else 'wrong'
+        self.stdout.write(self.style.SUCCESS(f'Checked {checked} posts, {wrong} {action}'))
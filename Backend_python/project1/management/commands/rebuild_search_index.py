@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from project1.search import rebuild_index
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the user_search_terms typeahead index from auth_user'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        total = rebuild_index(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Indexed {total} users'))
@@ -0,0 +1,23 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+
+from project1.timeline import rebuild_timeline
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the materialized home timelines from the follows and posts tables'
+
+    def add_arguments(self, parser):
+        parser.add_argument('usernames', nargs='*', help='Only rebuild these users (default: everyone)')
+
+    def handle(self, *args, **options):
+        users = User.objects.order_by('id')
+        if options['usernames']:
+            users = users.filter(username__in=options['usernames'])
+
+        total = 0
+        for user_id, username in users.values_list('id', 'username').iterator():
+            written = rebuild_timeline(user_id)
+            total += written
+            self.stdout.write(f'{username}: {written} entries')
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt timelines ({total} entries)'))
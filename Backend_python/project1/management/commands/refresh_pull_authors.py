@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from project1.timeline import refresh_pull_authors
+
+
+class Command(BaseCommand):
+    help = (
+        'Recount the accounts over TIMELINE_FANOUT_MAX_FOLLOWERS whose posts are pulled into feeds at read time. '
+        'Follows only ever add to that set, run this from cron to drop the accounts that fell back under the limit.'
+    )
+
+    def handle(self, *args, **options):
+        authors = refresh_pull_authors()
+        self.stdout.write(self.style.SUCCESS(f'{len(authors)} pull path accounts'))
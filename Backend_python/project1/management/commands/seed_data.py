@@ -0,0 +1,56 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from project1.models import FeedbackSurvey, Follows, Likes, Posts, Retweets
+from project1.seed import SCALES, seed_dataset
+
+
+class Command(BaseCommand):
+    help = (
+        'Seed a synthetic social graph (power-law follows, geotagged posts, likes, reyeets and '
+        'feedback surveys) for benchmarking, at a preset --scale or a custom size'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', choices=SCALES, help='Preset size: ' + ', '.join(
+            f"{name} ({preset['users']:,} users)" for name, preset in SCALES.items()
+        ))
+        parser.add_argument('--users', type=int, help='Number of users, overrides the scale')
+        parser.add_argument('--posts-per-user', type=int)
+        parser.add_argument('--follows-per-user', type=int)
+        parser.add_argument('--likes-per-user', type=int)
+        parser.add_argument('--retweets-per-user', type=int)
+        parser.add_argument('--follow-skew', type=float, help='Power-law exponent of who gets followed (default 1.0)')
+        parser.add_argument('--geo-fraction', type=float, help='Share of posts with a location (default 0.3)')
+        parser.add_argument('--feedback-fraction', type=float, help='Share of users with a feedback survey (default 0.05)')
+        parser.add_argument('--prefix', default='seed', help='Seeded usernames are <prefix>0, <prefix>1, ...')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed, the same seed gives the same data')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--no-timelines', action='store_true',
+                            help="Skip building the home_timeline inboxes (rebuild_timelines can do it later)")
+
+    def handle(self, *args, **options):
+        params = dict(SCALES.get(options['scale'], {}))
+        for name in ('users', 'posts_per_user', 'follows_per_user', 'likes_per_user', 'retweets_per_user',
+                     'follow_skew', 'geo_fraction', 'feedback_fraction'):
+            if options[name] is not None:
+                params[name] = options[name]
+        if 'users' not in params:
+            raise CommandError('Give a --scale or a number of --users')
+        if User.objects.filter(username__startswith=options['prefix']).exists():
+            raise CommandError(f"There are already users named {options['prefix']}*, pick another --prefix")
+
+        models = (User, Follows, Posts, Likes, Retweets, FeedbackSurvey)
+        before = {model: model.objects.count() for model in models}
+        started = time.perf_counter()
+        seed_dataset(
+            prefix=options['prefix'], seed=options['seed'], batch_size=options['batch_size'],
+            build_timelines=not options['no_timelines'], **params,
+        )
+        elapsed = time.perf_counter() - started
+
+        for model in models:
+            self.stdout.write(f'{model._meta.db_table}: {model.objects.count() - before[model]:,} rows')
+        self.stdout.write(self.style.SUCCESS(f'Seeded in {elapsed:.1f}s'))
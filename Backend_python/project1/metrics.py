@@ -0,0 +1,238 @@
+import logging
+import threading
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+from . import response_cache
+
+# Per route request metrics, kept in memory by each worker process and
+# rendered in the Prometheus text format by the api/metrics/ endpoint.
+# A route is the resolved URL name (see project1/urls.py).
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 250, 500)
+UNRESOLVED = '<unresolved>'
+
+# The RequestStats of the request being handled. Context variables follow the
+# request into sync_to_async threads, so the async views' queries count too.
+_current = ContextVar('request_stats', default=None)
+
+
+class RequestStats:
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.serialize_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def add_query(self, seconds):
+        with self._lock:
+            self.queries += 1
+            self.db_seconds += seconds
+
+
+def record_queries(execute, sql, params, many, context):
+    stats = _current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.add_query(time.perf_counter() - started)
+
+
+def watch_connection(connection):
+    if record_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_queries)
+
+
+def _watch_new_connection(sender, connection, **kwargs):
+    watch_connection(connection)
+
+
+connection_created.connect(_watch_new_connection, dispatch_uid='project1.metrics')
+
+
+def start_request():
+    # Opened connections are watched as they connect; these were opened before
+    for connection in connections.all(initialized_only=True):
+        watch_connection(connection)
+    stats = RequestStats()
+    return stats, _current.set(stats)
+
+
+def end_request(token):
+    _current.reset(token)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0
+        self.sum = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.total += 1
+        self.sum += value
+
+
+class RouteMetrics:
+    def __init__(self):
+        self.requests = {}    # (method, status) -> count
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.queries = Histogram(QUERY_BUCKETS)
+        self.db_seconds = 0.0
+        self.serialize_seconds = 0.0
+        self.response_bytes = 0
+        self.over_budget = 0
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._routes = {}
+        self._lock = threading.Lock()
+
+    def _route(self, route):
+        metrics = self._routes.get(route)
+        if metrics is None:
+            metrics = self._routes[route] = RouteMetrics()
+        return metrics
+
+    def record(self, route, method, status, seconds, stats, response_bytes, over_budget):
+        with self._lock:
+            metrics = self._route(route)
+            metrics.requests[method, status] = metrics.requests.get((method, status), 0) + 1
+            metrics.latency.observe(seconds)
+            metrics.queries.observe(stats.queries)
+            metrics.db_seconds += stats.db_seconds
+            metrics.serialize_seconds += stats.serialize_seconds
+            metrics.response_bytes += response_bytes
+            metrics.over_budget += over_budget
+
+    def add_bytes(self, route, response_bytes):
+        # Streamed bodies are only counted once they've been sent
+        with self._lock:
+            self._route(route).response_bytes += response_bytes
+
+    def snapshot(self):
+        with self._lock:
+            return {route: _copy(metrics) for route, metrics in self._routes.items()}
+
+    def clear(self):
+        with self._lock:
+            self._routes.clear()
+
+
+def _copy(metrics):
+    copy = RouteMetrics()
+    copy.requests = dict(metrics.requests)
+    for name in ('latency', 'queries'):
+        histogram, copied = getattr(metrics, name), getattr(copy, name)
+        copied.counts, copied.total, copied.sum = list(histogram.counts), histogram.total, histogram.sum
+    copy.db_seconds = metrics.db_seconds
+    copy.serialize_seconds = metrics.serialize_seconds
+    copy.response_bytes = metrics.response_bytes
+    copy.over_budget = metrics.over_budget
+    return copy
+
+
+registry = MetricsRegistry()
+
+
+def query_budget(route):
+    # QUERY_BUDGETS maps route names to the most queries one request may run
+    return getattr(settings, 'QUERY_BUDGETS', {}).get(route, getattr(settings, 'QUERY_BUDGET_DEFAULT', None))
+
+
+def check_budget(route, request, status, seconds, stats):
+    budget = query_budget(route)
+    if budget is None or stats.queries <= budget:
+        return False
+    details = {
+        'route': route,
+        'method': request.method,
+        'path': request.path,
+        'status': status,
+        'queries': stats.queries,
+        'budget': budget,
+        'db_ms': round(stats.db_seconds * 1000, 2),
+        'duration_ms': round(seconds * 1000, 2),
+    }
+    logger.warning(
+        'Query budget exceeded: %(route)s ran %(queries)d queries, budget %(budget)d',
+        details, extra={'query_budget': details},
+    )
+    return True
+
+
+def _labels(**labels):
+    def escape(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join(f'{name}="{escape(value)}"' for name, value in labels.items()) + '}'
+
+
+def _number(value):
+    return repr(round(value, 6)) if isinstance(value, float) else str(value)
+
+
+def _histogram_lines(name, route, histogram):
+    for bound, count in zip(histogram.buckets, histogram.counts):
+        yield f'{name}_bucket{_labels(route=route, le=bound)} {count}'
+    yield f'{name}_bucket{_labels(route=route, le="+Inf")} {histogram.total}'
+    yield f'{name}_sum{_labels(route=route)} {_number(histogram.sum)}'
+    yield f'{name}_count{_labels(route=route)} {histogram.total}'
+
+
+def render_prometheus():
+    """
+    Everything recorded by this process, plus the response cache hit and
+    miss counters, as Prometheus text exposition format.
+    """
+    routes = sorted(registry.snapshot().items())
+    lines = []
+
+    def family(name, kind, help_text, samples):
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        lines.extend(samples)
+
+    family('http_requests_total', 'counter', 'Requests handled, by route, method and status.', [
+        f'http_requests_total{_labels(route=route, method=method, status=status)} {count}'
+        for route, metrics in routes for (method, status), count in sorted(metrics.requests.items())
+    ])
+    family('http_request_duration_seconds', 'histogram', 'Time to build the response.', [
+        line for route, metrics in routes
+        for line in _histogram_lines('http_request_duration_seconds', route, metrics.latency)
+    ])
+    family('http_request_db_queries', 'histogram', 'Database queries per request.', [
+        line for route, metrics in routes
+        for line in _histogram_lines('http_request_db_queries', route, metrics.queries)
+    ])
+    for name, attr, help_text in (
+        ('http_request_db_seconds_total', 'db_seconds', 'Time spent in database queries.'),
+        ('http_request_serialize_seconds_total', 'serialize_seconds', 'Time spent rendering DRF response bodies.'),
+        ('http_response_bytes_total', 'response_bytes', 'Response body bytes sent.'),
+        ('http_request_query_budget_exceeded_total', 'over_budget', 'Requests that ran more queries than QUERY_BUDGETS allows.'),
+    ):
+        family(name, 'counter', help_text, [
+            f'{name}{_labels(route=route)} {_number(getattr(metrics, attr))}' for route, metrics in routes
+        ])
+
+    cache_stats = sorted(response_cache.stats().items())
+    for outcome in ('hits', 'misses'):
+        name = f'response_cache_{outcome}_total'
+        family(name, 'counter', f'Response cache {outcome}, by cached view.', [
+            f'{name}{_labels(view=view)} {counts[outcome]}' for view, counts in cache_stats
+        ])
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,203 @@
+import random
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from whitenoise.middleware import WhiteNoiseMiddleware
+
+from . import metrics, profiling, slow_queries
+
+
+def route_name(request):
+    # The URL name the request resolved to, or the view's dotted path if it has none
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return metrics.UNRESOLVED
+    return match.view_name or match._func_path
+
+
+class MetricsMiddleware:
+    """
+    Records query count, database time, render time, latency and response
+    size of every request under its route, and logs a warning when a route
+    runs more queries than its QUERY_BUDGETS entry. Goes first in MIDDLEWARE
+    so the latency covers the other middleware too. Sync and async, so it
+    doesn't push the async views under ASGI onto a thread.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'METRICS_ENABLED', True):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        stats, token = metrics.start_request()
+        request._metrics_stats = stats
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            metrics.end_request(token)
+        return self.record(request, response, stats, started)
+
+    async def __acall__(self, request):
+        stats, token = metrics.start_request()
+        request._metrics_stats = stats
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            metrics.end_request(token)
+        return self.record(request, response, stats, started)
+
+    def record(self, request, response, stats, started):
+        seconds = time.perf_counter() - started
+
+        route = route_name(request)
+        # A streamed listing runs most of its queries while the body goes out,
+        # after this; only its bytes are counted then
+        if response.streaming and not response.is_async:
+            response.streaming_content = self._count_streamed(route, response.streaming_content)
+            response_bytes = 0
+        else:
+            response_bytes = 0 if response.streaming else len(response.content)
+        over_budget = metrics.check_budget(route, request, response.status_code, seconds, stats)
+        metrics.registry.record(
+            route, request.method, response.status_code, seconds, stats, response_bytes, over_budget,
+        )
+        return response
+
+    def process_template_response(self, request, response):
+        # DRF responses are rendered right after this, time it with a callback
+        stats = getattr(request, '_metrics_stats', None)
+        if stats is not None:
+            started = time.perf_counter()
+
+            def rendered(response):
+                stats.serialize_seconds += time.perf_counter() - started
+
+            response.add_post_render_callback(rendered)
+        return response
+
+    @staticmethod
+    def _count_streamed(route, content):
+        sent = 0
+        try:
+            for chunk in content:
+                sent += len(chunk)
+                yield chunk
+        finally:
+            metrics.registry.add_bytes(route, sent)
+
+
+class SlowQueryMiddleware:
+    """
+    Times every query of the request and hands the slow and the repeated
+    ones to the slow query log (project1/slow_queries.py) when the request
+    is done. Off with SLOW_QUERY_LOG_ENABLED. Sync and async like
+    MetricsMiddleware.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'SLOW_QUERY_LOG_ENABLED', True):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = slow_queries.start_request(request)
+        try:
+            return self.get_response(request)
+        finally:
+            slow_queries.finish_request(token, route_name(request))
+
+    async def __acall__(self, request):
+        token = slow_queries.start_request(request)
+        try:
+            return await self.get_response(request)
+        finally:
+            offenders = slow_queries.end_request(token)
+            # Only a request with offenders goes to a thread, for the EXPLAIN
+            if offenders:
+                await sync_to_async(slow_queries.log_offenders)(offenders, route_name(request))
+
+
+class StaticFilesMiddleware(WhiteNoiseMiddleware):
+    """
+    WhiteNoiseMiddleware, which is sync only, made async capable too. Any
+    sync only middleware in MIDDLEWARE puts every ASGI request on a thread
+    of its own, async views or not.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response=None):
+        super().__init__(get_response)
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def static_file(self, request):
+        if self.autorefresh:
+            return self.find_file(request.path_info)
+        return self.files.get(request.path_info)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        static_file = self.static_file(request)
+        if static_file is not None:
+            return self.serve(static_file, request)
+        return await self.get_response(request)
+
+
+class ProfilingMiddleware:
+    """
+    Profiles a request when it carries a valid signed PROFILING_HEADER
+    (see the profiling_token command) or falls in PROFILING_SAMPLE_RATE,
+    and stores the profile for the api/profiles/ endpoints. Goes last in
+    MIDDLEWARE so it wraps the view. With PROFILING_ENABLED off it takes
+    itself out of the middleware chain, so it costs nothing. Sync only
+    (cProfile follows one thread), so with it on ASGI requests run on
+    threads.
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'PROFILING_ENABLED', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def reason(self, request):
+        token = request.headers.get(getattr(settings, 'PROFILING_HEADER', 'X-Profile-Request'))
+        if token and profiling.valid_token(token):
+            return 'header'
+        rate = getattr(settings, 'PROFILING_SAMPLE_RATE', 0.0)
+        if rate and random.random() < rate:
+            return 'sample'
+        return None
+
+    def __call__(self, request):
+        reason = self.reason(request)
+        if reason is None:
+            return self.get_response(request)
+        with profiling.RequestProfile() as profile:
+            response = self.get_response(request)
+        response['X-Profile-Id'] = profiling.save_profile(profile, request, response, route_name(request), reason)
+        return response
@@ -0,0 +1,30 @@
+# Generated by Django 5.1.6 on 2026-10-18 07:20
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('project1', '0005_alter_follows_options_alter_likes_options_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HomeTimeline',
+            fields=[
+                ('timeline_id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('created_at', models.DateTimeField()),
+                ('author', models.ForeignKey(on_delete=django.db.models.deletion.DO_NOTHING, related_name='timeline_authored', to='project1.authuser')),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.DO_NOTHING, to='project1.posts')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.DO_NOTHING, related_name='home_timeline', to='project1.authuser')),
+            ],
+            options={
+                'db_table': 'home_timeline',
+                'managed': True,
+                'indexes': [models.Index(fields=['user', '-created_at', '-post'], name='home_timeline_user_recent'), models.Index(fields=['user', 'author'], name='home_timeline_user_author')],
+                'unique_together': {('user', 'post')},
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.6 on 2026-10-18 08:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('project1', '0006_hometimeline'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='posts',
+            name='like_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='posts',
+            name='retweet_count',
+            field=models.IntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,155 @@
+# Generated by Django 5.1.6 on 2026-10-18 08:30
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def remove_duplicate_engagement(apps, schema_editor):
+    # The new unique constraints can't be added while double likes/retweets
+    # exist, so keep the oldest row of each (post, user) pair and recount.
+    Posts = apps.get_model('project1', 'Posts')
+    for model_name, pk_name, counter in (('Likes', 'like_id', 'like_count'),
+                                         ('Retweets', 'retweet_id', 'retweet_count')):
+        model = apps.get_model('project1', model_name)
+        duplicates = (
+            model.objects.values('post_id', 'user_id')
+            .annotate(rows=Count(pk_name), keep=Min(pk_name))
+            .filter(rows__gt=1)
+        )
+        for dup in duplicates:
+            model.objects.filter(post_id=dup['post_id'], user_id=dup['user_id']).exclude(
+                **{pk_name: dup['keep']}
+            ).delete()
+            Posts.objects.filter(post_id=dup['post_id']).update(
+                **{counter: model.objects.filter(post_id=dup['post_id']).count()}
+            )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('project1', '0007_posts_like_count_posts_retweet_count'),
+    ]
+
+    operations = [
+        # These tables and columns already exist in the MySQL schema but were
+        # never recorded in the migration state. Catch the state up only.
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name='FeedbackSurvey',
+                    fields=[
+                        ('feedback_id', models.AutoField(primary_key=True, serialize=False)),
+                        ('likes_app', models.BooleanField(default=False)),
+                        ('selected_reasons', models.JSONField(blank=True, null=True)),
+                        ('created_at', models.DateTimeField(auto_now_add=True, null=True)),
+                    ],
+                    options={
+                        'db_table': 'feedback_survey',
+                        'managed': True,
+                    },
+                ),
+                migrations.CreateModel(
+                    name='ProfilePics',
+                    fields=[
+                        ('photo_id', models.AutoField(primary_key=True, serialize=False)),
+                        ('photo_path', models.TextField()),
+                    ],
+                    options={
+                        'db_table': 'profile_pics',
+                        'managed': True,
+                    },
+                ),
+                migrations.AddField(
+                    model_name='follows',
+                    name='following_user',
+                    field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='follows_following_user_set', to='project1.authuser'),
+                ),
+                migrations.AddField(
+                    model_name='likes',
+                    name='post',
+                    field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.DO_NOTHING, to='project1.posts'),
+                ),
+                migrations.AddField(
+                    model_name='likes',
+                    name='user',
+                    field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.DO_NOTHING, to='project1.authuser'),
+                ),
+                migrations.AddField(
+                    model_name='retweets',
+                    name='post',
+                    field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.DO_NOTHING, to='project1.posts'),
+                ),
+                migrations.AddField(
+                    model_name='retweets',
+                    name='user',
+                    field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.DO_NOTHING, to='project1.authuser'),
+                ),
+                migrations.AlterField(
+                    model_name='follows',
+                    name='created_at',
+                    field=models.DateTimeField(auto_now_add=True, null=True),
+                ),
+                migrations.AlterField(
+                    model_name='follows',
+                    name='user',
+                    field=models.OneToOneField(on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, serialize=False, to='project1.authuser'),
+                ),
+                migrations.AlterField(
+                    model_name='likes',
+                    name='created_at',
+                    field=models.DateTimeField(auto_now_add=True, null=True),
+                ),
+                migrations.AlterField(
+                    model_name='posts',
+                    name='created_at',
+                    field=models.DateTimeField(auto_now_add=True, null=True),
+                ),
+                migrations.AlterField(
+                    model_name='retweets',
+                    name='retweet_timestamp',
+                    field=models.DateTimeField(auto_now_add=True, null=True),
+                ),
+                migrations.AlterUniqueTogether(
+                    name='follows',
+                    unique_together={('user', 'following_user')},
+                ),
+                migrations.AddField(
+                    model_name='feedbacksurvey',
+                    name='user',
+                    field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.DO_NOTHING, to='project1.authuser'),
+                ),
+                migrations.AddField(
+                    model_name='profilepics',
+                    name='user',
+                    field=models.ForeignKey(on_delete=django.db.models.deletion.DO_NOTHING, to='project1.authuser'),
+                ),
+                ],
+        ),
+        migrations.RunPython(remove_duplicate_engagement, reverse_code=migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='follows',
+            index=models.Index(fields=['following_user', 'user'], name='follows_followed_user'),
+        ),
+        migrations.AddIndex(
+            model_name='likes',
+            index=models.Index(fields=['user', 'created_at'], name='likes_user_recent'),
+        ),
+        migrations.AddIndex(
+            model_name='posts',
+            index=models.Index(fields=['user', 'created_at', 'post_id'], name='posts_user_recent'),
+        ),
+        migrations.AddIndex(
+            model_name='retweets',
+            index=models.Index(fields=['user', 'retweet_timestamp'], name='retweets_user_recent'),
+        ),
+        migrations.AddConstraint(
+            model_name='likes',
+            constraint=models.UniqueConstraint(fields=('post', 'user'), name='likes_post_user_uniq'),
+        ),
+        migrations.AddConstraint(
+            model_name='retweets',
+            constraint=models.UniqueConstraint(fields=('post', 'user'), name='retweets_post_user_uniq'),
+        ),
+    ]
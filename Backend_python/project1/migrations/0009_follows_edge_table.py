@@ -0,0 +1,64 @@
+# Generated by Django 5.1.6 on 2026-10-18 09:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def copy_follow_edges(apps, schema_editor):
+    # Move every edge out of the old table, dropping rows with no
+    # following_user and any duplicates the old key let through.
+    FollowsLegacy = apps.get_model('project1', 'FollowsLegacy')
+    Follows = apps.get_model('project1', 'Follows')
+    # keep the original follow times instead of stamping them all with now()
+    Follows._meta.get_field('created_at').auto_now_add = False
+    edges = (
+        FollowsLegacy.objects.filter(following_user__isnull=False)
+        .values_list('user_id', 'following_user_id', 'created_at')
+        .iterator(chunk_size=5000)
+    )
+    batch = []
+    for user_id, following_user_id, created_at in edges:
+        batch.append(Follows(user_id=user_id, following_user_id=following_user_id, created_at=created_at))
+        if len(batch) == 5000:
+            Follows.objects.bulk_create(batch, ignore_conflicts=True)
+            batch = []
+    Follows.objects.bulk_create(batch, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('project1', '0008_hot_path_indexes'),
+    ]
+
+    operations = [
+        # The old follows table keyed every row on user_id alone. Move it out
+        # of the way, build the real edge table, copy the rows over, drop the old one.
+        migrations.AlterModelTable(
+            name='follows',
+            table='follows_legacy',
+        ),
+        migrations.RenameModel(
+            old_name='Follows',
+            new_name='FollowsLegacy',
+        ),
+        migrations.CreateModel(
+            name='Follows',
+            fields=[
+                ('follow_id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True, null=True)),
+                ('following_user', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='follower_edges', to='project1.authuser')),
+                ('user', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='following_edges', to='project1.authuser')),
+            ],
+            options={
+                'db_table': 'follows',
+                'managed': True,
+                'indexes': [models.Index(fields=['following_user', 'user'], name='follows_edge_followed')],
+                'constraints': [models.UniqueConstraint(fields=('user', 'following_user'), name='follows_edge_uniq')],
+            },
+        ),
+        migrations.RunPython(copy_follow_edges, reverse_code=migrations.RunPython.noop),
+        migrations.DeleteModel(
+            name='FollowsLegacy',
+        ),
+    ]
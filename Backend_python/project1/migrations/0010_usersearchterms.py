@@ -0,0 +1,37 @@
+# Generated by Django 5.1.6 on 2026-10-18 11:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def build_search_index(apps, schema_editor):
+    from project1.search import rebuild_index
+    rebuild_index(
+        user_model=apps.get_model('project1', 'AuthUser'),
+        model=apps.get_model('project1', 'UserSearchTerms'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('project1', '0009_follows_edge_table'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserSearchTerms',
+            fields=[
+                ('term_id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('term', models.CharField(max_length=32)),
+                ('kind', models.SmallIntegerField()),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.DO_NOTHING, related_name='search_terms', to='project1.authuser')),
+            ],
+            options={
+                'db_table': 'user_search_terms',
+                'managed': True,
+                'indexes': [models.Index(fields=['kind', 'term'], name='user_search_kind_term')],
+            },
+        ),
+        migrations.RunPython(build_search_index, reverse_code=migrations.RunPython.noop),
+    ]
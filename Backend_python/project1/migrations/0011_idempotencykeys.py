@@ -0,0 +1,30 @@
+# Generated by Django 5.1.6 on 2026-10-18 14:20
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('project1', '0010_usersearchterms'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IdempotencyKeys',
+            fields=[
+                ('idempotency_id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('key', models.CharField(max_length=64)),
+                ('result', models.JSONField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='idempotency_keys', to='project1.authuser')),
+            ],
+            options={
+                'db_table': 'idempotency_keys',
+                'managed': True,
+                'indexes': [models.Index(fields=['created_at'], name='idempotency_created')],
+                'constraints': [models.UniqueConstraint(fields=('user', 'key'), name='idempotency_user_key_uniq')],
+            },
+        ),
+    ]
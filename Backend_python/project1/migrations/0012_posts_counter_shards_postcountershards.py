@@ -0,0 +1,34 @@
+# Generated by Django 5.1.6 on 2026-10-18 16:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('project1', '0011_idempotencykeys'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='posts',
+            name='counter_shards',
+            field=models.SmallIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='PostCounterShards',
+            fields=[
+                ('shard_id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('shard', models.SmallIntegerField()),
+                ('like_count', models.IntegerField(default=0)),
+                ('retweet_count', models.IntegerField(default=0)),
+                ('post', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='counter_shard_rows', to='project1.posts')),
+            ],
+            options={
+                'db_table': 'post_counter_shards',
+                'managed': True,
+                'constraints': [models.UniqueConstraint(fields=('post', 'shard'), name='counter_shard_post_shard_uniq')],
+            },
+        ),
+    ]
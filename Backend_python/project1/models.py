@@ -132,14 +132,23 @@ class ProfilePics(models.Model):
         db_table = 'profile_pics'
 
 class Follows(models.Model):
-    user = models.OneToOneField('AuthUser', models.DO_NOTHING, primary_key=True)  # The composite primary key (user_id, following_user_id) found, that is not supported. The first column is selected.
-    following_user = models.ForeignKey('AuthUser', models.DO_NOTHING, related_name='follows_following_user_set', null=True)
+    # One row per follow edge: `user` follows `following_user`
+    follow_id = models.BigAutoField(primary_key=True)
+    user = models.ForeignKey('AuthUser', models.DO_NOTHING, related_name='following_edges', db_index=False)
+    following_user = models.ForeignKey('AuthUser', models.DO_NOTHING, related_name='follower_edges', db_index=False)
     created_at = models.DateTimeField(auto_now_add=True, null=True, blank=True)
 
     class Meta:
         managed = True
         db_table = 'follows'
-        unique_together = (('user', 'following_user'), ('user', 'following_user'),)
+        constraints = [
+            # Also the index for "who does X follow" (user_id first)
+            models.UniqueConstraint(fields=['user', 'following_user'], name='follows_edge_uniq'),
+        ]
+        indexes = [
+            # "who follows X" lookups, covering so they never touch the table
+            models.Index(fields=['following_user', 'user'], name='follows_edge_followed'),
+        ]
 
 
 class Likes(models.Model):
@@ -151,6 +160,13 @@ class Likes(models.Model):
     class Meta:
         managed = True
         db_table = 'likes'
+        constraints = [
+            # One like per user per post. Also serves the per-post lookups.
+            models.UniqueConstraint(fields=['post', 'user'], name='likes_post_user_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['user', 'created_at'], name='likes_user_recent'),
+        ]
 
 
 class Posts(models.Model):
@@ -163,11 +179,37 @@ class Posts(models.Model):
     latitude = models.FloatField(null=True, blank=True)
     longitude = models.FloatField(null=True, blank=True)
     location_name = models.CharField(max_length=100, null=True, blank=True)
+    # Kept in step with the likes/retweets tables by the toggle endpoints
+    like_count = models.IntegerField(default=0)
+    retweet_count = models.IntegerField(default=0)
+    # Rows in post_counter_shards once the post is hot, 0 while the two columns above hold the whole count
+    counter_shards = models.SmallIntegerField(default=0)
 
 
     class Meta:
         managed = True
         db_table = 'posts'
+        indexes = [
+            # A user's posts newest first, and the keyset pagination seek
+            models.Index(fields=['user', 'created_at', 'post_id'], name='posts_user_recent'),
+        ]
+
+
+class PostCounterShards(models.Model):
+    # A slice of a hot post's like/retweet counts, see project1/counters.py
+    shard_id = models.BigAutoField(primary_key=True)
+    post = models.ForeignKey(Posts, models.DO_NOTHING, related_name='counter_shard_rows', db_index=False)
+    shard = models.SmallIntegerField()
+    like_count = models.IntegerField(default=0)
+    retweet_count = models.IntegerField(default=0)
+
+    class Meta:
+        managed = True
+        db_table = 'post_counter_shards'
+        constraints = [
+            # Also the index the writes and the summing read go through
+            models.UniqueConstraint(fields=['post', 'shard'], name='counter_shard_post_shard_uniq'),
+        ]
 
 
 class Project1User(models.Model):
@@ -189,6 +231,75 @@ class Retweets(models.Model):
     class Meta:
         managed = True
         db_table = 'retweets'
+        constraints = [
+            models.UniqueConstraint(fields=['post', 'user'], name='retweets_post_user_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['user', 'retweet_timestamp'], name='retweets_user_recent'),
+        ]
+
+
+# Materialized home timeline. Each row is one post sitting in one user's inbox,
+# written when the post is yeeted (fan-out on write) so the feed is a range scan.
+class HomeTimeline(models.Model):
+    timeline_id = models.BigAutoField(primary_key=True)
+    user = models.ForeignKey('AuthUser', models.DO_NOTHING, related_name='home_timeline')
+    post = models.ForeignKey(Posts, models.DO_NOTHING)
+    author = models.ForeignKey('AuthUser', models.DO_NOTHING, related_name='timeline_authored')
+    created_at = models.DateTimeField()
+
+    class Meta:
+        managed = True
+        db_table = 'home_timeline'
+        unique_together = (('user', 'post'),)
+        indexes = [
+            models.Index(fields=['user', '-created_at', '-post'], name='home_timeline_user_recent'),
+            models.Index(fields=['user', 'author'], name='home_timeline_user_author'),
+        ]
+
+
+class UserSearchTerms(models.Model):
+    # Typeahead index for search_users, one row per searchable prefix of a user
+    TERM_LENGTH = 32
+    USERNAME = 0    # the username itself
+    NAME = 1        # a word of first_name / last_name
+    INSIDE = 2      # a suffix starting inside the username, for substring matches
+
+    term_id = models.BigAutoField(primary_key=True)
+    user = models.ForeignKey('AuthUser', models.DO_NOTHING, related_name='search_terms')
+    term = models.CharField(max_length=TERM_LENGTH)
+    kind = models.SmallIntegerField()
+
+    class Meta:
+        managed = True
+        db_table = 'user_search_terms'
+        indexes = [
+            # term LIKE 'q%' within one kind is a range scan
+            models.Index(fields=['kind', 'term'], name='user_search_kind_term'),
+        ]
+
+
+class IdempotencyKeys(models.Model):
+    # One per mutation the batch endpoint applied, so a client replaying its queue gets the same result back
+    KEY_LENGTH = 64
+
+    idempotency_id = models.BigAutoField(primary_key=True)
+    user = models.ForeignKey('AuthUser', models.DO_NOTHING, related_name='idempotency_keys', db_index=False)
+    key = models.CharField(max_length=KEY_LENGTH)
+    result = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        managed = True
+        db_table = 'idempotency_keys'
+        constraints = [
+            # Also the index for looking a batch's keys up
+            models.UniqueConstraint(fields=['user', 'key'], name='idempotency_user_key_uniq'),
+        ]
+        indexes = [
+            # prune_idempotency_keys deletes by age
+            models.Index(fields=['created_at'], name='idempotency_created'),
+        ]
 
 
 class Users(models.Model):
@@ -0,0 +1,81 @@
+import base64
+from datetime import datetime
+
+from django.conf import settings
+from django.db.models import Q
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(created_at, post_id):
+    # Opaque to the client, it's just "<timestamp>|<post_id>" in base64
+    raw = f'{created_at.isoformat()}|{post_id}'
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        created_at, post_id = base64.urlsafe_b64decode(padded.encode()).decode().split('|')
+        return datetime.fromisoformat(created_at), int(post_id)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise InvalidCursor('Invalid cursor') from e
+
+
+def encode_pk_cursor(pk):
+    # For listings walked in primary key order
+    return base64.urlsafe_b64encode(str(pk).encode()).decode().rstrip('=')
+
+
+def decode_pk_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        return int(base64.urlsafe_b64decode(padded.encode()).decode())
+    except (ValueError, UnicodeDecodeError) as e:
+        raise InvalidCursor('Invalid cursor') from e
+
+
+def get_page_params(request, decode=decode_cursor):
+    """
+    Read ?limit= and ?cursor= off the request. Returns None when the client
+    didn't ask for a page (old clients still get the whole list), otherwise
+    (limit, cursor) where cursor is None for the first page.
+    """
+    if 'limit' not in request.GET and 'cursor' not in request.GET:
+        return None
+
+    try:
+        limit = int(request.GET.get('limit', settings.PAGE_SIZE_DEFAULT))
+    except ValueError:
+        raise InvalidCursor('limit must be a number')
+    limit = max(1, min(limit, settings.PAGE_SIZE_MAX))
+
+    cursor = request.GET.get('cursor')
+    return limit, decode(cursor) if cursor else None
+
+
+def keyset_filter(queryset, cursor, time_field='created_at', id_field='post_id'):
+    # Newest first, continuing after the cursor. Seeks on (time, id) instead of using OFFSET.
+    queryset = queryset.order_by(f'-{time_field}', f'-{id_field}')
+    if cursor is None:
+        return queryset
+    created_at, row_id = cursor
+    return queryset.filter(
+        Q(**{f'{time_field}__lt': created_at}) |
+        Q(**{time_field: created_at, f'{id_field}__lt': row_id})
+    )
+
+
+def split_page(items, limit, time_attr='created_at', id_attr='post_id'):
+    """
+    Takes up to limit + 1 rows and returns (page, next_cursor). The extra row
+    only tells us whether there is another page.
+    """
+    items = list(items)
+    if len(items) <= limit:
+        return items, None
+    page = items[:limit]
+    last = page[-1]
+    return page, encode_cursor(getattr(last, time_attr), getattr(last, id_attr))
@@ -0,0 +1,91 @@
+from .engagement import hydrate_engagement, serialize_posts
+from .graph import social_graph
+from .models import Likes, Posts, Retweets
+from .pagination import keyset_filter, split_page
+from .response_cache import post_deps
+from .users import user_directory
+
+# The sections of a user_profile response. None of them depends on another,
+# so the async view runs them at the same time; the sync view runs them in turn.
+
+
+def follow_state(profile_user_id, viewer_id=None):
+    # Follow state and counts come out of the in-memory social graph
+    return {
+        'is_following': viewer_id is not None and social_graph.is_following(viewer_id, profile_user_id),
+        'followers_count': social_graph.follower_count(profile_user_id),
+        'following_count': social_graph.following_count(profile_user_id),
+    }
+
+
+def _user_posts(profile_user_id):
+    return Posts.objects.filter(user_id=profile_user_id).select_related('user').order_by('-created_at', '-post_id')
+
+
+def posts_page(profile_user_id, page=None):
+    # The user's posts, one page at a time if the client asked for it
+    posts = _user_posts(profile_user_id)
+    if not page:
+        return list(posts), None
+    limit, cursor = page
+    return split_page(keyset_filter(posts, cursor)[:limit + 1], limit)
+
+
+def posts_count(profile_user_id):
+    return _user_posts(profile_user_id).count()
+
+
+def liked_posts(profile_user_id):
+    likes = Likes.objects.filter(user_id=profile_user_id, post__isnull=False).select_related('post__user')
+    return [like.post for like in likes]
+
+
+def retweeted_posts(profile_user_id):
+    retweets = Retweets.objects.filter(user_id=profile_user_id, post__isnull=False).select_related('post__user')
+    return [retweet.post for retweet in retweets]
+
+
+def picture(profile_user_id):
+    user = user_directory.get(profile_user_id)
+    return user['picture'] if user else ''
+
+
+def assemble_profile(profile_user, viewer_id, follow, posts, next_cursor, count, liked, retweeted, pic):
+    """
+    Put the sections together into the response body. Returns (data, deps)
+    for the response cache.
+    """
+    # Like/retweet data for all three lists in one go
+    listed_posts = posts + liked + retweeted
+    engagement = hydrate_engagement([post.post_id for post in listed_posts], viewer_id, listed_posts)
+    posts_data = serialize_posts(posts, viewer_id, engagement)
+    liked_posts_data = serialize_posts(liked, viewer_id, engagement)
+    retweeted_posts_data = serialize_posts(retweeted, viewer_id, engagement)
+
+    profile_data = {
+        'id': profile_user.id,
+        'username': profile_user.username,
+        'first_name': profile_user.first_name,
+        'last_name': profile_user.last_name,
+        'email': profile_user.email,
+        'picture': pic,
+        'date_joined': profile_user.date_joined,
+        **follow,
+        'posts_count': count,
+        'posts': posts_data,
+        'next_cursor': next_cursor,
+        'liked_posts': liked_posts_data,
+        'retweeted_posts': retweeted_posts_data,
+    }
+    return profile_data, post_deps(posts_data + liked_posts_data + retweeted_posts_data)
+
+
+def build_profile(profile_user, viewer_id=None, page=None):
+    posts, next_cursor = posts_page(profile_user.id, page)
+    # Liked and retweeted lists are only shown to signed in users
+    liked = liked_posts(profile_user.id) if viewer_id is not None else []
+    retweeted = retweeted_posts(profile_user.id) if viewer_id is not None else []
+    return assemble_profile(
+        profile_user, viewer_id, follow_state(profile_user.id, viewer_id), posts, next_cursor,
+        posts_count(profile_user.id), liked, retweeted, picture(profile_user.id),
+    )
@@ -0,0 +1,159 @@
+import cProfile
+import io
+import json
+import pstats
+import re
+import threading
+import time
+import uuid
+from contextlib import ExitStack
+from pathlib import Path
+
+from django.conf import settings
+from django.core import signing
+from django.db import connections
+from django.utils import timezone
+
+# On-demand profiles of single requests. A request is profiled when it
+# carries a signed PROFILING_HEADER or falls in PROFILING_SAMPLE_RATE. Each
+# profile is a cProfile dump (<id>.prof, opens in snakeviz/pstats) plus the
+# request's SQL timeline (<id>.json), kept in PROFILING_DIR, newest
+# PROFILING_MAX_FILES only.
+
+TOKEN_SALT = 'project1.profiling'
+PROFILE_ID = re.compile(r'^[0-9]{8}T[0-9]{12}-[0-9a-f]{8}$')
+
+# cProfile can only run in one thread at a time; other requests skip profiling meanwhile
+_profiler_lock = threading.Lock()
+
+
+def make_token(label='staff'):
+    # Value for the profiling header, valid for PROFILING_TOKEN_MAX_AGE seconds
+    return signing.TimestampSigner(salt=TOKEN_SALT).sign(label)
+
+
+def valid_token(token):
+    try:
+        signing.TimestampSigner(salt=TOKEN_SALT).unsign(
+            token, max_age=getattr(settings, 'PROFILING_TOKEN_MAX_AGE', 3600),
+        )
+    except signing.BadSignature:
+        return False
+    return True
+
+
+def profile_dir():
+    return Path(getattr(settings, 'PROFILING_DIR', settings.BASE_DIR / 'profiles'))
+
+
+class SQLTimeline:
+    # Every query of the request with when it started and how long it took, in ms
+    def __init__(self, started):
+        self.started = started
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append({
+                'alias': context['connection'].alias,
+                'start_ms': round((started - self.started) * 1000, 3),
+                'duration_ms': round((time.perf_counter() - started) * 1000, 3),
+                'sql': sql,
+                'many': many,
+            })
+
+
+class RequestProfile:
+    """
+    Context manager that profiles the code inside it and records its SQL.
+    Leaves .profiler as None when another thread was already profiling.
+    """
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        self.timeline = SQLTimeline(self.started)
+        self._stack = ExitStack()
+        for connection in connections.all():
+            self._stack.enter_context(connection.execute_wrapper(self.timeline))
+        self.profiler = cProfile.Profile() if _profiler_lock.acquire(blocking=False) else None
+        if self.profiler is not None:
+            self.profiler.enable()
+        return self
+
+    def __exit__(self, *exc):
+        if self.profiler is not None:
+            self.profiler.disable()
+            _profiler_lock.release()
+        self.duration_ms = round((time.perf_counter() - self.started) * 1000, 3)
+        self._stack.close()
+
+
+def top_functions(source, limit=40):
+    # pstats text report of a profiler or a .prof file, by cumulative time
+    out = io.StringIO()
+    stats = pstats.Stats(str(source) if isinstance(source, Path) else source, stream=out)
+    stats.sort_stats('cumulative').print_stats(limit)
+    return out.getvalue()
+
+
+def save_profile(profile, request, response, route, reason):
+    """
+    Write a finished RequestProfile to the store and drop the oldest ones
+    over PROFILING_MAX_FILES. Returns the profile id.
+    """
+    directory = profile_dir()
+    directory.mkdir(parents=True, exist_ok=True)
+    now = timezone.now()
+    profile_id = f"{now:%Y%m%dT%H%M%S%f}-{uuid.uuid4().hex[:8]}"
+    meta = {
+        'id': profile_id,
+        'created_at': now.isoformat(),
+        'route': route,
+        'method': request.method,
+        'path': request.get_full_path(),
+        'status': response.status_code,
+        'reason': reason,
+        'duration_ms': profile.duration_ms,
+        'query_count': len(profile.timeline.queries),
+        'db_ms': round(sum(query['duration_ms'] for query in profile.timeline.queries), 3),
+        'has_profile': profile.profiler is not None,
+        'queries': profile.timeline.queries,
+    }
+    if profile.profiler is not None:
+        profile.profiler.dump_stats(directory / f'{profile_id}.prof')
+    (directory / f'{profile_id}.json').write_text(json.dumps(meta, indent=2))
+    rotate(directory)
+    return profile_id
+
+
+def rotate(directory):
+    keep = getattr(settings, 'PROFILING_MAX_FILES', 200)
+    # Ids start with the timestamp, so name order is age order
+    stored = sorted(directory.glob('*.json'), reverse=True)
+    for old in stored[keep:]:
+        old.unlink(missing_ok=True)
+        old.with_suffix('.prof').unlink(missing_ok=True)
+
+
+def list_profiles():
+    # Newest first, without the SQL timelines
+    summaries = []
+    for path in sorted(profile_dir().glob('*.json'), reverse=True):
+        try:
+            meta = json.loads(path.read_text())
+        except (OSError, ValueError):
+            continue
+        meta.pop('queries', None)
+        summaries.append(meta)
+    return summaries
+
+
+def profile_path(profile_id, suffix):
+    # None for anything that isn't a stored profile id, so no path can be smuggled in
+    if not PROFILE_ID.match(profile_id):
+        return None
+    path = profile_dir() / f'{profile_id}{suffix}'
+    return path if path.exists() else None
@@ -0,0 +1,213 @@
+import hashlib
+import uuid
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponseNotModified, JsonResponse
+from django.utils.cache import patch_vary_headers
+from django.utils.http import parse_etags
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+
+# Each cached response remembers the version of everything it was built
+# from. A write bumps the versions it affects, and the next read that sees a
+# different version rebuilds instead of serving the old body.
+#
+#   posts:<id>     the user's posts and their like/reyeet counts
+#   activity:<id>  what the user liked, reyeeted and follows
+#   profile:<id>   the user's details and follower/following counts
+#   feed:<id>      what was pushed into the user's home timeline
+#   feedback:all   any feedback survey row
+CACHED_VIEWS = ('feed', 'user_posts', 'profile', 'feedback_stats')
+
+
+def version_key(kind, user_id):
+    return f'version:{kind}:{user_id}'
+
+
+def _new_version():
+    return uuid.uuid4().hex[:12]
+
+
+def _set_new_versions(keys):
+    # One round trip however many users a write touches (fan-out bumps every follower)
+    cache.set_many({key: _new_version() for key in keys}, None)
+
+
+def bump(*keys):
+    """
+    Give keys new versions now, and again once the surrounding transaction
+    commits, so a read that rebuilt from the uncommitted state in between
+    doesn't stay cached.
+    """
+    if not keys:
+        return
+    _set_new_versions(keys)
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(lambda: _set_new_versions(keys))
+
+
+def current_versions(keys):
+    """
+    Versions for keys, creating the missing ones. A missing version can't
+    be trusted: it may have been evicted after a bump.
+    """
+    keys = list(keys)
+    versions = cache.get_many(keys)
+    missing = {key: _new_version() for key in keys if key not in versions}
+    if missing:
+        for key, version in missing.items():
+            if not cache.add(key, version, None):
+                version = cache.get(key)
+            versions[key] = version
+    return versions
+
+
+def _count(view, outcome):
+    key = f'response_cache:{outcome}:{view}'
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, 1, None)
+
+
+def stats():
+    # Hit/miss counters since the cache was last cleared, per cached view
+    counters = cache.get_many([f'response_cache:{outcome}:{view}' for view in CACHED_VIEWS for outcome in ('hit', 'miss')])
+    report = {}
+    for view in CACHED_VIEWS:
+        hits = counters.get(f'response_cache:hit:{view}', 0)
+        misses = counters.get(f'response_cache:miss:{view}', 0)
+        report[view] = {
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': round(hits / (hits + misses), 3) if hits + misses else None,
+        }
+    return report
+
+
+def response_key(view, request, *parts):
+    # The query string is hashed so the key stays short and memcached-safe
+    params = hashlib.md5(request.GET.urlencode().encode()).hexdigest()[:16]
+    return ':'.join(['response', view, *map(str, parts), params])
+
+
+def enabled():
+    # Off without a shared cache (see settings), and then there are no ETags either:
+    # versions only one worker knows would give every worker its own
+    return getattr(settings, 'RESPONSE_CACHE_ENABLED', True)
+
+
+def validator_key(key):
+    return 'etag:' + key
+
+
+def make_etag(key, versions):
+    # Derived from the shared versions alone, so checking it never needs the body
+    raw = key + '|' + '|'.join(f'{dep}={versions[dep]}' for dep in sorted(versions))
+    return '"' + hashlib.md5(raw.encode()).hexdigest() + '"'
+
+
+def fresh_entry(view, key):
+    # The cached entry for key if none of its versions moved since it was built
+    if not enabled():
+        return None
+    entry = cache.get(key)
+    if entry is not None and current_versions(entry['deps']) == entry['deps']:
+        _count(view, 'hit')
+        return entry
+    _count(view, 'miss')
+    return None
+
+
+def fresh_validator(key):
+    """
+    The {'deps', 'etag'} record kept next to the entry for key if none of
+    its versions moved. It outlives the entry (RESPONSE_CACHE_VALIDATOR_TTL),
+    so a client's ETag can still be checked once the body expired or was
+    evicted.
+    """
+    validator = cache.get(validator_key(key))
+    if validator is not None and current_versions(validator['deps']) == validator['deps']:
+        return validator
+    return None
+
+
+def store_entry(key, versions, data, extra_deps):
+    # versions were read before the data was built, so a write that lands meanwhile makes this entry stale
+    versions = dict(versions)
+    versions.update(current_versions(set(extra_deps) - versions.keys()))
+    entry = {'deps': versions, 'data': data, 'etag': make_etag(key, versions)}
+    cache.set(key, entry, getattr(settings, 'RESPONSE_CACHE_TTL', 300))
+    cache.set(validator_key(key), {'deps': versions, 'etag': entry['etag']},
+              getattr(settings, 'RESPONSE_CACHE_VALIDATOR_TTL', 3600))
+    return entry
+
+
+def not_modified(request, entry):
+    if_none_match = parse_etags(request.headers.get('If-None-Match', ''))
+    return entry['etag'] in if_none_match or '*' in if_none_match
+
+
+def revalidated(view, request, key):
+    """
+    The fresh entry for key, or failing that its fresh validator when the
+    request's If-None-Match matches it, which is all a 304 needs. None when
+    the body has to be built.
+    """
+    entry = fresh_entry(view, key)
+    if entry is None and 'If-None-Match' in request.headers:
+        validator = fresh_validator(key)
+        if validator is not None and not_modified(request, validator):
+            return validator
+    return entry
+
+
+def add_validators(response, entry):
+    response['ETag'] = entry['etag']
+    # Clients may keep it but have to revalidate, and it's per viewer
+    response['Cache-Control'] = 'private, no-cache'
+    patch_vary_headers(response, ['Authorization'])
+    return response
+
+
+def cached_response(view, request, key, deps, build):
+    """
+    The cached body for key as a DRF Response with an ETag, built again if
+    any of its versions moved. deps are the version keys known up front.
+    build() returns (data, extra_deps) for versions only known once the
+    data is there, like the authors of the posts on the page. A request
+    whose If-None-Match still matches gets a bodyless 304 straight off the
+    cache entry or its validator, without building anything. With the cache
+    disabled it's build() every time and no ETag.
+    """
+    if not enabled():
+        return Response(build()[0])
+    entry = revalidated(view, request, key)
+    if entry is None:
+        versions = current_versions(deps)
+        entry = store_entry(key, versions, *build())
+    if not_modified(request, entry):
+        return add_validators(Response(status=304), entry)
+    return add_validators(Response(entry['data']), entry)
+
+
+async def acached_response(view, request, key, deps, build):
+    # cached_response for the async views: build is a coroutine function, the answer a JsonResponse
+    if not enabled():
+        data, _ = await build()
+        return JsonResponse(data, safe=False, encoder=JSONEncoder)
+    entry = await sync_to_async(revalidated)(view, request, key)
+    if entry is None:
+        versions = await sync_to_async(current_versions)(deps)
+        data, extra_deps = await build()
+        entry = await sync_to_async(store_entry)(key, versions, data, extra_deps)
+    if not_modified(request, entry):
+        return add_validators(HttpResponseNotModified(), entry)
+    return add_validators(JsonResponse(entry['data'], safe=False, encoder=JSONEncoder), entry)
+
+
+def post_deps(posts):
+    return {version_key('posts', post['user_id']) for post in posts}
@@ -0,0 +1,106 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import transaction
+
+from .graph import social_graph
+from .models import UserSearchTerms
+
+# Shortest username suffix worth indexing, and so the shortest substring query
+MIN_INSIDE_LENGTH = 3
+
+
+def search_terms(username, first_name='', last_name=''):
+    """
+    The (term, kind) rows a user can be found by. Every suffix of the
+    username is indexed too, so a substring query becomes a prefix query.
+    """
+    size = UserSearchTerms.TERM_LENGTH
+    username = (username or '').lower()
+    terms = {(username[:size], UserSearchTerms.USERNAME)}
+    for start in range(1, len(username) - MIN_INSIDE_LENGTH + 1):
+        terms.add((username[start:start + size], UserSearchTerms.INSIDE))
+    for word in f'{first_name or ""} {last_name or ""}'.lower().split():
+        terms.add((word[:size], UserSearchTerms.NAME))
+    return terms
+
+
+def index_users(users, batch_size=1000, model=UserSearchTerms):
+    # Replace the rows of these users. model is swappable for the migration's historical model.
+    users = list(users)
+    with transaction.atomic():
+        model.objects.filter(user_id__in=[user.id for user in users]).delete()
+        model.objects.bulk_create(
+            (model(user_id=user.id, term=term, kind=kind)
+             for user in users
+             for term, kind in search_terms(user.username, user.first_name, user.last_name)),
+            batch_size=batch_size,
+        )
+
+
+def unindex_user(user_id):
+    UserSearchTerms.objects.filter(user_id=user_id).delete()
+
+
+def rebuild_index(batch_size=1000, user_model=User, model=UserSearchTerms):
+    # Walk auth_user by primary key and reindex every user. Returns how many.
+    last_id = total = 0
+    while True:
+        users = list(
+            user_model.objects.filter(id__gt=last_id).order_by('id')
+            .only('id', 'username', 'first_name', 'last_name')[:batch_size]
+        )
+        if not users:
+            return total
+        index_users(users, batch_size, model)
+        total += len(users)
+        last_id = users[-1].id
+
+
+def search_users(query, viewer_id=None, limit=10):
+    """
+    Ranked typeahead matches for query: exact username, then users the
+    viewer follows, then username prefix, name prefix and substring matches,
+    shorter usernames first. Each lookup is a range scan on the term index
+    capped at SEARCH_CANDIDATES rows.
+    """
+    query = ' '.join(query.lower().split())
+    if not query:
+        return []
+    size = UserSearchTerms.TERM_LENGTH
+    cap = getattr(settings, 'SEARCH_CANDIDATES', 100)
+
+    lookups = [(UserSearchTerms.USERNAME, query), (UserSearchTerms.NAME, query.split(' ')[0])]
+    if len(query) >= MIN_INSIDE_LENGTH:
+        lookups.append((UserSearchTerms.INSIDE, query))
+
+    candidates = {}
+    for kind, term in lookups:
+        if len(candidates) >= cap:
+            break
+        rows = (
+            UserSearchTerms.objects.filter(kind=kind, term__istartswith=term[:size])
+            .values_list('user_id', flat=True)[:cap]
+        )
+        for user_id in rows:
+            candidates.setdefault(user_id, kind)
+    if not candidates:
+        return []
+
+    results = []
+    users = User.objects.filter(id__in=candidates).values('id', 'username', 'first_name', 'last_name', 'email')
+    for user in users:
+        # Terms are truncated and names only match per word, so check the whole query
+        name = f"{user['first_name']} {user['last_name']}".lower()
+        if query not in user['username'].lower() and query not in name:
+            continue
+        user['is_following'] = viewer_id is not None and social_graph.is_following(viewer_id, user['id'])
+        results.append(user)
+
+    results.sort(key=lambda user: (
+        user['username'].lower() != query,
+        not user['is_following'],
+        candidates[user['id']],
+        len(user['username']),
+        user['username'],
+    ))
+    return results[:limit]
@@ -0,0 +1,164 @@
+import random
+from array import array
+from itertools import accumulate, islice
+
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from .graph import social_graph
+from .models import FeedbackSurvey, Follows, Likes, Posts, Retweets
+from .response_cache import bump, version_key
+from .search import index_users
+from .timeline import rebuild_timeline
+
+# Preset sizes for the seed_data command. Anything not set keeps the
+# seed_dataset() default; the bigger sets post less per user to stay loadable.
+SCALES = {
+    '10k': {'users': 10_000},
+    '100k': {'users': 100_000, 'posts_per_user': 10, 'likes_per_user': 20},
+    '1m': {'users': 1_000_000, 'posts_per_user': 5, 'likes_per_user': 10, 'retweets_per_user': 2},
+}
+
+# Where geotagged seed posts are, jittered a little around the city
+CITIES = [
+    ('New York, NY', 40.7128, -74.0060),
+    ('Los Angeles, CA', 34.0522, -118.2437),
+    ('Chicago, IL', 41.8781, -87.6298),
+    ('Houston, TX', 29.7604, -95.3698),
+    ('Seattle, WA', 47.6062, -122.3321),
+    ('Miami, FL', 25.7617, -80.1918),
+    ('Denver, CO', 39.7392, -104.9903),
+    ('Boston, MA', 42.3601, -71.0589),
+]
+
+# The options the app's feedback survey offers (FeedbackOptionsScreen.js)
+FEEDBACK_REASONS = {
+    True: ['User Interface', 'Performance', 'Features', 'Ease of Use', 'Content Quality',
+           'Social Interaction', 'Notifications', 'Search Functionality', 'Profile Customization'],
+    False: ['Confusing Interface', 'Slow Performance', 'Missing Features', 'Difficult to Use',
+            'Poor Content Quality', 'Limited Social Interaction', 'Too Many Notifications',
+            'Poor Search Results', 'Limited Customization'],
+}
+
+
+def bulk_insert(model, rows, batch_size, **kwargs):
+    # bulk_create turns its input into a list first, so feed it one batch at a time
+    rows, total = iter(rows), 0
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            return total
+        model.objects.bulk_create(batch, **kwargs)
+        total += len(batch)
+
+
+def power_law_follows(rng, user_ids, follows_per_user, skew):
+    """
+    (follower, followed) pairs where the chance of being followed falls off
+    as 1 / rank ** skew, so a few accounts collect most of the followers
+    like on the real thing. Who is popular is shuffled, not the lowest ids.
+    """
+    popularity = list(user_ids)
+    rng.shuffle(popularity)
+    cum_weights = list(accumulate(1 / (rank + 1) ** skew for rank in range(len(popularity))))
+    for user_id in user_ids:
+        # Oversample, the popular accounts come up more than once
+        picks = rng.choices(popularity, cum_weights=cum_weights, k=follows_per_user * 2)
+        followed = []
+        for followed_id in dict.fromkeys(picks):
+            if followed_id != user_id:
+                followed.append(followed_id)
+                if len(followed) == follows_per_user:
+                    break
+        for followed_id in followed:
+            yield user_id, followed_id
+
+
+def _count_of(model):
+    rows = model.objects.filter(post_id=OuterRef('post_id')).values('post_id').annotate(n=Count('pk')).values('n')
+    return Coalesce(Subquery(rows), Value(0))
+
+
+def count_engagement(post_ids):
+    # Fresh posts only: sets the counters straight from the likes/retweets tables in one UPDATE
+    Posts.objects.filter(post_id__in=post_ids).update(like_count=_count_of(Likes), retweet_count=_count_of(Retweets))
+
+
+def seed_post(rng, user_id, n, geo_fraction):
+    post = Posts(user_id=user_id, content=f'seed yeet {n} from {user_id}')
+    if rng.random() < geo_fraction:
+        post.location_name, latitude, longitude = rng.choice(CITIES)
+        post.latitude = round(latitude + rng.uniform(-0.05, 0.05), 6)
+        post.longitude = round(longitude + rng.uniform(-0.05, 0.05), 6)
+    return post
+
+
+def seed_feedback(rng, user_id):
+    likes_app = rng.random() < 0.7
+    reasons = rng.sample(FEEDBACK_REASONS[likes_app], rng.randint(1, 3))
+    return FeedbackSurvey(user_id=user_id, likes_app=likes_app, selected_reasons=reasons)
+
+
+def seed_dataset(users=50, posts_per_user=20, follows_per_user=10, likes_per_user=30,
+                 retweets_per_user=5, prefix='seed', seed=0, batch_size=1000, follow_skew=1.0,
+                 geo_fraction=0.3, feedback_fraction=0.05, build_timelines=True):
+    """
+    Fill the database with a synthetic social graph for benchmarks: users,
+    power-law follows, posts (some geotagged), likes, reyeets and feedback
+    surveys. Users are named <prefix>0, <prefix>1, ... Everything is written
+    in batch_size chunks so a million users fit in memory. Returns the
+    created user ids.
+    """
+    rng = random.Random(seed)
+
+    bulk_insert(User, (
+        User(username=f'{prefix}{i}', first_name=f'Seed{i}', last_name='User', email=f'{prefix}{i}@example.com')
+        for i in range(users)
+    ), batch_size)
+    seeded = User.objects.filter(username__startswith=prefix)
+    user_ids = list(seeded.order_by('id').values_list('id', flat=True))
+    # bulk_create skips the post_save signal that keeps the search index up to date
+    for start in range(0, len(user_ids), batch_size):
+        index_users(
+            seeded.filter(id__in=user_ids[start:start + batch_size]).only('id', 'username', 'first_name', 'last_name'),
+            batch_size,
+        )
+
+    bulk_insert(Follows, (
+        Follows(user_id=user_id, following_user_id=followed_id)
+        for user_id, followed_id in power_law_follows(rng, user_ids, follows_per_user, follow_skew)
+    ), batch_size, ignore_conflicts=True)
+    social_graph.invalidate()
+
+    last_post_id = Posts.objects.order_by('-post_id').values_list('post_id', flat=True).first() or 0
+    bulk_insert(Posts, (
+        seed_post(rng, user_id, n, geo_fraction) for user_id in user_ids for n in range(posts_per_user)
+    ), batch_size)
+    post_ids = array('q', Posts.objects.filter(post_id__gt=last_post_id).order_by('post_id')
+                     .values_list('post_id', flat=True).iterator(chunk_size=batch_size))
+
+    if post_ids:
+        for model, per_user in ((Likes, likes_per_user), (Retweets, retweets_per_user)):
+            bulk_insert(model, (
+                model(user_id=user_id, post_id=post_id)
+                for user_id in user_ids
+                for post_id in rng.sample(post_ids, min(per_user, len(post_ids)))
+            ), batch_size, ignore_conflicts=True)
+
+    bulk_insert(FeedbackSurvey, (
+        seed_feedback(rng, user_id) for user_id in user_ids if rng.random() < feedback_fraction
+    ), batch_size)
+    # No post_save for bulk inserts, the cached survey stats have to be told
+    bump(version_key('feedback', 'all'))
+
+    for start in range(0, len(post_ids), batch_size):
+        count_engagement(post_ids[start:start + batch_size])
+    if build_timelines:
+        # One transaction per batch of users, not one commit per inbox write
+        for start in range(0, len(user_ids), batch_size):
+            with transaction.atomic():
+                for user_id in user_ids[start:start + batch_size]:
+                    rebuild_timeline(user_id)
+    return user_ids
@@ -17,7 +17,8 @@ class PostSerializer(serializers.ModelSerializer):
    
      class  Meta:
         model = Posts
-        fields = '__all__'
+        # The stored counters leave out the shards of hot posts, serialize_posts() has the real counts
+        exclude = ['like_count', 'retweet_count', 'counter_shards']
 
 class LikeSerializer(serializers.ModelSerializer):
     class Meta:
@@ -0,0 +1,60 @@
+from django.contrib.auth.models import User
+from django.contrib.auth.signals import user_logged_out
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from .authentication import auth_users
+from .models import FeedbackSurvey, ProfilePics
+from .response_cache import bump, version_key
+from .search import index_users, unindex_user
+from .users import user_directory
+
+SEARCHABLE_FIELDS = {'username', 'first_name', 'last_name'}
+PROFILE_FIELDS = SEARCHABLE_FIELDS | {'email'}
+
+
+# Keep the cached user info in step with renames and new profile pictures
+@receiver([post_save, post_delete], sender=User)
+def user_changed(sender, instance, update_fields=None, **kwargs):
+    user_directory.invalidate(instance.id)
+    auth_users.invalidate(instance.id)
+    if update_fields is None or PROFILE_FIELDS & set(update_fields):
+        # Name and username show up on the profile and on every post of theirs
+        bump(version_key('profile', instance.id), version_key('posts', instance.id))
+
+
+@receiver([post_save, post_delete], sender=ProfilePics)
+def profile_pic_changed(sender, instance, **kwargs):
+    user_directory.invalidate(instance.user_id)
+    bump(version_key('profile', instance.user_id))
+
+
+# Logging out or deleting an authtoken revokes access, the next request reads the user again
+@receiver(user_logged_out)
+def user_logged_out_auth(sender, user=None, **kwargs):
+    if user is not None:
+        auth_users.invalidate(user.id)
+
+
+@receiver(post_delete, sender=Token)
+def auth_token_deleted(sender, instance, **kwargs):
+    auth_users.invalidate(instance.user_id)
+
+
+# Keep the search index in step, skipping saves like last_login that don't touch names
+@receiver(post_save, sender=User)
+def user_saved_search(sender, instance, update_fields=None, **kwargs):
+    if update_fields is None or SEARCHABLE_FIELDS & set(update_fields):
+        index_users([instance])
+
+
+@receiver(pre_delete, sender=User)
+def user_deleted_search(sender, instance, **kwargs):
+    unindex_user(instance.id)
+
+
+# New survey answers change the feedback stats
+@receiver([post_save, post_delete], sender=FeedbackSurvey)
+def feedback_changed(sender, instance, **kwargs):
+    bump(version_key('feedback', 'all'))
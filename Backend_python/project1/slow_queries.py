@@ -0,0 +1,221 @@
+import hashlib
+import logging
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict
+from contextvars import ContextVar
+from pathlib import Path
+
+from django.conf import settings
+from django.db import DatabaseError, connection, connections
+from django.db.backends.signals import connection_created
+from django.utils import timezone
+
+# Slow query log. Every query of a request is timed and grouped by its SQL;
+# when the request ends, statements that were slow, or that ran so many
+# times they must be inside a loop, go into a bounded in-process store
+# aggregated by fingerprint, with the view and line that ran them and an
+# EXPLAIN of the slowest run. Staff read it at api/slow_queries/.
+
+logger = logging.getLogger(__name__)
+
+_current = ContextVar('slow_query_request', default=None)
+_explaining = ContextVar('slow_query_explaining', default=False)
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+_PLACEHOLDERS = re.compile(r'\(\s*(?:(?:%s|\?)\s*,\s*)+(?:%s|\?)\s*\)')
+_SPACE = re.compile(r'\s+')
+_THIS_DIR = str(Path(__file__).resolve().parent)
+_OWN_FILES = {str(Path(__file__).resolve()), str(Path(_THIS_DIR, 'metrics.py')), str(Path(_THIS_DIR, 'profiling.py'))}
+
+
+def fingerprint(sql):
+    """
+    The statement with literals and placeholders taken out, so a query run
+    with different ids, or an IN list of a different length, groups together.
+    """
+    sql = _STRING.sub('?', sql)
+    sql = _PLACEHOLDERS.sub('(...)', sql)
+    sql = _NUMBER.sub('?', sql.replace('%s', '?'))
+    return _SPACE.sub(' ', sql).strip()
+
+
+def caller():
+    # The first frame in this project's code, outside Django and the instrumentation
+    base = str(settings.BASE_DIR)
+    frame = sys._getframe(2)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if filename.startswith(base) and 'site-packages' not in filename and filename not in _OWN_FILES:
+            return f'{Path(filename).relative_to(base)}:{frame.f_lineno} in {frame.f_code.co_name}'
+        frame = frame.f_back
+    return None
+
+
+class RequestQueries:
+    # Per statement totals for one request: {sql: [runs, total_ms, max_ms, slowest params, caller]}
+    def __init__(self, request):
+        self.request = request
+        self.statements = {}
+        self._lock = threading.Lock()
+
+    def add(self, sql, params, many, ms):
+        with self._lock:
+            seen = self.statements.get(sql)
+            if seen is None:
+                self.statements[sql] = [1, ms, ms, None if many else params, caller()]
+                return
+            seen[0] += 1
+            seen[1] += ms
+            if ms > seen[2]:
+                seen[2] = ms
+                seen[3] = None if many else params
+
+
+def record_query(execute, sql, params, many, context):
+    current = _current.get()
+    if current is None or _explaining.get():
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        current.add(sql, params, many, (time.perf_counter() - started) * 1000)
+
+
+def watch_connection(conn):
+    if record_query not in conn.execute_wrappers:
+        conn.execute_wrappers.append(record_query)
+
+
+def _watch_new_connection(sender, connection, **kwargs):
+    watch_connection(connection)
+
+
+connection_created.connect(_watch_new_connection, dispatch_uid='project1.slow_queries')
+
+
+def explain(sql, params):
+    # The plan of a SELECT on this database, or None if it can't be explained
+    if params is None or not sql.lstrip().upper().startswith('SELECT'):
+        return None
+    token = _explaining.set(True)
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(f'{connection.ops.explain_query_prefix()} {sql}', params)
+            return [' '.join(str(column) for column in row) for row in cursor.fetchall()]
+    except DatabaseError:
+        return None
+    finally:
+        _explaining.reset(token)
+
+
+class SlowQueryStore:
+    """
+    Offenders by fingerprint, at most SLOW_QUERY_MAX_FINGERPRINTS of them;
+    the one seen longest ago goes first when it's full.
+    """
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, sql, runs, total_ms, max_ms, params, where, view, reason):
+        key = hashlib.md5(fingerprint(sql).encode()).hexdigest()[:12]
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            new = entry is None
+            if new:
+                entry = {
+                    'id': key,
+                    'fingerprint': fingerprint(sql),
+                    'sample_sql': sql,
+                    'requests': 0,
+                    'executions': 0,
+                    'total_ms': 0.0,
+                    'max_ms': 0.0,
+                    'max_executions_per_request': 0,
+                    'reasons': [],
+                    'callers': {},
+                    'explain': None,
+                }
+            entry['requests'] += 1
+            entry['executions'] += runs
+            entry['total_ms'] = round(entry['total_ms'] + total_ms, 3)
+            entry['max_ms'] = round(max(entry['max_ms'], max_ms), 3)
+            entry['max_executions_per_request'] = max(entry['max_executions_per_request'], runs)
+            if reason not in entry['reasons']:
+                entry['reasons'].append(reason)
+            place = f'{view} ({where})' if where else view
+            entry['callers'][place] = entry['callers'].get(place, 0) + runs
+            entry['last_seen'] = timezone.now().isoformat()
+            self._entries[key] = entry
+            while len(self._entries) > getattr(settings, 'SLOW_QUERY_MAX_FINGERPRINTS', 500):
+                self._entries.popitem(last=False)
+            needs_plan = entry['explain'] is None
+        if needs_plan and getattr(settings, 'SLOW_QUERY_EXPLAIN', True):
+            plan = explain(sql, params)
+            with self._lock:
+                if key in self._entries:
+                    self._entries[key]['explain'] = plan
+        return entry, new
+
+    def report(self):
+        # Worst first: the most time spent over all requests
+        with self._lock:
+            entries = [dict(entry, callers=dict(entry['callers'])) for entry in self._entries.values()]
+        return sorted(entries, key=lambda entry: entry['total_ms'], reverse=True)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+store = SlowQueryStore()
+
+
+def start_request(request):
+    for conn in connections.all(initialized_only=True):
+        watch_connection(conn)
+    return _current.set(RequestQueries(request))
+
+
+def end_request(token):
+    """
+    Stop timing the request and return its offenders: statements that took
+    longer than SLOW_QUERY_THRESHOLD_MS once, and statements that ran
+    SLOW_QUERY_REPEAT_THRESHOLD times or more (a query in a loop), as
+    (sql, runs, total_ms, max_ms, params, where, reason).
+    """
+    current = _current.get()
+    _current.reset(token)
+    threshold = getattr(settings, 'SLOW_QUERY_THRESHOLD_MS', 100)
+    repeats = getattr(settings, 'SLOW_QUERY_REPEAT_THRESHOLD', 50)
+    offenders = []
+    for sql, (runs, total_ms, max_ms, params, where) in current.statements.items():
+        if max_ms >= threshold:
+            offenders.append((sql, runs, total_ms, max_ms, params, where, 'slow'))
+        if runs >= repeats:
+            offenders.append((sql, runs, total_ms, max_ms, params, where, 'repeated'))
+    return offenders
+
+
+def log_offenders(offenders, view):
+    # Into the store and the log. May run EXPLAIN, so not on an event loop.
+    for sql, runs, total_ms, max_ms, params, where, reason in offenders:
+        entry, new = store.add(sql, runs, total_ms, max_ms, params, where, view, reason)
+        if new:
+            logger.warning(
+                'Slow query %s in %s: %d run(s), %.1fms total, %.1fms max: %s',
+                reason, view, runs, total_ms, max_ms, entry['fingerprint'],
+                extra={'slow_query': {'id': entry['id'], 'view': view, 'caller': where, 'runs': runs,
+                                      'total_ms': round(total_ms, 3), 'max_ms': round(max_ms, 3)}},
+            )
+
+
+def finish_request(token, view):
+    # Move the request's offenders into the store
+    log_offenders(end_request(token), view)
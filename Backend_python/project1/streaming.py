@@ -0,0 +1,89 @@
+from django.conf import settings
+from django.http import JsonResponse, StreamingHttpResponse
+from rest_framework.utils.encoders import JSONEncoder
+
+from .pagination import InvalidCursor, decode_pk_cursor, encode_pk_cursor, get_page_params
+
+CONTENT_TYPES = {
+    'json': 'application/json',
+    'ndjson': 'application/x-ndjson',
+}
+
+
+def iterate_by_pk(queryset, chunk_size):
+    """
+    Yield every row of queryset in primary key order, chunk_size rows per
+    query. Each chunk is a range scan on the primary key. Unlike
+    .iterator(), this doesn't depend on server-side cursors, which
+    mysqlclient doesn't have (it buffers the whole result set).
+    """
+    queryset = queryset.order_by('pk')
+    last_pk = None
+    while True:
+        chunk = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+        chunk = list(chunk[:chunk_size])
+        yield from chunk
+        if len(chunk) < chunk_size:
+            return
+        last_pk = chunk[-1].pk
+
+
+def encode_rows(rows, fmt, chunk_size):
+    # One write per chunk of rows: a JSON array, or one object per line for ndjson
+    encoder = JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+    first = True
+    buffer = []
+    if fmt == 'json':
+        yield '['
+    for row in rows:
+        if fmt == 'ndjson':
+            buffer.append(encoder.encode(row) + '\n')
+        else:
+            buffer.append(encoder.encode(row) if first else ',' + encoder.encode(row))
+            first = False
+        if len(buffer) >= chunk_size:
+            yield ''.join(buffer)
+            buffer = []
+    if buffer:
+        yield ''.join(buffer)
+    if fmt == 'json':
+        yield ']'
+
+
+def pk_page(queryset, limit, after=None):
+    # One page in primary key order, continuing after the pk in the cursor
+    queryset = queryset.order_by('pk')
+    if after is not None:
+        queryset = queryset.filter(pk__gt=after)
+    rows = list(queryset[:limit + 1])
+    if len(rows) <= limit:
+        return rows, None
+    return rows[:limit], encode_pk_cursor(rows[limit - 1].pk)
+
+
+def listing_response(request, queryset, serializer_class):
+    """
+    Respond with every row of queryset without holding the table in memory.
+    ?limit=/&cursor= returns one page as {'results', 'next_cursor'}, for
+    clients that can't stream. Otherwise the rows are streamed as a JSON
+    array (same body as before), or as NDJSON with ?stream=ndjson.
+    """
+    try:
+        page = get_page_params(request, decode_pk_cursor)
+    except InvalidCursor as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    if page:
+        rows, next_cursor = pk_page(queryset, *page)
+        return JsonResponse(
+            {'results': serializer_class(rows, many=True).data, 'next_cursor': next_cursor},
+            encoder=JSONEncoder,
+        )
+
+    fmt = request.GET.get('stream', 'json')
+    if fmt not in CONTENT_TYPES:
+        return JsonResponse({'error': f"stream must be one of {', '.join(CONTENT_TYPES)}"}, status=400)
+    chunk_size = settings.STREAM_CHUNK_SIZE
+    serializer = serializer_class()
+    rows = (serializer.to_representation(obj) for obj in iterate_by_pk(queryset, chunk_size))
+    return StreamingHttpResponse(encode_rows(rows, fmt, chunk_size), content_type=CONTENT_TYPES[fmt])
@@ -1,3 +1,1398 @@
-from django.test import TestCase
+import io
+import json
+import logging
+import tempfile
+import threading
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, iscoroutinefunction, sync_to_async
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.handlers.asgi import ASGIHandler
+from django.core.management import CommandError, call_command
+from django.db import DatabaseError, IntegrityError, connection, transaction
+from django.db.models import OuterRef, Subquery
+from django.http import HttpResponse
+from django.test import Client, RequestFactory, TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from .authentication import CachedJWTAuthentication, auth_users
+from .counters import promote, summed_shards
+from .engagement import hydrate_engagement, rebuild_counters
+from .feed import first_batches, read_feed
+from .graph import social_graph
+from .middleware import MetricsMiddleware, SlowQueryMiddleware
+from .models import (
+    FeedbackSurvey, Follows, HomeTimeline, IdempotencyKeys, Likes, PostCounterShards, Posts, ProfilePics, Retweets,
+)
+from .pagination import decode_cursor, encode_cursor
+from . import graph, metrics, profiling, response_cache, slow_queries, timeline, write_behind
+from .timeline import fan_out_post, pull_authors, rebuild_timeline, touch_follower_feeds
+from .toggles import COUNTERS, insert_ignore, toggle_engagement, toggle_row
+from .users import user_directory
+
+
+# The tests are one process, so the locmem cache is as shared as it gets
+@override_settings(RESPONSE_CACHE_ENABLED=True)
+class CleanStateTestCase(TestCase):
+    # The caches, the social graph and the user directories live outside the test transaction
+    def setUp(self):
+        cache.clear()
+        social_graph.clear()
+        user_directory.clear()
+        auth_users.clear()
+
+
+def auth_header(user):
+    return {'HTTP_AUTHORIZATION': f'Bearer {RefreshToken.for_user(user).access_token}'}
+
+
+class EngagementHydrationTests(CleanStateTestCase):
+    def setUp(self):
+        super().setUp()
+        self.author = User.objects.create(username='author')
+        self.viewer = User.objects.create(username='viewer')
+        self.other = User.objects.create(username='other')
+        Follows.objects.create(user_id=self.viewer.id, following_user_id=self.author.id)
+
+    def make_posts(self, count):
+        Posts.objects.bulk_create(
+            Posts(user_id=self.author.id, content=f'yeet {i}') for i in range(count)
+        )
+        post_ids = list(
+            Posts.objects.filter(user_id=self.author.id).order_by('-post_id').values_list('post_id', flat=True)[:count]
+        )[::-1]
+        Likes.objects.bulk_create(Likes(user_id=self.other.id, post_id=post_id) for post_id in post_ids)
+        Likes.objects.bulk_create(Likes(user_id=self.viewer.id, post_id=post_id) for post_id in post_ids[::2])
+        Retweets.objects.bulk_create(Retweets(user_id=self.other.id, post_id=post_id) for post_id in post_ids[::3])
+        rebuild_counters(Posts.objects.filter(post_id__in=post_ids))
+        rebuild_timeline(self.viewer.id)
+
+    def count_queries(self, url, **extra):
+        # Cold path: nothing cached, nothing loaded
+        cache.clear()
+        social_graph.clear()
+        user_directory.clear()
+        auth_users.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, **extra)
+        self.assertEqual(response.status_code, 200)
+        return len(queries), response.json()
+
+    def test_hydrate_engagement_counts_and_flags(self):
+        self.make_posts(4)
+        post_ids = list(Posts.objects.order_by('post_id').values_list('post_id', flat=True))
+        with self.assertNumQueries(3):
+            engagement = hydrate_engagement(post_ids, self.viewer.id)
+        first, second = engagement[post_ids[0]], engagement[post_ids[1]]
+        self.assertEqual(first['like_count'], 2)
+        self.assertTrue(first['liked_by_user'])
+        self.assertEqual(first['retweet_count'], 1)
+        self.assertFalse(first['retweeted_by_user'])
+        self.assertEqual(second['like_count'], 1)
+        self.assertFalse(second['liked_by_user'])
+        self.assertEqual(second['retweet_count'], 0)
+
+    def test_query_count_does_not_grow_with_page_size(self):
+        urls = [
+            ('/api/follow_feed/viewer/', {}),
+            ('/api/user_posts/author/', {}),
+            ('/user_profile/author/', auth_header(self.viewer)),
+        ]
+        self.make_posts(5)
+        small = [self.count_queries(url, **extra)[0] for url, extra in urls]
+        self.make_posts(50)
+        large = [self.count_queries(url, **extra)[0] for url, extra in urls]
+        self.assertEqual(small, large)
+
+
+class EngagementCounterTests(CleanStateTestCase):
+    def setUp(self):
+        super().setUp()
+        self.author = User.objects.create(username='author')
+        self.fan = User.objects.create(username='fan')
+        self.post = Posts.objects.create(user_id=self.author.id, content='yeet')
+
+    def toggle(self, url):
+        return self.client.post(url, json.dumps({'username': 'fan', 'post_id': self.post.post_id}),
+                                content_type='application/json')
+
+    def test_toggles_keep_counters_in_step(self):
+        self.assertEqual(self.toggle('/api/like_unlike/').status_code, 201)
+        self.assertEqual(self.toggle('/api/reyeet_unreyeet/').status_code, 201)
+        self.post.refresh_from_db()
+        self.assertEqual((self.post.like_count, self.post.retweet_count), (1, 1))
+
+        self.assertEqual(self.toggle('/api/like_unlike/').status_code, 200)
+        self.post.refresh_from_db()
+        self.assertEqual((self.post.like_count, self.post.retweet_count), (0, 1))
+
+    def test_toggles_need_a_real_post(self):
+        for body, status in (({}, 400), ({'post_id': 'x'}, 400), ({'post_id': self.post.post_id + 1}, 404)):
+            for url in ('/api/like_unlike/', '/api/reyeet_unreyeet/'):
+                response = self.client.post(url, json.dumps({'username': 'fan', **body}),
+                                            content_type='application/json')
+                self.assertEqual(response.status_code, status, (url, body))
+        self.assertFalse(Likes.objects.exists())
+        self.assertFalse(Retweets.objects.exists())
+
+    def test_only_the_unique_key_is_ignored(self):
+        self.assertEqual(toggle_row(Likes, user_id=self.fan.id, post_id=self.post.post_id), 1)
+        self.assertEqual(insert_ignore([Likes(user_id=self.fan.id, post_id=self.post.post_id)]), 0)
+        # A follow without a follower breaks NOT NULL, which isn't a duplicate
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            insert_ignore([Follows(user_id=None, following_user_id=self.fan.id)])
+
+    def test_rebuild_command_fixes_drifted_counters(self):
+        Likes.objects.create(user_id=self.fan.id, post_id=self.post.post_id)
+        Posts.objects.filter(post_id=self.post.post_id).update(like_count=7)
+        with self.assertRaises(CommandError):
+            call_command('rebuild_engagement_counters', '--check', stdout=io.StringIO())
+        call_command('rebuild_engagement_counters', '--chunk-size', '1', stdout=io.StringIO())
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.like_count, 1)
+
+
+@override_settings(COUNTER_SHARD_PROMOTE_WRITES=3, COUNTER_SHARD_WINDOW_SECONDS=3600, COUNTER_SHARDS=4)
+class CounterShardTests(CleanStateTestCase):
+    def setUp(self):
+        super().setUp()
+        self.author = User.objects.create(username='author')
+        self.fans = [User.objects.create(username=f'fan{n}') for n in range(5)]
+        self.post = Posts.objects.create(user_id=self.author.id, content='viral')
+
+    def like(self, fan):
+        return toggle_engagement(Likes, fan.id, self.post.post_id)
+
+    def test_hot_post_is_promoted_and_still_counted(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            for fan in self.fans[:3]:
+                self.like(fan)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.counter_shards, 4)
+        self.assertEqual(PostCounterShards.objects.filter(post_id=self.post.post_id).count(), 4)
+
+        # Past the promotion the posts row stays put and the shards take the writes
+        for fan in self.fans[3:]:
+            self.like(fan)
+        self.like(self.fans[0])
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.like_count, 3)
+        self.assertEqual(summed_shards([self.post.post_id]), {self.post.post_id: (1, 0)})
+        self.assertEqual(hydrate_engagement([self.post.post_id])[self.post.post_id]['like_count'], 4)
+        self.assertEqual(rebuild_counters(Posts.objects.all(), fix=False), [])
+
+    def test_rebuild_leaves_the_shards_alone(self):
+        promote(self.post.post_id)
+        for fan in self.fans[:2]:
+            self.like(fan)
+        Posts.objects.filter(post_id=self.post.post_id).update(like_count=7)
+        rebuild_counters(Posts.objects.all())
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.like_count, 0)
+        self.assertEqual(hydrate_engagement([self.post.post_id])[self.post.post_id]['like_count'], 2)
+
+    def test_post_listings_leave_the_stored_counters_out(self):
+        promote(self.post.post_id)
+        self.like(self.fans[0])
+        for url in ('/view_all_posts/?limit=50', '/all_posts/?limit=50'):
+            row = self.client.get(url).json()['results'][0]
+            self.assertEqual(row['post_id'], self.post.post_id)
+            for field in ('like_count', 'retweet_count', 'counter_shards'):
+                self.assertNotIn(field, row)
+
+
+class FollowEdgeTests(CleanStateTestCase):
+    def setUp(self):
+        super().setUp()
+        self.ann = User.objects.create(username='ann')
+        self.bob = User.objects.create(username='bob')
+        self.cat = User.objects.create(username='cat')
+
+    def follow(self, user, username):
+        return self.client.post('/follow_toggle/', {'username': username}, **auth_header(user)).json()
+
+    def test_users_can_follow_many_accounts(self):
+        self.assertEqual(self.follow(self.ann, 'bob'), {'status': 'followed'})
+        self.assertEqual(self.follow(self.ann, 'cat'), {'status': 'followed'})
+        self.assertEqual(self.follow(self.bob, 'cat'), {'status': 'followed'})
+
+        self.assertCountEqual(self.client.get('/api/user/ann/Follows/').json(), ['bob', 'cat'])
+        self.assertCountEqual(self.client.get('/api/user/cat/Following/').json(), ['ann', 'bob'])
+
+    def test_unfollow_only_removes_that_edge(self):
+        self.follow(self.ann, 'bob')
+        self.follow(self.ann, 'cat')
+        self.assertEqual(self.follow(self.ann, 'bob'), {'status': 'unfollowed'})
+        self.assertEqual(
+            list(Follows.objects.filter(user_id=self.ann.id).values_list('following_user_id', flat=True)),
+            [self.cat.id],
+        )
+
+    def test_follow_needs_someone_else_and_a_login(self):
+        self.assertEqual(self.follow(self.ann, 'ann'), {'error': "You can't follow yourself"})
+        self.assertEqual(self.client.post('/follow_toggle/', {'username': 'bob'}).status_code, 401)
+        self.assertFalse(Follows.objects.exists())
+
+
+class SocialGraphTests(CleanStateTestCase):
+    def setUp(self):
+        super().setUp()
+        self.ann, self.bob, self.cat = (User.objects.create(username=name) for name in ('ann', 'bob', 'cat'))
+        Follows.objects.create(user_id=self.ann.id, following_user_id=self.bob.id)
+        Follows.objects.create(user_id=self.bob.id, following_user_id=self.ann.id)
+        Follows.objects.create(user_id=self.cat.id, following_user_id=self.bob.id)
+
+    def test_answers_from_memory_once_loaded(self):
+        self.assertTrue(social_graph.is_following(self.ann.id, self.bob.id))
+        social_graph.followers(self.bob.id)
+        with self.assertNumQueries(0):
+            self.assertFalse(social_graph.is_following(self.ann.id, self.cat.id))
+            self.assertEqual(social_graph.follower_count(self.bob.id), 2)
+            self.assertEqual(social_graph.following_count(self.ann.id), 1)
+
+    def test_mutuals(self):
+        self.assertEqual(social_graph.mutuals(self.bob.id), [self.ann.id])
+
+    def test_follow_toggle_updates_loaded_lists(self):
+        self.assertEqual(social_graph.follower_count(self.cat.id), 0)
+        # The loaded lists change once the follow commits
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/follow_toggle/', {'username': 'cat'}, **auth_header(self.ann))
+        with self.assertNumQueries(0):
+            self.assertEqual(social_graph.follower_count(self.cat.id), 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/follow_toggle/', {'username': 'cat'}, **auth_header(self.ann))
+        self.assertEqual(social_graph.follower_count(self.cat.id), 0)
+
+    def test_follows_never_change_a_list_handed_out(self):
+        followees = social_graph.followees(self.cat.id)
+        followers = social_graph.followers(self.bob.id)
+        social_graph.follow_added(self.cat.id, self.ann.id)
+        social_graph.follow_removed(self.ann.id, self.bob.id)
+        # A reader iterating the old arrays sees them as they were
+        self.assertEqual(list(followees), [self.bob.id])
+        self.assertEqual(list(followers), [self.ann.id, self.cat.id])
+        self.assertEqual(list(social_graph.followees(self.cat.id)), sorted([self.ann.id, self.bob.id]))
+        self.assertEqual(list(social_graph.followers(self.bob.id)), [self.cat.id])
+
+    def test_version_bump_from_elsewhere_drops_loaded_lists(self):
+        self.assertEqual(social_graph.following_count(self.cat.id), 1)
+        self.assertEqual(social_graph.following_count(self.ann.id), 1)
+        Follows.objects.create(user_id=self.cat.id, following_user_id=self.ann.id)
+        cache.incr(graph.version_key(self.cat.id))  # what another worker's follow_toggle does
+        with self.settings(SOCIAL_GRAPH_VERSION_CHECK_SECONDS=0):
+            self.assertEqual(social_graph.following_count(self.cat.id), 2)
+            # Only the users whose versions moved are read again
+            with self.assertNumQueries(0):
+                self.assertEqual(social_graph.following_count(self.ann.id), 1)
+
+    def test_fan_out_past_the_limit_loads_no_followers(self):
+        post = Posts.objects.create(user_id=self.bob.id, content='to the pull path')
+        with self.settings(TIMELINE_FANOUT_MAX_FOLLOWERS=1):
+            self.assertEqual(fan_out_post(post), 0)
+        # Still cold, the check read two ids and kept none
+        with self.assertNumQueries(1):
+            self.assertEqual(social_graph.follower_count(self.bob.id), 2)
+
+    def test_touching_feeds_past_the_limit_loads_no_followers(self):
+        with self.settings(TIMELINE_FANOUT_MAX_FOLLOWERS=1):
+            self.assertEqual(touch_follower_feeds(self.bob.id), 0)
+        self.assertIn(self.bob.id, pull_authors())
+        with self.assertNumQueries(1):
+            self.assertEqual(social_graph.follower_count(self.bob.id), 2)
+        # Under the limit every follower's feed version moves
+        bob_feed, cat_feed = (response_cache.version_key('feed', user.id) for user in (self.bob, self.cat))
+        before = response_cache.current_versions([bob_feed, cat_feed])
+        self.assertEqual(touch_follower_feeds(self.ann.id), 1)
+        self.assertNotEqual(cache.get(bob_feed), before[bob_feed])
+        self.assertEqual(cache.get(cat_feed), before[cat_feed])
+
+    def test_loaded_lists_expire(self):
+        self.assertEqual(social_graph.following_count(self.cat.id), 1)
+        # A write that bumped no version, like a worker whose cache isn't shared
+        Follows.objects.create(user_id=self.cat.id, following_user_id=self.ann.id)
+        with self.settings(SOCIAL_GRAPH_TTL=0):
+            self.assertEqual(social_graph.following_count(self.cat.id), 2)
+
+
+class UserDirectoryTests(CleanStateTestCase):
+    def setUp(self):
+        super().setUp()
+        self.users = [User.objects.create(username=f'user{i}', first_name=f'First{i}') for i in range(5)]
+        ProfilePics.objects.create(user_id=self.users[0].id, photo_path='https://example.com/pic.png')
+
+    def test_resolves_a_batch_in_one_query_then_from_memory(self):
+        ids = [user.id for user in self.users]
+        with self.assertNumQueries(1):
+            users = user_directory.resolve(ids + [999999])
+        self.assertEqual(sorted(users), ids)
+        self.assertEqual(users[ids[0]]['picture'], 'https://example.com/pic.png')
+        self.assertEqual(users[ids[1]]['picture'], '')
+        with self.assertNumQueries(0):
+            self.assertEqual(user_directory.usernames(ids[:2]), ['user0', 'user1'])
+
+    def test_rename_invalidates(self):
+        user = self.users[1]
+        user_directory.get(user.id)
+        user.username = 'renamed'
+        user.save()
+        self.assertEqual(user_directory.get(user.id)['username'], 'renamed')
+
+    def test_usernames_endpoint(self):
+        ids = ','.join(str(user.id) for user in self.users[:3])
+        with self.assertNumQueries(1):
+            data = self.client.get(f'/api/usernames/?ids={ids},999999').json()
+        self.assertEqual(sorted(data), sorted(str(user.id) for user in self.users[:3]))
+        self.assertEqual(data[str(self.users[2].id)]['first_name'], 'First2')
+        self.assertEqual(self.client.get('/api/usernames/?ids=1,abc').status_code, 400)
+
+    def test_ids_past_the_column_are_a_bad_request(self):
+        huge = '9' * 40
+        for url in (f'/api/usernames/?ids=1,{huge}', f'/api/follow-usernames/{huge}/', f'/api/username/{huge}/'):
+            with self.assertNumQueries(0):
+                self.assertEqual(self.client.get(url).status_code, 400, url)
+
+    def test_follow_usernames_is_constant(self):
+        Follows.objects.create(user_id=self.users[0].id, following_user_id=self.users[1].id)
+        with self.assertNumQueries(2):
+            data = self.client.get(f'/api/follow-usernames/{self.users[0].id}/').json()
+        self.assertEqual((data['username'], data['following_username']), ('user0', 'user1'))
+
+
+class CachedJWTAuthenticationTests(CleanStateTestCase):
+    def setUp(self):
+        super().setUp()
+        self.ann = User.objects.create(username='ann')
+
+    def authenticate(self, user=None, header=None):
+        request = RequestFactory().get('/', **(auth_header(user) if user else {'HTTP_AUTHORIZATION': header}))
+        return CachedJWTAuthentication().authenticate(request)
+
+    def test_known_users_are_not_read_again(self):
+        with self.assertNumQueries(1):
+            user, _ = self.authenticate(self.ann)
+        with self.assertNumQueries(0):
+            again, _ = self.authenticate(self.ann)
+        self.assertEqual(again, user)
+        # A copy per request, changing one doesn't touch the cached user
+        again.username = 'changed'
+        self.assertEqual(self.authenticate(self.ann)[0].username, 'ann')
+        # Token headers are left to TokenAuthentication without a query
+        with self.assertNumQueries(0):
+            self.assertIsNone(self.authenticate(header='Token abc'))
+
+    def test_deactivated_user_is_refused_right_away(self):
+        self.authenticate(self.ann)
+        self.ann.is_active = False
+        self.ann.save()
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate(self.ann)
+
+    def test_password_change_revokes_tokens(self):
+        # simplejwt reads its settings once, override_settings doesn't reach the modules that imported them
+        with mock.patch.object(jwt_settings, 'CHECK_REVOKE_TOKEN', True):
+            self.ann.set_password('old secret')
+            self.ann.save()
+            header = auth_header(self.ann)['HTTP_AUTHORIZATION']
+            self.authenticate(header=header)
+            self.ann.set_password('new secret')
+            self.ann.save()
+            with self.assertRaises(AuthenticationFailed):
+                self.authenticate(header=header)
+
+
+class UserSearchTests(CleanStateTestCase):
+    def setUp(self):
+        super().setUp()
+        self.viewer = User.objects.create(username='viewer')
+        self.annie = User.objects.create(username='annie', first_name='Ann', last_name='Lee')
+        self.joanna = User.objects.create(username='joanna', first_name='Jo', last_name='Banner')
+        self.ann = User.objects.create(username='ann')
+        User.objects.create(username='bob', first_name='Bob', last_name='Stone')
+
+    def search(self, query, **extra):
+        return [user['username'] for user in self.client.get('/search_users/', {'query': query}, **extra).json()]
+
+    def test_ranks_exact_then_prefix_then_substring(self):
+        self.assertEqual(self.search('ann'), ['ann', 'annie', 'joanna'])
+        self.assertEqual(self.search('ANN'), ['ann', 'annie', 'joanna'])
+        self.assertEqual(self.search('stone'), ['bob'])
+        self.assertEqual(self.search('ann lee'), ['annie'])
+
+    def test_followed_users_rank_higher(self):
+        Follows.objects.create(user_id=self.viewer.id, following_user_id=self.joanna.id)
+        self.assertEqual(self.search('ann', **auth_header(self.viewer)), ['ann', 'joanna', 'annie'])
+
+    def test_index_follows_renames(self):
+        self.joanna.username = 'jo'
+        self.joanna.save()
+        self.assertEqual(self.search('joanna'), [])
+        self.assertEqual(self.search('jo'), ['jo'])
+
+    def test_limit_is_clamped(self):
+        for limit, found in (('-1', ['ann']), ('0', ['ann']), ('2', ['ann', 'annie'])):
+            response = self.client.get('/search_users/', {'query': 'ann', 'limit': limit})
+            self.assertEqual([user['username'] for user in response.json()], found, limit)
+        self.assertEqual(self.client.get('/search_users/', {'query': 'ann', 'limit': 'all'}).status_code, 400)
+
+
+class StreamingListingTests(CleanStateTestCase):
+    def setUp(self):
+        super().setUp()
+        self.users = [User.objects.create(username=f'user{i}', first_name='Ünï') for i in range(5)]
+
+    def body(self, response):
+        return b''.join(response.streaming_content).decode()
+
+    def test_streams_the_same_json_array_in_chunks(self):
+        with self.settings(STREAM_CHUNK_SIZE=2):
+            response = self.client.get('/api/users/')
+            with self.assertNumQueries(3):
+                data = json.loads(self.body(response))
+        self.assertTrue(response.streaming)
+        self.assertEqual([user['username'] for user in data], [f'user{i}' for i in range(5)])
+        self.assertEqual(data[0]['first_name'], 'Ünï')
+        self.assertEqual(set(data[0]), {'id', 'username', 'email', 'first_name', 'last_name', 'last_login'})
+
+    def test_ndjson(self):
+        response = self.client.get('/api/users/?stream=ndjson')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = self.body(response).splitlines()
+        self.assertEqual([json.loads(line)['username'] for line in lines], [f'user{i}' for i in range(5)])
+        self.assertEqual(self.client.get('/api/users/?stream=xml').status_code, 400)
+
+    def test_paginated_mode_walks_every_row(self):
+        seen, cursor = [], None
+        while True:
+            url = '/api/users/?limit=2' + (f'&cursor={cursor}' if cursor else '')
+            page = self.client.get(url).json()
+            seen += [user['username'] for user in page['results']]
+            cursor = page['next_cursor']
+            if not cursor:
+                break
+        self.assertEqual(seen, [f'user{i}' for i in range(5)])
+        self.assertEqual(self.client.get('/api/users/?cursor=nope').status_code, 400)
+
+    def test_all_users_page(self):
+        response = self.client.get('/all_users/?limit=3')
+        self.assertContains(response, 'user2')
+        self.assertNotContains(response, 'user3')
+        self.assertContains(response, 'Next page')
+
+
+class ResponseCacheTests(CleanStateTestCase):
+    def setUp(self):
+        super().setUp()
+        self.ann = User.objects.create(username='ann')
+        self.bob = User.objects.create(username='bob')
+        Follows.objects.create(user_id=self.ann.id, following_user_id=self.bob.id)
+        self.post = Posts.objects.create(user_id=self.bob.id, content='hi')
+        rebuild_timeline(self.ann.id)
+
+    def feed(self):
+        return self.client.get('/api/follow_feed/ann/').json()
+
+    def test_repeat_reads_are_served_from_cache(self):
+        self.feed()
+        with self.assertNumQueries(1):  # just the username lookup
+            self.assertEqual(len(self.feed()), 1)
+        self.assertEqual(response_cache.stats()['feed']['hits'], 1)
+
+    def test_writes_invalidate_affected_readers(self):
+        self.assertEqual(self.feed()[0]['like_count'], 0)
+        self.client.post('/api/like_unlike/', json.dumps({'username': 'ann', 'post_id': self.post.post_id}),
+                         content_type='application/json')
+        self.assertEqual(self.feed()[0]['like_count'], 1)
+        self.assertTrue(self.feed()[0]['liked_by_user'])
+
+        profile = self.client.get('/user_profile/bob/').json()
+        self.client.post('/api/post_yeet/', json.dumps({'username': 'bob', 'post_content': 'again'}),
+                         content_type='application/json')
+        self.assertEqual(len(self.feed()), 2)
+        self.assertEqual(self.client.get('/user_profile/bob/').json()['posts_count'], profile['posts_count'] + 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/follow_toggle/', {'username': 'bob'}, **auth_header(self.ann))
+        self.assertEqual(self.feed(), [])
+        self.assertEqual(self.client.get('/user_profile/bob/').json()['followers_count'], 0)
+
+    def test_stats_are_staff_only(self):
+        self.assertEqual(self.client.get('/api/cache_stats/').status_code, 401)
+        staff = User.objects.create(username='staff', is_staff=True)
+        self.assertIn('profile', self.client.get('/api/cache_stats/', **auth_header(staff)).json())
+
+
+class ConditionalGetTests(CleanStateTestCase):
+    def setUp(self):
+        super().setUp()
+        self.ann = User.objects.create(username='ann')
+        self.post = Posts.objects.create(user_id=self.ann.id, content='hi')
+
+    def test_unchanged_resource_is_not_modified(self):
+        for url in ('/api/user_posts/ann/', '/user_profile/ann/', '/api/feedback/stats/', '/api/follow_feed/ann/'):
+            etag = self.client.get(url)['ETag']
+            with self.assertNumQueries(1 if 'feedback' not in url else 0):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304, url)
+            self.assertEqual(response.content, b'')
+
+    def test_write_changes_the_etag(self):
+        etag = self.client.get('/api/user_posts/ann/')['ETag']
+        self.client.post('/api/like_unlike/', json.dumps({'username': 'ann', 'post_id': self.post.post_id}),
+                         content_type='application/json')
+        response = self.client.get('/api/user_posts/ann/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+        etag = self.client.get('/api/feedback/stats/')['ETag']
+        self.client.post('/api/feedback/', {'likes_app': True, 'selected_reasons': ['fast']}, format='json')
+        response = self.client.get('/api/feedback/stats/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_etag_is_checked_without_the_cached_body(self):
+        etag = self.client.get('/api/user_posts/ann/')['ETag']
+        cache.delete(response_cache.response_key('user_posts', RequestFactory().get('/'), self.ann.id))
+        # Only the user lookup, the posts page isn't built again for a 304
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/user_posts/ann/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+    def test_no_etag_without_the_response_cache(self):
+        with self.settings(RESPONSE_CACHE_ENABLED=False):
+            response = self.client.get('/api/user_posts/ann/')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('ETag'))
+
+
+class CursorPaginationTests(CleanStateTestCase):
+    # (url, where the page's posts are in the body) for every keyset paginated endpoint
+    ENDPOINTS = (
+        ('/api/user_posts/ann/', 'results'),
+        ('/user_profile/ann/', 'posts'),
+        ('/api/follow_feed/bob/', 'results'),
+    )
+
+    def setUp(self):
+        super().setUp()
+        self.ann = User.objects.create(username='ann')
+        self.bob = User.objects.create(username='bob')
+        Follows.objects.create(user_id=self.bob.id, following_user_id=self.ann.id)
+        now = timezone.now()
+        # Six posts over three timestamps, the cursor has to break the ties on post_id
+        for n in range(6):
+            post = Posts.objects.create(user_id=self.ann.id, content=f'post {n}')
+            Posts.objects.filter(post_id=post.post_id).update(created_at=now - timedelta(minutes=n // 2))
+        rebuild_timeline(self.bob.id)
+        self.expected = list(Posts.objects.order_by('-created_at', '-post_id').values_list('post_id', flat=True))
+
+    def walk(self, url, field, limit):
+        pages, cursor = [], ''
+        while True:
+            data = self.client.get(url, {'limit': limit, 'cursor': cursor}).json()
+            pages.append([post['post_id'] for post in data[field]])
+            cursor = data['next_cursor']
+            if cursor is None:
+                return pages
+
+    def test_pages_cover_every_post_once(self):
+        for url, field in self.ENDPOINTS:
+            for limit in (1, 2, 4, 6, 7):
+                pages = self.walk(url, field, limit)
+                self.assertEqual([post_id for page in pages for post_id in page], self.expected, (url, limit))
+                # Only the last page is short, and a full last page doesn't point at an empty one
+                self.assertEqual([len(page) for page in pages[:-1]], [limit] * (len(pages) - 1), (url, limit))
+                self.assertTrue(pages[-1], (url, limit))
+
+    def test_bad_cursor_or_limit_is_a_bad_request(self):
+        for url, _ in self.ENDPOINTS:
+            for params in ({'cursor': 'not a cursor'}, {'cursor': encode_cursor(timezone.now(), 1)[:-3]},
+                           {'limit': 'ten'}):
+                response = self.client.get(url, params)
+                self.assertEqual(response.status_code, 400, (url, params))
+                self.assertIn('error', response.json())
+
+
+class HomeTimelineTests(CleanStateTestCase):
+    def setUp(self):
+        super().setUp()
+        self.ann, self.bob, self.cat, self.dan = (
+            User.objects.create(username=name) for name in ('ann', 'bob', 'cat', 'dan')
+        )
+        for follower in (self.ann, self.bob):
+            Follows.objects.create(user_id=follower.id, following_user_id=self.cat.id)
+
+    def inbox(self, user):
+        return list(HomeTimeline.objects.filter(user_id=user.id).order_by('post_id').values_list('post_id', flat=True))
+
+    def yeet(self, user, content):
+        response = self.client.post('/api/post_yeet/', json.dumps({'username': user.username, 'post_content': content}),
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        return Posts.objects.get(content=content)
+
+    def follow(self, user, username):
+        return self.client.post('/follow_toggle/', {'username': username}, **auth_header(user)).json()
+
+    def feed(self, user, limit):
+        # Every page of the user's feed, walked with the cursors
+        pages, cursor = [], ''
+        while True:
+            data = self.client.get(f'/api/follow_feed/{user.username}/?limit={limit}&cursor={cursor}').json()
+            pages.append([post['post_id'] for post in data['results']])
+            cursor = data['next_cursor']
+            if cursor is None:
+                return pages
+
+    def test_posting_pushes_into_followers_inboxes(self):
+        post = self.yeet(self.cat, 'hello')
+        self.assertEqual(self.inbox(self.ann), [post.post_id])
+        self.assertEqual(self.inbox(self.bob), [post.post_id])
+        self.assertEqual(self.inbox(self.dan), [])
+        self.assertEqual(self.inbox(self.cat), [])
+
+    def test_follow_backfills_and_unfollow_removes(self):
+        posts = [self.yeet(self.cat, f'cat {n}').post_id for n in range(3)]
+        dan_post = self.yeet(self.dan, 'dan').post_id
+        self.assertEqual(self.follow(self.ann, 'dan'), {'status': 'followed'})
+        self.assertEqual(self.inbox(self.ann), posts + [dan_post])
+        self.assertEqual(self.follow(self.ann, 'cat'), {'status': 'unfollowed'})
+        self.assertEqual(self.inbox(self.ann), [dan_post])
+        self.assertEqual(self.inbox(self.bob), posts)
+
+    @override_settings(TIMELINE_FANOUT_MAX_FOLLOWERS=1)
+    def test_pulled_posts_page_in_with_the_pushed_ones(self):
+        Follows.objects.create(user_id=self.ann.id, following_user_id=self.dan.id)
+        now = timezone.now()
+        # cat has two followers, one over the limit: cat's posts are pulled, dan's pushed
+        pushed, pulled = [], []
+        for n in range(4):
+            pushed.append(self.yeet(self.dan, f'dan {n}'))
+            pulled.append(self.yeet(self.cat, f'cat {n}'))
+        self.assertEqual(self.inbox(self.ann), [post.post_id for post in pushed])
+        self.assertIn(self.cat.id, pull_authors())
+        # Pairs of posts at the same time, across the two parts
+        for n, (dan_post, cat_post) in enumerate(zip(pushed, pulled)):
+            Posts.objects.filter(post_id__in=[dan_post.post_id, cat_post.post_id]).update(
+                created_at=now - timedelta(minutes=n),
+            )
+        HomeTimeline.objects.filter(user_id=self.ann.id).update(
+            created_at=Subquery(Posts.objects.filter(post_id=OuterRef('post_id')).values('created_at')),
+        )
+        cache.clear()
+
+        expected = list(
+            Posts.objects.filter(user_id__in=[self.cat.id, self.dan.id])
+            .order_by('-created_at', '-post_id').values_list('post_id', flat=True)
+        )
+        for limit in (1, 3, 8):
+            pages = self.feed(self.ann, limit)
+            self.assertEqual([post_id for page in pages for post_id in page], expected, limit)
+            self.assertTrue(all(len(page) <= limit for page in pages))
+
+    @override_settings(TIMELINE_FANOUT_MAX_FOLLOWERS=2)
+    def test_follow_past_the_limit_moves_the_author_to_the_pull_path(self):
+        post = self.yeet(self.cat, 'before')
+        self.assertNotIn(self.cat.id, pull_authors())
+        self.follow(self.dan, 'cat')
+        self.assertIn(self.cat.id, pull_authors())
+        # Nothing copied into dan's inbox, the feed pulls cat's posts instead
+        self.assertEqual(self.inbox(self.dan), [])
+        self.assertEqual(self.feed(self.dan, 10), [[post.post_id]])
+
+    @override_settings(TIMELINE_FANOUT_MAX_FOLLOWERS=1)
+    def test_lost_pull_authors_are_recounted_once(self):
+        cache.add(timeline.PULL_AUTHORS_LOCK, 1)
+        # Another request holds the lock and stores the set, this one waits for it instead of counting too
+        threading.Timer(0.1, lambda: cache.set(timeline.PULL_AUTHORS_KEY, {42}, None)).start()
+        with self.assertNumQueries(0):
+            self.assertEqual(pull_authors(), {42})
+
+        cache.clear()
+        out = io.StringIO()
+        call_command('refresh_pull_authors', stdout=out)
+        self.assertIn('1 pull path accounts', out.getvalue())
+        self.assertEqual(pull_authors(), {self.cat.id})
+
+
+class FeedEngineTests(CleanStateTestCase):
+    def setUp(self):
+        super().setUp()
+        self.ann, self.bob, self.cat = (User.objects.create(username=name) for name in ('ann', 'bob', 'cat'))
+        Follows.objects.create(user_id=self.ann.id, following_user_id=self.bob.id)
+        Follows.objects.create(user_id=self.ann.id, following_user_id=self.cat.id)
+        for n in range(6):
+            post = Posts.objects.create(user_id=(self.bob, self.cat)[n % 2].id, content=f'post {n}')
+        Likes.objects.create(user_id=self.ann.id, post_id=post.post_id)
+        rebuild_counters(Posts.objects.all())
+        rebuild_timeline(self.ann.id)
+
+    def test_sql_engine_is_one_statement_and_matches_the_timeline(self):
+        with self.assertNumQueries(1):
+            sql_page, sql_cursor = read_feed(self.ann.id, 4, engine='sql')
+        timeline_page, timeline_cursor = read_feed(self.ann.id, 4, engine='timeline')
+        self.assertEqual(sql_page, timeline_page)
+        self.assertEqual(sql_cursor, timeline_cursor)
+        self.assertTrue(sql_page[0]['liked_by_user'])
+        self.assertEqual(sql_page[0]['like_count'], 1)
+
+    def test_view_uses_the_configured_engine(self):
+        with self.settings(FEED_ENGINE='sql'):
+            data = self.client.get('/api/follow_feed/ann/?limit=4').json()
+            rest = self.client.get(f"/api/follow_feed/ann/?limit=4&cursor={data['next_cursor']}").json()
+        self.assertEqual(len(data['results']) + len(rest['results']), 6)
+        self.assertIsNone(rest['next_cursor'])
+
+    def test_merge_engine_interleaves_reyeets(self):
+        dan = User.objects.create(username='dan')
+        outsider_post = Posts.objects.create(user_id=dan.id, content='not followed')
+        bob_post = Posts.objects.filter(user_id=self.bob.id).order_by('post_id').first()
+        Retweets.objects.create(user_id=self.cat.id, post_id=outsider_post.post_id)
+        Retweets.objects.create(user_id=self.cat.id, post_id=bob_post.post_id)
+
+        # A cutoff seek and a bounded read per stream kind, the newer reyeets check and the two viewer flag lookups
+        with self.assertNumQueries(7):
+            page, cursor = read_feed(self.ann.id, 2, engine='merge')
+        self.assertEqual([post['reyeeted_by'] for post in page], ['cat', 'cat'])
+        self.assertEqual(page[0]['post_id'], bob_post.post_id)
+        self.assertEqual(page[1]['post_id'], outsider_post.post_id)
+
+        while cursor:
+            more, cursor = read_feed(self.ann.id, 2, decode_cursor(cursor), engine='merge')
+            page += more
+        # bob's reyeeted post only shows up once, as the reyeet
+        self.assertEqual(len(page), 7)
+        self.assertEqual(len({post['post_id'] for post in page}), 7)
+        self.assertEqual(sum(post['reyeeted_by'] is None for post in page), 5)
+
+    def test_merge_pages_follow_the_reference_order_through_ties(self):
+        dan = User.objects.create(username='dan')
+        outsider_post = Posts.objects.create(user_id=dan.id, content='not followed')
+        bob_post = Posts.objects.filter(user_id=self.bob.id).order_by('post_id').first()
+        now = timezone.now()
+        # bob and cat reyeet dan's post at the same time, and cat reyeets bob's post the moment it's posted
+        Retweets.objects.create(user_id=self.bob.id, post_id=outsider_post.post_id)
+        Retweets.objects.create(user_id=self.cat.id, post_id=outsider_post.post_id)
+        Retweets.objects.filter(post_id=outsider_post.post_id).update(retweet_timestamp=now)
+        reyeet = Retweets.objects.create(user_id=self.cat.id, post_id=bob_post.post_id)
+        Retweets.objects.filter(retweet_id=reyeet.retweet_id).update(retweet_timestamp=bob_post.created_at)
+
+        # Every appearance of the followees' posts and reyeets in the merge order, each post at its first one
+        appearances = [((post.created_at, post.post_id), post.post_id)
+                       for post in Posts.objects.filter(user_id__in=[self.bob.id, self.cat.id])]
+        appearances += [((retweet.retweet_timestamp, -retweet.retweet_id), retweet.post_id)
+                        for retweet in Retweets.objects.all()]
+        expected = []
+        for _, post_id in sorted(appearances, reverse=True):
+            if post_id not in expected:
+                expected.append(post_id)
+
+        for limit in (1, 2, 3, 7):
+            page, cursor = read_feed(self.ann.id, limit, engine='merge')
+            walked = [post['post_id'] for post in page]
+            while cursor:
+                page, cursor = read_feed(self.ann.id, limit, decode_cursor(cursor), engine='merge')
+                walked += [post['post_id'] for post in page]
+            self.assertEqual(walked, expected, limit)
+
+    def test_first_batches_stop_at_each_authors_cutoff(self):
+        # Every bob post at the same time, the cutoff can't tell them apart
+        Posts.objects.filter(user_id=self.bob.id).update(created_at=timezone.now())
+        # ann's own post isn't hers to read, she doesn't follow herself
+        Posts.objects.create(user_id=self.ann.id, content='mine')
+        newest = Posts.objects.order_by('-created_at', '-post_id')
+        batches = first_batches(newest, self.ann.id, 'created_at', 2, 10)
+        self.assertEqual(set(batches), {self.bob.id, self.cat.id})
+        for author in (self.bob, self.cat):
+            expected = list(newest.filter(user_id=author.id).values_list('post_id', flat=True)[:2])
+            self.assertEqual([post.post_id for post in batches[author.id]], expected)
+
+    def test_only_followees_that_can_reach_the_page_are_read(self):
+        newest = Posts.objects.order_by('-created_at', '-post_id')
+
+        def rows_statement():
+            with CaptureQueriesContext(connection) as queries:
+                batches = first_batches(newest, self.ann.id, 'created_at', 2, 3)
+            return set(batches), queries[-1]['sql']
+
+        def follow_older_authors(start, count):
+            for n in range(start, start + count):
+                author = User.objects.create(username=f'older{n}')
+                Follows.objects.create(user_id=self.ann.id, following_user_id=author.id)
+                post = Posts.objects.create(user_id=author.id, content=f'older {n}')
+                Posts.objects.filter(post_id=post.post_id).update(created_at=timezone.now() - timedelta(days=n + 1))
+
+        follow_older_authors(0, 5)
+        authors, sql = rows_statement()
+        # bob's and cat's heads and the newest of the older ones cover a page of 2 and its next cursor
+        self.assertEqual(authors, {self.bob.id, self.cat.id, User.objects.get(username='older0').id})
+        follow_older_authors(5, 30)
+        self.assertEqual(rows_statement(), (authors, sql))
+
+    def test_reyeet_refreshes_followers_merge_feed(self):
+        post = Posts.objects.create(user_id=self.ann.id, content='mine')
+        with self.settings(FEED_ENGINE='merge'):
+            before = self.client.get('/api/follow_feed/ann/?limit=3').json()['results']
+            self.client.post('/api/reyeet_unreyeet/', {'username': 'bob', 'post_id': post.post_id},
+                             content_type='application/json')
+            after = self.client.get('/api/follow_feed/ann/?limit=3').json()['results']
+        self.assertNotIn(post.post_id, [item['post_id'] for item in before])
+        self.assertEqual((after[0]['post_id'], after[0]['reyeeted_by']), (post.post_id, 'bob'))
+
+
+class ConcurrentToggleTests(TransactionTestCase):
+    # Committed data: every thread toggles on a connection of its own
+    THREADS = 12
+    TOGGLES = 20
+
+    def setUp(self):
+        # Known once the test database is set up
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest('in-memory SQLite locks whole tables between connections, run it on MySQL or a file database')
+        cache.clear()
+        social_graph.clear()
+        user_directory.clear()
+        auth_users.clear()
+        self.author = User.objects.create(username='author')
+        self.fans = [User.objects.create(username=f'fan{n}') for n in range(3)]
+        self.post = Posts.objects.create(user_id=self.author.id, content='hammered')
+
+    def hammer(self, toggle):
+        # Every thread double taps every fan at once, returns the sum of the changes each fan saw
+        start = threading.Barrier(self.THREADS)
+        changes = {fan.id: [] for fan in self.fans}
+        errors = []
+
+        def run():
+            try:
+                start.wait()
+                for n in range(self.TOGGLES):
+                    fan = self.fans[n % len(self.fans)]
+                    changes[fan.id].append(toggle(fan.id))
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=run) for _ in range(self.THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        return {fan_id: sum(seen) for fan_id, seen in changes.items()}
+
+    def counted(self):
+        # (likes, retweets) on the posts row plus its shards, the post gets hot enough to be promoted
+        self.post.refresh_from_db()
+        sharded_likes, sharded_retweets = summed_shards([self.post.post_id]).get(self.post.post_id, (0, 0))
+        return {Likes: self.post.like_count + sharded_likes, Retweets: self.post.retweet_count + sharded_retweets}
+
+    def test_likes_and_reyeets_stay_counted(self):
+        for model in COUNTERS:
+            net = self.hammer(lambda fan_id: toggle_engagement(model, fan_id, self.post.post_id))
+            rows = model.objects.filter(post_id=self.post.post_id)
+            for fan in self.fans:
+                # Each fan ends with the row iff their toggles added up to one
+                self.assertEqual(rows.filter(user_id=fan.id).count(), net[fan.id])
+            self.assertEqual(self.counted()[model], rows.count())
+
+    def test_sharded_counters_stay_counted(self):
+        promote(self.post.post_id)
+        self.hammer(lambda fan_id: toggle_engagement(Likes, fan_id, self.post.post_id))
+        self.assertEqual(self.counted()[Likes], Likes.objects.filter(post_id=self.post.post_id).count())
+
+    def test_follows_stay_single(self):
+        net = self.hammer(lambda fan_id: toggle_row(Follows, user_id=fan_id, following_user_id=self.author.id))
+        for fan in self.fans:
+            self.assertEqual(
+                Follows.objects.filter(user_id=fan.id, following_user_id=self.author.id).count(), net[fan.id],
+            )
+
+
+class WriteBehindTests(CleanStateTestCase):
+    def setUp(self):
+        super().setUp()
+        self.author = User.objects.create(username='author')
+        self.fans = [User.objects.create(username=f'fan{n}') for n in range(3)]
+        self.post = Posts.objects.create(user_id=self.author.id, content='popular', like_count=1)
+        Likes.objects.create(user_id=self.fans[0].id, post_id=self.post.post_id)
+        # No worker thread, it would flush on a connection outside the test transaction
+        self.buffer = write_behind.EngagementBuffer(background=False)
+
+    def test_toggles_coalesce_until_the_flush(self):
+        post_id = self.post.post_id
+        changes = [
+            self.buffer.toggle(Likes, self.fans[0].id, post_id),
+            self.buffer.toggle(Likes, self.fans[1].id, post_id),
+            # A double tap cancels out
+            self.buffer.toggle(Likes, self.fans[2].id, post_id),
+            self.buffer.toggle(Likes, self.fans[2].id, post_id),
+            self.buffer.toggle(Retweets, self.fans[1].id, post_id),
+        ]
+        self.assertEqual(changes, [-1, 1, 1, -1, 1])
+        self.assertEqual(len(self.buffer), 3)
+        self.assertEqual(list(Likes.objects.values_list('user_id', flat=True)), [self.fans[0].id])
+
+        posts_version = cache.get(response_cache.version_key('posts', self.author.id))
+        self.assertEqual(self.buffer.flush(), 3)
+        self.assertEqual(list(Likes.objects.values_list('user_id', flat=True)), [self.fans[1].id])
+        self.post.refresh_from_db()
+        self.assertEqual((self.post.like_count, self.post.retweet_count), (1, 1))
+        self.assertNotEqual(cache.get(response_cache.version_key('posts', self.author.id)), posts_version)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.buffer.flush(), 0)
+
+    def test_failed_flush_keeps_the_toggles(self):
+        self.buffer.toggle(Likes, self.fans[1].id, self.post.post_id)
+        with mock.patch.object(write_behind, 'write_events', side_effect=DatabaseError('gone')), \
+                self.assertLogs('project1.write_behind', 'ERROR'):
+            self.assertEqual(self.buffer.flush(), 0)
+        self.assertEqual(len(self.buffer), 1)
+        self.assertEqual(self.buffer.flush(), 1)
+        self.assertTrue(Likes.objects.filter(user_id=self.fans[1].id).exists())
+
+    def test_buffered_endpoint_falls_back_to_sync_when_full(self):
+        def like(fan):
+            return self.client.post(
+                '/api/like_unlike/', {'username': fan.username, 'post_id': self.post.post_id},
+                content_type='application/json',
+            )
+
+        with self.settings(ENGAGEMENT_WRITE_MODE='buffered', ENGAGEMENT_BUFFER_MAX=1), \
+                mock.patch.object(write_behind, 'engagement_buffer', self.buffer):
+            self.assertEqual(like(self.fans[1]).status_code, 201)
+            self.assertFalse(Likes.objects.filter(user_id=self.fans[1].id).exists())
+            self.assertEqual(like(self.fans[2]).status_code, 201)
+            self.assertTrue(Likes.objects.filter(user_id=self.fans[2].id).exists())
+            self.buffer.drain()
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.like_count, 3)
+        self.assertEqual(Likes.objects.count(), 3)
+
+
+class BatchMutationTests(CleanStateTestCase):
+    def setUp(self):
+        super().setUp()
+        self.ann = User.objects.create(username='ann')
+        self.bob = User.objects.create(username='bob')
+        self.posts = [Posts.objects.create(user_id=self.bob.id, content=f'post {n}') for n in range(2)]
+
+    def send(self, mutations, user=None):
+        return self.client.post('/api/batch/', {'mutations': mutations}, content_type='application/json',
+                                **auth_header(user or self.ann))
+
+    def test_applies_in_order_and_replays_by_key(self):
+        first, second = (post.post_id for post in self.posts)
+        mutations = [
+            {'key': 'k1', 'op': 'like', 'post_id': first},
+            {'key': 'k2', 'op': 'like', 'post_id': second},
+            {'key': 'k3', 'op': 'unlike', 'post_id': second},
+            {'key': 'k4', 'op': 'reyeet', 'post_id': first},
+            {'key': 'k5', 'op': 'follow', 'username': 'bob'},
+            {'key': 'k6', 'op': 'post', 'content': 'written offline', 'location_name': 'Denver, CO'},
+            {'key': 'k7', 'op': 'like', 'post_id': 999999},
+            {'key': 'k8', 'op': 'shout'},
+            {'op': 'like', 'post_id': first},
+            {'key': 'k1', 'op': 'unlike', 'post_id': first},
+        ]
+        response = self.send(mutations)
+        self.assertEqual(response.status_code, 200)
+        results = response.json()['results']
+        self.assertEqual([result['status'] for result in results], ['applied'] * 6 + ['error'] * 3 + ['applied'])
+        self.assertTrue(results[-1]['replayed'])
+        self.assertEqual(results[-1]['op'], 'like')
+
+        self.assertEqual(list(Likes.objects.values_list('post_id', flat=True)), [first])
+        self.assertEqual(list(Posts.objects.filter(post_id__in=[first, second]).order_by('post_id')
+                              .values_list('like_count', 'retweet_count')), [(1, 1), (0, 0)])
+        self.assertTrue(Follows.objects.filter(user_id=self.ann.id, following_user_id=self.bob.id).exists())
+        post = Posts.objects.get(post_id=results[5]['post_id'])
+        self.assertEqual((post.user_id, post.location_name), (self.ann.id, 'Denver, CO'))
+
+        # The app resends its whole queue after a timeout: nothing is applied twice
+        replayed = self.send(mutations).json()['results']
+        self.assertEqual(Posts.objects.filter(user_id=self.ann.id).count(), 1)
+        self.assertEqual(Likes.objects.count(), 1)
+        for before, after in zip(results, replayed):
+            if before['status'] == 'applied' or before.get('key'):
+                self.assertEqual({**before, 'replayed': True}, after)
+        self.assertEqual(IdempotencyKeys.objects.filter(user_id=self.ann.id).count(), 8)
+        # Keys belong to their user
+        self.assertNotIn('replayed', self.send([{'key': 'k1', 'op': 'like', 'post_id': first}], self.bob).json()['results'][0])
+
+    def test_rejects_bad_requests(self):
+        self.assertEqual(self.client.post('/api/batch/', {'mutations': []}, content_type='application/json').status_code, 401)
+        self.assertEqual(self.send([]).status_code, 400)
+        with self.settings(BATCH_MAX_MUTATIONS=2):
+            self.assertEqual(self.send([{'key': str(n), 'op': 'post', 'content': 'x'} for n in range(3)]).status_code, 400)
+        self.assertEqual(self.send([{'key': 'me', 'op': 'follow', 'username': 'ann'}]).json()['results'][0]['status'], 'error')
+
+    def test_prune_command(self):
+        IdempotencyKeys.objects.create(user_id=self.ann.id, key='old', result={})
+        IdempotencyKeys.objects.filter(key='old').update(created_at=timezone.now() - timedelta(days=30))
+        IdempotencyKeys.objects.create(user_id=self.ann.id, key='new', result={})
+        call_command('prune_idempotency_keys', stdout=io.StringIO())
+        self.assertEqual(list(IdempotencyKeys.objects.values_list('key', flat=True)), ['new'])
+
+
+@override_settings(RESPONSE_CACHE_ENABLED=True)
+class AsyncViewTests(TransactionTestCase):
+    # Committed data: the async views read on connections of their own threads
+    def setUp(self):
+        cache.clear()
+        social_graph.clear()
+        user_directory.clear()
+        auth_users.clear()
+        self.ann = User.objects.create(username='ann')
+        self.bob = User.objects.create(username='bob')
+        Follows.objects.create(user_id=self.ann.id, following_user_id=self.bob.id)
+        for n in range(3):
+            post = Posts.objects.create(user_id=self.bob.id, content=f'post {n}')
+            Likes.objects.create(user_id=self.ann.id, post_id=post.post_id)
+        rebuild_timeline(self.ann.id)
+
+    def test_same_responses_as_the_sync_views(self):
+        pairs = [
+            ('/api/follow_feed/ann/?limit=2', '/api/async/follow_feed/ann/?limit=2'),
+            ('/user_profile/ann/', '/async/user_profile/ann/'),
+        ]
+        for sync_url, async_url in pairs:
+            with self.settings(RESPONSE_CACHE_ENABLED=False):
+                expected = self.client.get(sync_url, **auth_header(self.bob)).json()
+                response = self.client.get(async_url, **auth_header(self.bob))
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json(), expected)
+
+    def test_asgi_middleware_chain_stays_async(self):
+        # With DEBUG on Django logs every middleware it has to adapt, the profiler's is thrown away since it's off
+        with self.settings(DEBUG=True), self.assertLogs('django.request', 'DEBUG') as logs:
+            logging.getLogger('django.request').debug('loading')
+            ASGIHandler()
+        adapted = [
+            record.getMessage() for record in logs.records
+            if 'adapted' in record.getMessage() and 'ProfilingMiddleware' not in record.getMessage()
+        ]
+        self.assertEqual(adapted, [])
+
+    def test_conditional_get_and_errors(self):
+        etag = self.client.get('/async/user_profile/bob/')['ETag']
+        self.assertEqual(self.client.get('/async/user_profile/bob/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual(self.client.get('/async/user_profile/nobody/').status_code, 404)
+        self.assertEqual(self.client.get('/async/user_profile/bob/', HTTP_AUTHORIZATION='Bearer nope').status_code, 401)
+        self.assertEqual(self.client.get('/api/async/follow_feed/ann/?cursor=bad').status_code, 400)
+
+
+class ExplainHotPathsTests(CleanStateTestCase):
+    def test_hot_paths_use_indexes(self):
+        out = io.StringIO()
+        call_command('explain_hot_paths', '--seed', '10', stdout=out)
+        self.assertIn('no full scans', out.getvalue())
+
+
+class MetricsTests(CleanStateTestCase):
+    def setUp(self):
+        super().setUp()
+        metrics.registry.clear()
+        self.ann = User.objects.create(username='ann')
+        self.admin = User.objects.create(username='admin', is_staff=True)
+
+    def test_records_routes_in_prometheus_format(self):
+        self.client.get('/api/follow_feed/ann/?limit=5')
+        self.assertEqual(self.client.get('/api/metrics/').status_code, 403)
+        with self.settings(METRICS_TOKEN='scrape'):
+            self.assertEqual(self.client.get('/api/metrics/', HTTP_AUTHORIZATION='Bearer scrape').status_code, 200)
+        body = self.client.get('/api/metrics/', **auth_header(self.admin)).content.decode()
+        self.assertIn('http_requests_total{route="get_following_feed",method="GET",status="200"} 1', body)
+        self.assertIn('http_request_db_queries_count{route="get_following_feed"} 1', body)
+        self.assertIn('response_cache_misses_total{view="feed"} 1', body)
+
+    def test_warns_when_a_route_goes_over_its_query_budget(self):
+        with self.settings(QUERY_BUDGETS={'get_following_feed': 0}), self.assertLogs('project1.metrics', 'WARNING') as logs:
+            self.client.get('/api/follow_feed/ann/?limit=5')
+        self.assertEqual(logs.records[0].query_budget['route'], 'get_following_feed')
+        self.assertGreater(logs.records[0].query_budget['queries'], 0)
+        self.assertEqual(metrics.registry.snapshot()['get_following_feed'].over_budget, 1)
+
+    def test_async_requests_stay_async(self):
+        async def view(request):
+            await sync_to_async(User.objects.count)()
+            return HttpResponse('ok')
+
+        middleware = MetricsMiddleware(view)
+        self.assertTrue(iscoroutinefunction(middleware))
+        response = async_to_sync(middleware)(RequestFactory().get('/anywhere/'))
+        self.assertEqual(response.status_code, 200)
+        recorded = metrics.registry.snapshot()[metrics.UNRESOLVED]
+        self.assertEqual(recorded.requests, {('GET', 200): 1})
+        self.assertEqual(recorded.queries.sum, 1)
+
+
+class BenchmarkCommandTests(CleanStateTestCase):
+    def test_seed_data_and_bench_every_route(self):
+        call_command('seed_data', '--users', '40', '--prefix', 'bench_seed', stdout=io.StringIO())
+        self.assertEqual(User.objects.filter(username__startswith='bench_seed').count(), 40)
+        self.assertTrue(Posts.objects.filter(latitude__isnull=False).exists())
+        self.assertEqual(rebuild_counters(Posts.objects.all(), fix=False), [])
+        with self.assertRaises(CommandError):
+            call_command('seed_data', '--users', '5', '--prefix', 'bench_seed')
+
+        out = io.StringIO()
+        call_command('bench_endpoints', '--requests', '2', '--warmup', '0', '--json', stdout=out)
+        report = json.loads(out.getvalue())
+        self.assertEqual(report['not_benchmarked'], [])
+        self.assertEqual(report['meta']['users'], 40)
+        for route, row in report['routes'].items():
+            # The async views read on their own connections, which can't see this test's transaction
+            if not route.endswith('_async'):
+                self.assertLess(row['status'], 500, route)
+        self.assertEqual(report['routes']['get_following_feed']['status'], 200)
+        self.assertGreater(report['routes']['get_following_feed']['queries_max'], 0)
+
+
+class QueryBudgetTests(CleanStateTestCase):
+    """
+    Queries per request for every view in project1.views, on a cold cache,
+    with 10 posts and again with 1000. None of them may grow with the data.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.viewer = User.objects.create(username='viewer', email='viewer@example.com')
+        self.authors = [User.objects.create(username=f'author{i}') for i in range(4)]
+        self.fans = [User.objects.create(username=f'fan{i}') for i in range(6)]
+        for user in [self.viewer] + self.fans:
+            for author in self.authors:
+                Follows.objects.create(user_id=user.id, following_user_id=author.id)
+        ProfilePics.objects.create(user_id=self.authors[0].id, photo_path='author0.jpg')
+
+    def grow_to(self, total):
+        # Posts spread over the authors, each liked and reyeeted by some fans, and a survey per 10 posts
+        start = Posts.objects.count()
+        Posts.objects.bulk_create(
+            Posts(user_id=self.authors[n % len(self.authors)].id, content=f'yeet {n}', latitude=40.7, longitude=-74.0)
+            for n in range(start, total)
+        )
+        new_posts = list(Posts.objects.order_by('post_id')[start:])
+        Likes.objects.bulk_create(
+            Likes(user_id=fan.id, post_id=post.post_id)
+            for n, post in enumerate(new_posts) for fan in self.fans[:n % len(self.fans) + 1]
+        )
+        Likes.objects.bulk_create(Likes(user_id=self.viewer.id, post_id=post.post_id) for post in new_posts[::2])
+        Retweets.objects.bulk_create(
+            Retweets(user_id=self.authors[(n + 1) % len(self.authors)].id, post_id=post.post_id)
+            for n, post in enumerate(new_posts[::3])
+        )
+        FeedbackSurvey.objects.bulk_create(
+            FeedbackSurvey(likes_app=n % 3 > 0, selected_reasons=['Performance', 'Features'])
+            for n in range(start // 10, total // 10)
+        )
+        rebuild_counters(Posts.objects.all())
+        for user in [self.viewer] + self.fans:
+            rebuild_timeline(user.id)
+
+    def requests(self):
+        author = self.authors[0]
+        post = Posts.objects.filter(user_id=author.id).order_by('-post_id').first()
+        follow = Follows.objects.order_by('follow_id').first()
+        viewer = auth_header(self.viewer)
+        toggle = {'username': self.viewer.username, 'post_id': post.post_id}
+        ids = ','.join(str(user.id) for user in self.authors + self.fans)
+        # (name, method, url, body, headers, settings, queries)
+        return [
+            ('feed', 'GET', '/api/follow_feed/viewer/?limit=20', None, {}, {}, 5),
+            ('feed, whole timeline', 'GET', '/api/follow_feed/viewer/', None, {}, {}, 5),
+            ('feed, sql engine', 'GET', '/api/follow_feed/viewer/?limit=20', None, {}, {'FEED_ENGINE': 'sql'}, 3),
+            ('feed, merge engine', 'GET', '/api/follow_feed/viewer/?limit=20', None, {}, {'FEED_ENGINE': 'merge'}, 10),
+            ('user posts', 'GET', '/api/user_posts/author0/?limit=20', None, {}, {}, 4),
+            ('user profile', 'GET', '/user_profile/author0/?limit=20', None, viewer, {}, 12),
+            ('user profile, anonymous', 'GET', '/user_profile/author0/?limit=20', None, {}, {}, 6),
+            ('user info, follows', 'GET', '/api/user/viewer/Follows/', None, {}, {}, 2),
+            ('user info, followers', 'GET', '/api/user/author0/Following/', None, {}, {}, 2),
+            ('user info, posts', 'GET', '/api/user/author0/Posts/', None, {}, {}, 2),
+            ('username', 'GET', f'/api/username/{author.id}/', None, {}, {}, 1),
+            ('usernames', 'GET', f'/api/usernames/?ids={ids}', None, {}, {}, 1),
+            ('follow usernames', 'GET', f'/api/follow-usernames/{follow.follow_id}/', None, {}, {}, 2),
+            ('profile pic', 'GET', f'/api/profile_pic/?user_id={author.id}', None, {}, {}, 1),
+            ('search', 'GET', '/search_users/?query=auth', None, viewer, {}, 6),
+            ('feedback stats', 'GET', '/api/feedback/stats/', None, {}, {}, 4),
+            ('check user', 'POST', '/check_user/', {'email': 'viewer@example.com'}, {}, {}, 1),
+            ('validate signup', 'POST', '/validate_new_user/', {'username': 'new', 'email': 'new@example.com'}, {}, {}, 2),
+            ('google login', 'POST', '/auth/google-login/', {'email': 'viewer@example.com'}, {}, {}, 2),
+            ('like', 'POST', '/api/like_unlike/', toggle, {}, {}, 7),
+            ('reyeet', 'POST', '/api/reyeet_unreyeet/', toggle, {}, {}, 8),
+            ('yeet', 'POST', '/api/post_yeet/', {'username': 'author0', 'post_content': 'new'}, {}, {}, 4),
+            ('follow', 'POST', '/follow_toggle/', {'username': 'fan0'}, viewer, {}, 9),
+            ('batch', 'POST', '/api/batch/', {'mutations': [
+                {'key': 'a', 'op': 'like', 'post_id': post.post_id},
+                {'key': 'b', 'op': 'reyeet', 'post_id': post.post_id},
+                {'key': 'c', 'op': 'unfollow', 'username': 'author1'},
+                {'key': 'd', 'op': 'post', 'content': 'offline'},
+            ]}, viewer, {}, 15),
+            ('submit feedback', 'POST', '/api/feedback/', {'likes_app': True, 'selected_reasons': []}, viewer, {}, 3),
+            ('users page', 'GET', '/api/users/?limit=50', None, {}, {}, 1),
+            ('follows page', 'GET', '/api/follows/?limit=50', None, {}, {}, 1),
+            ('posts page', 'GET', '/view_all_posts/?limit=50', None, {}, {}, 1),
+            ('all posts page', 'GET', '/all_posts/?limit=50', None, {}, {}, 1),
+            ('all users template page', 'GET', '/all_users/', None, {}, {}, 1),
+            # Streamed: one query per STREAM_CHUNK_SIZE rows, so one for these sizes
+            ('users stream', 'GET', '/api/users/', None, {}, {}, 1),
+            ('posts stream', 'GET', '/view_all_posts/', None, {}, {}, 1),
+        ]
+
+    def count(self, method, url, body, headers, overrides):
+        cache.clear()
+        social_graph.clear()
+        user_directory.clear()
+        auth_users.clear()
+        # Writes are rolled back so both fixture sizes see the same starting state
+        with self.settings(**overrides), transaction.atomic(), CaptureQueriesContext(connection) as queries:
+            if method == 'GET':
+                response = self.client.get(url, **headers)
+            else:
+                response = self.client.post(url, body, content_type='application/json', **headers)
+            response.getvalue()
+            transaction.set_rollback(True)
+        self.assertLess(response.status_code, 400, url)
+        return len(queries)
+
+    def measure(self):
+        return {
+            name: self.count(method, url, body, headers, overrides)
+            for name, method, url, body, headers, overrides, _ in self.requests()
+        }
+
+    def test_query_counts_do_not_grow_with_the_data(self):
+        self.maxDiff = None
+        self.grow_to(10)
+        small = self.measure()
+        self.grow_to(1000)
+        large = self.measure()
+        expected = {name: queries for name, *_, queries in self.requests()}
+        self.assertEqual(small, large)
+        self.assertEqual(large, expected)
+
+
+class ProfilingTests(CleanStateTestCase):
+    def setUp(self):
+        super().setUp()
+        self.store = tempfile.TemporaryDirectory()
+        self.addCleanup(self.store.cleanup)
+        self.admin = User.objects.create(username='admin', is_staff=True)
+        self.ann = User.objects.create(username='ann')
+
+    def profiled_client(self, **overrides):
+        # Middleware is set up on a client's first request, so settings go in first
+        self.enterContext(self.settings(PROFILING_ENABLED=True, PROFILING_DIR=self.store.name, **overrides))
+        return Client()
+
+    def test_signed_header_profiles_the_request(self):
+        client = self.profiled_client()
+        self.assertNotIn('X-Profile-Id', client.get('/api/user_posts/ann/'))
+        self.assertNotIn('X-Profile-Id', client.get('/api/user_posts/ann/', HTTP_X_PROFILE_REQUEST='forged'))
+        response = client.get('/api/user_posts/ann/', HTTP_X_PROFILE_REQUEST=profiling.make_token())
+        profile_id = response['X-Profile-Id']
+
+        listed = client.get('/api/profiles/', **auth_header(self.admin)).json()
+        self.assertEqual([profile['id'] for profile in listed], [profile_id])
+        self.assertEqual(listed[0]['route'], 'get_user_posts')
+        self.assertGreater(listed[0]['query_count'], 0)
+        stored = json.loads(b''.join(
+            client.get(f'/api/profiles/{profile_id}/?as=json', **auth_header(self.admin)).streaming_content
+        ))
+        self.assertIn('FROM "auth_user"', stored['queries'][0]['sql'])
+        text = client.get(f'/api/profiles/{profile_id}/?as=text', **auth_header(self.admin)).content.decode()
+        self.assertIn('get_user_posts', text)
+        self.assertEqual(client.get(f'/api/profiles/{profile_id}/', **auth_header(self.ann)).status_code, 403)
+        self.assertEqual(client.get('/api/profiles/../../etc/', **auth_header(self.admin)).status_code, 404)
+
+    def test_sampling_and_rotation(self):
+        client = self.profiled_client(PROFILING_SAMPLE_RATE=1.0, PROFILING_MAX_FILES=2)
+        for _ in range(3):
+            client.get('/api/user_posts/ann/')
+        self.assertEqual(len(profiling.list_profiles()), 2)
+        self.assertEqual(profiling.list_profiles()[0]['reason'], 'sample')
+
+
+class SlowQueryLogTests(CleanStateTestCase):
+    def setUp(self):
+        super().setUp()
+        slow_queries.store.clear()
+        self.addCleanup(slow_queries.store.clear)
+        self.admin = User.objects.create(username='admin', is_staff=True)
+        self.ann = User.objects.create(username='ann')
+        self.posts = Posts.objects.bulk_create(Posts(user_id=self.ann.id, content=f'yeet {n}') for n in range(5))
+
+    def run_request(self, work, view='test_view'):
+        token = slow_queries.start_request(None)
+        try:
+            work()
+        finally:
+            slow_queries.finish_request(token, view)
+
+    def test_fingerprint(self):
+        self.assertEqual(
+            slow_queries.fingerprint("SELECT * FROM posts WHERE post_id IN (%s, %s,%s) AND content = 'it''s'  LIMIT 21"),
+            'SELECT * FROM posts WHERE post_id IN (...) AND content = ? LIMIT ?',
+        )
+
+    def test_query_in_a_loop_is_logged_with_caller_and_plan(self):
+        def loop():
+            for post in self.posts:
+                Posts.objects.filter(post_id=post.post_id).first()
+
+        with self.settings(SLOW_QUERY_REPEAT_THRESHOLD=5), self.assertLogs('project1.slow_queries', 'WARNING'):
+            self.run_request(loop)
+            self.run_request(lambda: Posts.objects.filter(post_id=self.posts[0].post_id).first())
+        [entry] = slow_queries.store.report()
+        self.assertEqual(entry['reasons'], ['repeated'])
+        self.assertEqual((entry['requests'], entry['executions'], entry['max_executions_per_request']), (1, 5, 5))
+        [place] = entry['callers']
+        self.assertRegex(place, r'^test_view \(project1/tests\.py:\d+ in loop\)$')
+        self.assertIn('"posts"', entry['fingerprint'])
+        self.assertTrue(entry['explain'])
+
+    def test_async_requests_are_logged(self):
+        async def view(request):
+            await sync_to_async(lambda: Posts.objects.filter(post_id=self.posts[0].post_id).first())()
+            return HttpResponse('ok')
+
+        middleware = SlowQueryMiddleware(view)
+        self.assertTrue(iscoroutinefunction(middleware))
+        with self.settings(SLOW_QUERY_THRESHOLD_MS=0), self.assertLogs('project1.slow_queries', 'WARNING'):
+            async_to_sync(middleware)(RequestFactory().get('/anywhere/'))
+        [entry] = slow_queries.store.report()
+        self.assertEqual(entry['reasons'], ['slow'])
+        self.assertTrue(entry['explain'])
+
+    def test_slow_queries_are_aggregated_by_fingerprint(self):
+        with self.settings(SLOW_QUERY_THRESHOLD_MS=0, SLOW_QUERY_MAX_FINGERPRINTS=2), \
+                self.assertLogs('project1.slow_queries', 'WARNING'):
+            for post in self.posts:
+                self.run_request(lambda: Posts.objects.filter(post_id=post.post_id).first())
+            self.run_request(lambda: Posts.objects.filter(user_id=self.ann.id).count())
+            self.run_request(lambda: User.objects.filter(id=self.ann.id).exists())
+        report = slow_queries.store.report()
+        self.assertEqual(len(report), 2)
+        self.assertFalse(any('"post_id" = ?' in entry['fingerprint'] for entry in report))
+
+        with self.settings(SLOW_QUERY_THRESHOLD_MS=0), self.assertLogs('project1.slow_queries', 'WARNING'):
+            for post in self.posts:
+                self.run_request(lambda: Posts.objects.filter(post_id=post.post_id).first())
+        entry = next(entry for entry in slow_queries.store.report() if '"post_id" = ?' in entry['fingerprint'])
+        self.assertEqual((entry['requests'], entry['executions'], entry['reasons']), (5, 5, ['slow']))
+
+    def test_staff_endpoint(self):
+        with self.settings(SLOW_QUERY_THRESHOLD_MS=0), self.assertLogs('project1.slow_queries', 'WARNING'):
+            self.run_request(lambda: Posts.objects.filter(user_id=self.ann.id).count())
+        self.assertEqual(self.client.get('/api/slow_queries/', **auth_header(self.ann)).status_code, 403)
+        listed = self.client.get('/api/slow_queries/', **auth_header(self.admin)).json()
+        self.assertEqual(len(listed['queries']), 1)
+        self.assertEqual(self.client.delete('/api/slow_queries/', **auth_header(self.admin)).status_code, 204)
+        self.assertEqual(slow_queries.store.report(), [])
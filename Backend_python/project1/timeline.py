@@ -0,0 +1,233 @@
+import time
+from heapq import merge
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count
+
+from . import response_cache
+from .graph import social_graph
+from .models import Follows, HomeTimeline, Posts
+from .pagination import keyset_filter
+
+# Cache key for the set of authors whose posts are pulled at read time
+# instead of being fanned out into every follower's inbox. It has no expiry:
+# follows and fan-outs add the accounts that go over the limit as they do,
+# and refresh_pull_authors (the command, from cron) recounts it to drop the
+# ones that fell back under. Requests only count it when the cache lost it.
+PULL_AUTHORS_KEY = 'timeline:pull_authors'
+PULL_AUTHORS_LOCK = 'timeline:pull_authors:lock'
+
+
+def fanout_limit():
+    return getattr(settings, 'TIMELINE_FANOUT_MAX_FOLLOWERS', 5000)
+
+
+def _newest_first(post):
+    return (post.created_at, post.post_id)
+
+
+def refresh_pull_authors():
+    # Count the accounts over the fan-out limit, one GROUP BY over the whole follows table
+    authors = set(
+        Follows.objects.values('following_user_id')
+        .annotate(followers=Count('user_id'))
+        .filter(followers__gt=fanout_limit())
+        .values_list('following_user_id', flat=True)
+    )
+    cache.set(PULL_AUTHORS_KEY, authors, None)
+    return authors
+
+
+def _recount_pull_authors():
+    # One request recounts a lost set, the others wait for it instead of all running the GROUP BY
+    wait = getattr(settings, 'TIMELINE_PULL_AUTHORS_LOCK_SECONDS', 30)
+    deadline = time.monotonic() + wait
+    while not cache.add(PULL_AUTHORS_LOCK, 1, wait):
+        time.sleep(0.05)
+        authors = cache.get(PULL_AUTHORS_KEY)
+        if authors is not None:
+            return authors
+        if time.monotonic() > deadline:
+            # Whoever held the lock never finished
+            return refresh_pull_authors()
+    try:
+        return refresh_pull_authors()
+    finally:
+        cache.delete(PULL_AUTHORS_LOCK)
+
+
+def pull_authors():
+    # Accounts over the fan-out limit
+    authors = cache.get(PULL_AUTHORS_KEY)
+    if authors is None:
+        authors = _recount_pull_authors()
+    return authors
+
+
+def _mark_pull_author(user_id):
+    authors = pull_authors()
+    if user_id not in authors:
+        authors.add(user_id)
+        cache.set(PULL_AUTHORS_KEY, authors, None)
+
+
+def check_fanout_limit(user_id):
+    """
+    Whether the user's posts are pulled at read time. A new follow calls it
+    to move its account over once it passes the limit, counting no further
+    than that on the follows index.
+    """
+    if user_id in pull_authors():
+        return True
+    limit = fanout_limit()
+    if Follows.objects.filter(following_user_id=user_id)[:limit + 1].count() > limit:
+        _mark_pull_author(user_id)
+        return True
+    return False
+
+
+def _followers_to_push(user_id):
+    """
+    The user's followers, or None when there are more than the fan-out
+    limit and the user goes on the pull path. Bounded read, a celebrity's
+    whole follower list is never loaded just to be skipped.
+    """
+    limit = fanout_limit()
+    follower_ids = list(
+        Follows.objects.filter(following_user_id=user_id)
+        .values_list('user_id', flat=True)[:limit + 1]
+    )
+    if len(follower_ids) > limit:
+        _mark_pull_author(user_id)
+        return None
+    return follower_ids
+
+
+def fan_out_post(post):
+    """
+    Push a new post into the inbox of everyone following its author.
+    High follower accounts are skipped and served by the pull path instead.
+    Returns the number of inboxes written.
+    """
+    follower_ids = _followers_to_push(post.user_id)
+    if follower_ids is None:
+        return 0
+
+    entries = [
+        HomeTimeline(user_id=follower_id, post_id=post.post_id,
+                     author_id=post.user_id, created_at=post.created_at)
+        for follower_id in follower_ids
+    ]
+    HomeTimeline.objects.bulk_create(
+        entries,
+        batch_size=getattr(settings, 'TIMELINE_BATCH_SIZE', 1000),
+        ignore_conflicts=True,
+    )
+    # Every follower's cached feed is now out of date
+    response_cache.bump(*(response_cache.version_key('feed', follower_id) for follower_id in follower_ids))
+    return len(entries)
+
+
+def touch_follower_feeds(user_id):
+    """
+    Bump the cached feeds of a user's followers for something that shows up
+    in them without an inbox row, like a reyeet in the merge feed. Pull path
+    accounts are skipped: their followers' feeds watch their activity instead.
+    """
+    if user_id in pull_authors():
+        return 0
+    follower_ids = _followers_to_push(user_id)
+    if follower_ids is None:
+        return 0
+    response_cache.bump(*(response_cache.version_key('feed', follower_id) for follower_id in follower_ids))
+    return len(follower_ids)
+
+
+def backfill_follow(user_id, followed_id):
+    # Copy the followed user's recent posts into the new follower's inbox
+    if followed_id in pull_authors():
+        return 0
+    posts = (
+        Posts.objects.filter(user_id=followed_id)
+        .order_by('-created_at', '-post_id')
+        .values_list('post_id', 'created_at')[:getattr(settings, 'TIMELINE_BACKFILL_POSTS', 200)]
+    )
+    entries = [
+        HomeTimeline(user_id=user_id, post_id=post_id, author_id=followed_id, created_at=created_at)
+        for post_id, created_at in posts
+    ]
+    HomeTimeline.objects.bulk_create(entries, ignore_conflicts=True)
+    return len(entries)
+
+
+def prune_follow(user_id, followed_id):
+    # Drop an unfollowed user's posts out of the follower's inbox
+    deleted, _ = HomeTimeline.objects.filter(user_id=user_id, author_id=followed_id).delete()
+    return deleted
+
+
+def followed_pull_authors_of(user_id):
+    # The pull path accounts this user follows, merged into their feed at read time
+    authors = pull_authors()
+    if not authors:
+        return []
+    return [followed_id for followed_id in social_graph.followees(user_id) if followed_id in authors]
+
+
+def read_inbox(user_id, limit, cursor=None):
+    # One indexed range scan on the user's home_timeline rows
+    entries = keyset_filter(
+        HomeTimeline.objects.filter(user_id=user_id).select_related('post__user'),
+        cursor,
+    )[:limit]
+    return [entry.post for entry in entries]
+
+
+def read_pulled(user_id, limit, cursor=None):
+    # Newest posts of the followed accounts that aren't fanned out
+    followed_pull_authors = followed_pull_authors_of(user_id)
+    if not followed_pull_authors:
+        return []
+    return list(keyset_filter(
+        Posts.objects.filter(user_id__in=followed_pull_authors).select_related('user'),
+        cursor,
+    )[:limit])
+
+
+def merge_timeline(inbox, pulled, limit):
+    if not pulled:
+        return inbox
+    # An author promoted to the pull path may still have older rows in the inbox
+    feed, seen = [], set()
+    for post in merge(inbox, pulled, key=_newest_first, reverse=True):
+        if post.post_id not in seen:
+            seen.add(post.post_id)
+            feed.append(post)
+            if len(feed) == limit:
+                break
+    return feed
+
+
+def timeline_limit(limit=None):
+    return getattr(settings, 'TIMELINE_SIZE', 800) if limit is None else limit
+
+
+def read_timeline(user_id, limit=None, cursor=None):
+    """
+    Return the newest `limit` posts for a user's home feed, newest first,
+    starting after `cursor` (a (created_at, post_id) pair) if given.
+    Inbox rows come from one indexed range scan on home_timeline; posts from
+    followed high follower accounts are pulled and merged in.
+    """
+    limit = timeline_limit(limit)
+    return merge_timeline(read_inbox(user_id, limit, cursor), read_pulled(user_id, limit, cursor), limit)
+
+
+def rebuild_timeline(user_id):
+    # Rebuild one user's inbox from scratch out of the follows and posts tables
+    HomeTimeline.objects.filter(user_id=user_id).delete()
+    written = 0
+    for followed_id in social_graph.followees(user_id):
+        written += backfill_follow(user_id, followed_id)
+    return written
@@ -0,0 +1,140 @@
+from django.db import DEFAULT_DB_ALIAS, IntegrityError, connections, transaction
+from django.db.models.constants import OnConflict
+from django.db.models.sql import InsertQuery
+
+from . import counters
+from .feed import feed_engine
+from .graph import social_graph
+from .models import Likes, Posts, Retweets
+from .response_cache import bump, version_key
+from .timeline import backfill_follow, check_fanout_limit, prune_follow, touch_follower_feeds
+
+# Like, reyeet and follow are toggles on a row with a unique key (see the
+# constraints in models.py). Checking first and then deleting or creating
+# races with a double tap; flipping with the delete's row count and an
+# INSERT that ignores the unique key does not, and each call changes the
+# counters only by what it really changed.
+
+# The Posts column that counts each engagement table's rows
+COUNTERS = {Likes: 'like_count', Retweets: 'retweet_count'}
+
+# MySQL's ER_DUP_ENTRY, the one INSERT IGNORE warning that means the row was already there
+MYSQL_DUP_ENTRY = 1062
+
+
+def _raise_mysql_warnings(conn, cursor):
+    # INSERT IGNORE turns every error into a warning (a missing foreign key, a NULL), raise those again
+    if not conn.connection.warning_count():
+        return
+    cursor.execute('SHOW WARNINGS')
+    for _, code, message in cursor.fetchall():
+        if code != MYSQL_DUP_ENTRY:
+            raise IntegrityError(code, message)
+
+
+def insert_ignore(objs, using=DEFAULT_DB_ALIAS):
+    """
+    Insert rows of one model skipping those already there by its unique
+    key, in as few statements as the database takes. Returns how many went
+    in, which bulk_create(ignore_conflicts=True) can't tell. Only a
+    conflict on that key is skipped, any other error is raised as usual:
+    ON CONFLICT (key) DO NOTHING where there is one, and on MySQL, which
+    has no conflict target, INSERT IGNORE with its other warnings raised.
+    """
+    objs = list(objs)
+    if not objs:
+        return 0
+    model = type(objs[0])
+    fields = [field for field in model._meta.local_concrete_fields if not field.primary_key]
+    conn = connections[using]
+    mysql = conn.vendor == 'mysql'
+    # Follows, Likes and Retweets have one unique key each
+    unique_key, = model._meta.total_unique_constraints
+    conflict = ' ON CONFLICT ({}) DO NOTHING'.format(', '.join(
+        conn.ops.quote_name(model._meta.get_field(name).column) for name in unique_key.fields
+    ))
+    batch_size = max(conn.ops.bulk_batch_size(fields, objs), 1)
+    inserted = 0
+    with conn.cursor() as cursor:
+        for start in range(0, len(objs), batch_size):
+            query = InsertQuery(model, on_conflict=OnConflict.IGNORE if mysql else None)
+            query.insert_values(fields, objs[start:start + batch_size])
+            for sql, params in query.get_compiler(using).as_sql():
+                cursor.execute(sql if mysql else sql + conflict, params)
+                inserted += cursor.rowcount
+                if mysql:
+                    _raise_mysql_warnings(conn, cursor)
+    return inserted
+
+
+def toggle_row(model, **key):
+    """
+    Delete the row with these unique key values if it is there, insert it
+    if not. Returns -1 when this call deleted it, +1 when it inserted it,
+    and 0 when a concurrent toggle inserted it in between (the row is
+    there, this call changed nothing). Run it in the same transaction as
+    whatever counts the rows so both commit together.
+    """
+    deleted, _ = model.objects.filter(**key).delete()
+    if deleted:
+        return -deleted
+    return insert_ignore([model(**key)])
+
+
+def set_row(model, wanted, **key):
+    # Like toggle_row for a known end state: +1 if inserted, -1 if deleted, 0 if it already was that way
+    if wanted:
+        return insert_ignore([model(**key)])
+    return -model.objects.filter(**key).delete()[0]
+
+
+def follow_changed(user_id, followed_id, change):
+    """
+    Everything else a follow (change > 0) or unfollow (change < 0) touches:
+    the follower's inbox, the cached social graph once the transaction
+    commits, and the cached feed and profiles.
+    """
+    if change > 0:
+        check_fanout_limit(followed_id)
+        backfill_follow(user_id, followed_id)
+        transaction.on_commit(lambda: social_graph.follow_added(user_id, followed_id))
+    elif change < 0:
+        prune_follow(user_id, followed_id)
+        transaction.on_commit(lambda: social_graph.follow_removed(user_id, followed_id))
+    else:
+        return
+    bump(
+        version_key('activity', user_id),
+        version_key('feed', user_id),
+        version_key('profile', user_id),
+        version_key('profile', followed_id),
+    )
+
+
+def engagement_changed(changes):
+    """
+    Bump the cached responses that show these likes/retweets, given as
+    {model: [(user_id, post_id)]}: the users' activity and the authors' posts.
+    """
+    pairs = [pair for model_pairs in changes.values() for pair in model_pairs]
+    user_ids = {user_id for user_id, _ in pairs}
+    author_ids = set(
+        Posts.objects.filter(post_id__in={post_id for _, post_id in pairs})
+        .exclude(user_id=None).values_list('user_id', flat=True)
+    )
+    bump(*(version_key('activity', user_id) for user_id in user_ids),
+         *(version_key('posts', author_id) for author_id in author_ids))
+    # Reyeets are feed entries in the merge feed, so the followers' cached feeds go stale
+    if Retweets in changes and feed_engine() == 'merge':
+        for user_id in {user_id for user_id, _ in changes[Retweets]}:
+            touch_follower_feeds(user_id)
+
+
+def toggle_engagement(model, user_id, post_id):
+    # Flip a like/retweet and move the post's counter (or one of its shards) by the same amount, in one transaction
+    with transaction.atomic():
+        change = toggle_row(model, user_id=user_id, post_id=post_id)
+        if change:
+            counters.add(post_id, **{COUNTERS[model]: change})
+            engagement_changed({model: [(user_id, post_id)]})
+    return change
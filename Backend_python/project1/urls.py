@@ -1,7 +1,7 @@
 from django.urls import path
 from django.conf import settings
 from django.conf.urls.static import static
-from . import views
+from . import views, async_views
 from .views import PostInfoView, AllUsersView, AllFollowsView, google_login
 urlpatterns = [
     path('all_users/', views.all_users, name='all_users'),
@@ -13,6 +13,7 @@ urlpatterns = [
     path('api/users/', AllUsersView.as_view(), name='all-users-api'),
     path('api/follows/', AllFollowsView.as_view(), name='all-follows-api'),
     path('api/username/<int:user_id>/', views.get_username_by_user_id, name='get-username-by-id'),
+    path('api/usernames/', views.get_usernames, name='get-usernames'),
     path('api/follow-usernames/<int:follow_id>/', views.get_usernames_for_follow, name='get-follow-usernames'),
     path('auth/google-login/', google_login),
     path('api/follow_feed/<str:username>/', views.get_following_feed, name='get_following_feed'),
@@ -24,8 +25,18 @@ urlpatterns = [
     path('search_users/', views.search_users, name='search_users'),
     path('user_profile/<str:username>/', views.user_profile, name='user_profile'),
     path('follow_toggle/', views.follow_toggle, name='follow_toggle'),
+    path('api/batch/', views.batch_mutations, name='batch_mutations'),
+
+    # Async versions of the feed and profile, for the ASGI deployment
+    path('api/async/follow_feed/<str:username>/', async_views.get_following_feed_async, name='get_following_feed_async'),
+    path('async/user_profile/<str:username>/', async_views.user_profile_async, name='user_profile_async'),
     
     # Feedback survey endpoints
     path('api/feedback/', views.submit_feedback, name='submit_feedback'),
     path('api/feedback/stats/', views.get_feedback_stats, name='get_feedback_stats'),
+    path('api/cache_stats/', views.cache_stats, name='cache_stats'),
+    path('api/metrics/', views.prometheus_metrics, name='metrics'),
+    path('api/slow_queries/', views.slow_query_log, name='slow_query_log'),
+    path('api/profiles/', views.list_profiles, name='list_profiles'),
+    path('api/profiles/<str:profile_id>/', views.download_profile, name='download_profile'),
 ] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
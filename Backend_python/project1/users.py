@@ -0,0 +1,103 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db.models import OuterRef, Subquery
+
+from .models import ProfilePics
+
+MEDIA_HOST = 'http://54.147.244.63:8000/media/'
+
+
+def picture_url(photo_path):
+    # Google pictures are stored as full urls, uploads as a path under media/
+    if not photo_path:
+        return ''
+    if photo_path.startswith('https'):
+        return photo_path
+    return MEDIA_HOST + photo_path
+
+
+class UserDirectory:
+    """
+    Process-local id -> public user info (username, names, picture). Misses
+    are resolved in a single query for the whole batch. Entries are dropped
+    by the post_save/post_delete signals on User and ProfilePics and expire
+    after USER_CACHE_TTL seconds so other processes catch up eventually.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def _max_users(self):
+        return getattr(settings, 'USER_CACHE_MAX_USERS', 50000)
+
+    def _ttl(self):
+        return getattr(settings, 'USER_CACHE_TTL', 300)
+
+    def _load(self, ids):
+        picture = ProfilePics.objects.filter(user_id=OuterRef('id')).order_by('-photo_id').values('photo_path')[:1]
+        rows = (
+            User.objects.filter(id__in=ids)
+            .annotate(photo_path=Subquery(picture))
+            .values_list('id', 'username', 'first_name', 'last_name', 'photo_path')
+        )
+        return {
+            user_id: {
+                'id': user_id,
+                'username': username,
+                'first_name': first_name,
+                'last_name': last_name,
+                'picture': picture_url(photo_path),
+            }
+            for user_id, username, first_name, last_name, photo_path in rows
+        }
+
+    def resolve(self, ids):
+        """
+        Return {id: info} for every id that exists. Unknown ids are left out.
+        """
+        ids = {int(user_id) for user_id in ids}
+        found = {}
+        now = time.monotonic()
+        with self._lock:
+            for user_id in ids:
+                entry = self._entries.get(user_id)
+                if entry is not None and entry[0] > now:
+                    self._entries.move_to_end(user_id)
+                    found[user_id] = entry[1]
+
+        missing = ids - found.keys()
+        if missing:
+            loaded = self._load(missing)
+            expires = now + self._ttl()
+            with self._lock:
+                for user_id, info in loaded.items():
+                    self._entries[user_id] = (expires, info)
+                    self._entries.move_to_end(user_id)
+                while len(self._entries) > self._max_users():
+                    self._entries.popitem(last=False)
+            found.update(loaded)
+        return found
+
+    def get(self, user_id):
+        return self.resolve([user_id]).get(int(user_id))
+
+    def usernames(self, ids):
+        # Usernames in the order of ids, skipping any that no longer exist
+        users = self.resolve(ids)
+        return [users[user_id]['username'] for user_id in ids if user_id in users]
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+user_directory = UserDirectory()
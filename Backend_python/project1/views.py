@@ -3,6 +3,21 @@ from django.shortcuts import render
 from .models import Posts, Follows, Likes, Retweets, FeedbackSurvey, ProfilePics
 from rest_framework.response import Response
 from .serializers import UserSerializer, PostSerializer, FollowSerializer, LikeSerializer, RetweetSerializer, FeedbackSerializer
+from .feed import feed_deps, feed_engine, read_feed
+from .timeline import fan_out_post
+from .pagination import InvalidCursor, decode_pk_cursor, get_page_params, keyset_filter, split_page
+from .streaming import listing_response, pk_page
+from .engagement import hydrate_engagement, serialize_posts
+from .graph import social_graph
+from .profile import build_profile
+from .response_cache import bump, cached_response, post_deps, response_key, version_key
+from . import response_cache
+from .toggles import follow_changed, toggle_row
+from .batch import BatchConflict, apply_batch
+from .write_behind import record_toggle
+from .users import user_directory
+from .authentication import CachedJWTAuthentication
+from . import search as search_index
 from rest_framework import status
 from rest_framework.views import APIView
 from django.http import JsonResponse
@@ -10,18 +25,27 @@ from django.contrib.auth.models import User
 from rest_framework.decorators import api_view
 from django.core.exceptions import ObjectDoesNotExist
 import json
-from django.db import models
-from django.utils import timezone
+from django.conf import settings
+from django.db import models, transaction
 from rest_framework_simplejwt.tokens import RefreshToken
-from rest_framework.permissions import AllowAny
+from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
 from rest_framework.decorators import permission_classes
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from django.http import FileResponse, HttpResponse
+import hmac
+from . import metrics, profiling, slow_queries
 
 # this is a simple version of getting all the users that i made when
 # i first started learning. I think using apiView is better. 
 # its not needed anymore, but i wont delete it.
 def all_users(request):
-    users = User.objects.all()
-    return render(request, 'all_users.html', {'users': users})
+    # One page at a time now, the whole table doesn't fit in one page render
+    try:
+        limit, after = get_page_params(request, decode_pk_cursor) or (settings.PAGE_SIZE_MAX, None)
+    except InvalidCursor as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    users, next_cursor = pk_page(User.objects.all(), limit, after)
+    return render(request, 'all_users.html', {'users': users, 'next_cursor': next_cursor, 'limit': limit})
 
 # i dont know if this is used anywhere and i am scared to delete it
 class UserViewSet(viewsets.ModelViewSet):
@@ -35,9 +59,8 @@ class UserViewSet(viewsets.ModelViewSet):
 
 class PostInfoView(APIView):
     def get(self, request):
-        posts = Posts.objects.all()
-        serializer = PostSerializer(posts, many=True)
-        return Response(serializer.data)
+        # Streamed (or paged with ?limit=) so the posts table never sits in memory
+        return listing_response(request, Posts.objects.all(), PostSerializer)
 
 # This function is for project1
 def get_user_info(request, username, checkInfo):
@@ -46,24 +69,23 @@ def get_user_info(request, username, checkInfo):
     try:
         # Fetch the user object based on the username
         user = User.objects.get(username=username)
-        user_id = user.user_id  # Get the user's ID to use in the queries
+        user_id = user.id  # Get the user's ID to use in the queries
 
         # Determine what data to return based on the 'info' parameter
         if checkInfo == 'Follows':
-            # Fetch the list of users who are following the given user (using user_id)
-            follows_data = Follows.objects.filter(user_id=user_id)
-            data = []
-            for follow_data in follows_data:
-                user_being_followed = User.objects.get(id=follow_data.following_user_id)
-                data.append(user_being_followed.username)
+            # Usernames of the users the given user follows, one join on the follows index.
+            # Not through the user directory: a whole list would flood its LRU.
+            data = list(
+                Follows.objects.filter(user_id=user_id)
+                .values_list('following_user__username', flat=True)
+            )
  
         elif checkInfo == 'Following':
-            # Fetch the list of users that the given user is following (using user_id)
-            following = Follows.objects.filter(following_user_id=user_id)
-            data = []
-            for follow in following:
-                following_user = User.objects.get(id=follow.user_id)
-                data.append(following_user.username)
+            # Usernames of the users following the given user
+            data = list(
+                Follows.objects.filter(following_user_id=user_id)
+                .values_list('user__username', flat=True)
+            )
 
         elif checkInfo == 'Posts':
             # Fetch the user's posts (using user_id)
@@ -81,66 +103,72 @@ def get_user_info(request, username, checkInfo):
 # Get all the posts from the database
 # This isnt used in anything important, but i still wont delete it. =]
 def all_posts(request):
-    posts = Posts.objects.all()
-    serializer = PostSerializer(posts, many=True)
-    return JsonResponse(serializer.data, safe=False)
+    return listing_response(request, Posts.objects.all(), PostSerializer)
 
 
 class AllUsersView(APIView):
     def get(self, request):
-        users = User.objects.all()
-        serializer = UserSerializer(users, many=True)
-        return Response(serializer.data)
+        return listing_response(request, User.objects.all(), UserSerializer)
 
 class AllFollowsView(APIView):
     def get(self, request):
-        follows = Follows.objects.all()
-        serializer = FollowSerializer(follows, many=True)
-        return Response(serializer.data)
+        return listing_response(request, Follows.objects.all(), FollowSerializer)
+
+# auth_user.id and the ids pointing at it are signed 32-bit columns, a bigger id is a
+# database error rather than a lookup that finds nothing
+MAX_USER_ID = 2**31 - 1
+
+def id_out_of_range(*ids):
+    if any(not -MAX_USER_ID - 1 <= user_id <= MAX_USER_ID for user_id in ids):
+        return JsonResponse({'error': f'ids go up to {MAX_USER_ID}'}, status=400)
+    return None
 
 def get_username_by_user_id(request, user_id):
-    try:
-        user = User.objects.get(id=user_id)
-        return JsonResponse({'username': user.username})
-    except User.DoesNotExist:
+    error = id_out_of_range(user_id)
+    if error:
+        return error
+    user = user_directory.get(user_id)
+    if user is None:
         return JsonResponse({'error': 'User not found!'}, status=404)
+    return JsonResponse({'username': user['username']})
 
-def get_usernames_for_follow(request, follow_id):
+# Bulk version of get_username_by_user_id: api/usernames/?ids=1,2,3
+def get_usernames(request):
     try:
-        # The Follows model doesn't have an 'id' field, so we need to find a follow relationship
-        # where either user_id or following_user_id matches the provided follow_id
-        follows = Follows.objects.filter(user_id=follow_id)
-        
-        if follows.exists():
-            # Get the first matching follow relationship
-            follow = follows.first()
-            user = User.objects.get(id=follow.user_id)
-            following_user = User.objects.get(id=follow.following_user_id)
-            
-            return JsonResponse({
-                'user_id': follow.user_id,
-                'username': user.username,
-                'following_user_id': follow.following_user_id,
-                'following_username': following_user.username
-            })
-        else:
-            # Try finding a follow relationship where the user is being followed
-            follows = Follows.objects.filter(following_user_id=follow_id)
-            if follows.exists():
-                follow = follows.first()
-                user = User.objects.get(id=follow.user_id)
-                following_user = User.objects.get(id=follow.following_user_id)
-                
-                return JsonResponse({
-                    'user_id': follow.user_id,
-                    'username': user.username,
-                    'following_user_id': follow.following_user_id,
-                    'following_username': following_user.username
-                })
-            else:
-                return JsonResponse({'error': 'No follow relationship found for this ID!'}, status=404)
-    except User.DoesNotExist:
+        ids = [int(user_id) for user_id in request.GET.get('ids', '').split(',') if user_id.strip()]
+    except ValueError:
+        return JsonResponse({'error': 'ids must be a comma separated list of user ids'}, status=400)
+    if len(ids) > settings.USERNAMES_MAX_IDS:
+        return JsonResponse({'error': f'At most {settings.USERNAMES_MAX_IDS} ids per request'}, status=400)
+    error = id_out_of_range(*ids)
+    if error:
+        return error
+    users = user_directory.resolve(ids)
+    # Keyed by id, ids that don't exist are left out
+    return JsonResponse({str(user_id): info for user_id, info in users.items()})
+
+def get_usernames_for_follow(request, follow_id):
+    error = id_out_of_range(follow_id)
+    if error:
+        return error
+    # Look for a follow where follow_id is the follower first, then the followed user
+    follow = (
+        Follows.objects.filter(user_id=follow_id).first()
+        or Follows.objects.filter(following_user_id=follow_id).first()
+    )
+    if follow is None:
+        return JsonResponse({'error': 'No follow relationship found for this ID!'}, status=404)
+
+    # Both usernames in one lookup
+    users = user_directory.resolve([follow.user_id, follow.following_user_id])
+    if follow.user_id not in users or follow.following_user_id not in users:
         return JsonResponse({'error': 'User not found!'}, status=404)
+    return JsonResponse({
+        'user_id': follow.user_id,
+        'username': users[follow.user_id]['username'],
+        'following_user_id': follow.following_user_id,
+        'following_username': users[follow.following_user_id]['username']
+    })
 
 # Project 2 - Check if user exists by email
 @api_view(['POST'])
@@ -176,14 +204,10 @@ def generate_unique_username(base):
 # Final - check for profile pic
 def profile_pic(user_id):
     try:
-        user_pic = ProfilePics.objects.get(user_id=user_id)
-        if user_pic.photo_path.startswith('https'):
-            return user_pic.photo_path
-        else:
-            pic_path = 'http://54.147.244.63:8000/media/' + user_pic.photo_path
-            return pic_path
-    except ProfilePics.DoesNotExist:
+        user = user_directory.get(user_id)
+    except (TypeError, ValueError):
         return ''
+    return user['picture'] if user else ''
 
 @api_view(['GET'])
 def get_profile_pic(request):
@@ -254,6 +278,7 @@ def validate_signup_info(request):
     
 
 # Final - Get 'like' information for a post
+# (single post only, the listing views hydrate in bulk with serialize_posts)
 def get_like_data(post_id, user_id):
     likes = Likes.objects.filter(post_id=post_id)
     return {
@@ -276,57 +301,49 @@ def get_following_feed(request, username):
     try: 
         # Get the user info from the username
         user = User.objects.get(username=username)
-        # Get the people the user follows from the user id
-        follow_relationships = Follows.objects.filter(user_id=user.id)
-    
-        post_info = []
-        for follow in follow_relationships:
-            followed_user = User.objects.get(id=follow.following_user_id)
-            # Get the posts by user id
-            posts = Posts.objects.filter(user_id=followed_user.id)
-            for post in posts:
-                post_info.append({
-                    'user_id': post.user.id,
-                    'username': followed_user.username,
-                    'post_id': post.post_id,
-                    'post_content': post.content,
-                    'post_timestamp': post.created_at,
-                    'latitude': post.latitude,
-                    'longitude': post.longitude,
-                    'location_name': post.location_name,
-                    **get_like_data(post.post_id, user.id),
-                    **get_retweet_data(post.post_id, user.id)
-
-                })
-        sorted_posts = sorted(post_info, key=lambda x: x['post_timestamp'], reverse=True)
-        return Response(sorted_posts)
+        page = get_page_params(request)
+
+        def build():
+            # The newest posts, from whichever engine FEED_ENGINE picks
+            limit, cursor = page or (None, None)
+            post_info, next_cursor = read_feed(user.id, limit, cursor)
+            if page:
+                return {'results': post_info, 'next_cursor': next_cursor}, post_deps(post_info)
+            return post_info, post_deps(post_info)
+
+        # Served from cache until something is pushed into the timeline, the user
+        # likes/reyeets/follows, a pulled author posts or a listed post changes
+        key = response_key('feed', request, user.id, feed_engine())
+        return cached_response('feed', request, key, feed_deps(user.id), build)
     except User.DoesNotExist:
         return Response({'error': 'User not found'}, status=404)
+    except InvalidCursor as e:
+        return Response({'error': str(e)}, status=400)
 
 # Final - Get the posts of the user for the 'My Posts' feed
 @api_view(['GET'])
 def get_user_posts(request, username):
     try:
-        post_info = []
         user = User.objects.get(username=username)
-        posts = Posts.objects.filter(user_id=user.id).order_by('-created_at')
-
-        for post in posts:
-            post_info.append({
-                'user_id': post.user.id,
-                'username': user.username,
-                'post_id': post.post_id,
-                'post_content': post.content,
-                'post_timestamp': post.created_at,
-                'latitude': post.latitude,
-                'longitude': post.longitude,
-                'location_name': post.location_name,
-                **get_like_data(post.post_id, user.id),
-                **get_retweet_data(post.post_id, user.id)
-            })
-        return Response(post_info)
+        page = get_page_params(request)
+
+        def build():
+            posts = Posts.objects.filter(user_id=user.id).select_related('user').order_by('-created_at', '-post_id')
+            if page:
+                limit, cursor = page
+                posts, next_cursor = split_page(keyset_filter(posts, cursor)[:limit + 1], limit)
+
+            post_info = serialize_posts(posts, user.id)
+            if page:
+                return {'results': post_info, 'next_cursor': next_cursor}, ()
+            return post_info, ()
+
+        deps = [version_key('posts', user.id), version_key('activity', user.id)]
+        return cached_response('user_posts', request, response_key('user_posts', request, user.id), deps, build)
     except User.DoesNotExist:
         return Response({'error': 'User not found'}, status=404)
+    except InvalidCursor as e:
+        return Response({'error': str(e)}, status=400)
     
 # Final - Add a post to the posts table
 @api_view(['POST'])
@@ -341,13 +358,16 @@ def yeet(request):
 
         user = User.objects.get(username=username)
 
-        Posts.objects.create(
+        post = Posts.objects.create(
             user_id=user.id,
             content=post_content,
             latitude=latitude,
             longitude=longitude,
             location_name=location_name
         )
+        # Push the new post into the followers' home timelines
+        fan_out_post(post)
+        bump(version_key('posts', user.id), version_key('feed', user.id))
 
         return JsonResponse({'status': 'Yeet successfully Yeeted'}, status=201)
     except User.DoesNotExist:
@@ -355,23 +375,35 @@ def yeet(request):
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
 
+def toggled_post_id(data):
+    # The post_id a like/reyeet toggle is for, or the error response when there's no such post
+    try:
+        post_id = int(data.get('post_id'))
+    except (TypeError, ValueError):
+        return None, JsonResponse({'error': 'post_id must be a number'}, status=400)
+    if not Posts.objects.filter(post_id=post_id).exists():
+        return None, JsonResponse({'error': 'Yeet does not exist'}, status=404)
+    return post_id, None
+
 # Final - Like or Unlike a Post
 @api_view(['POST'])
 def like_toggle(request):
     try:
         data = json.loads(request.body)
         username = data.get('username')
-        post_id = data.get('post_id')
         user = User.objects.get(username=username)
-        if Likes.objects.filter(user_id=user.id, post_id=post_id).exists():
-            Likes.objects.filter(user_id=user.id, post_id=post_id).delete()
+        post_id, error = toggled_post_id(data)
+        if error:
+            return error
+        # The like row and the post's like_count change together, double taps can't double count.
+        # Written later in batches with ENGAGEMENT_WRITE_MODE = 'buffered'.
+        change = record_toggle(Likes, user.id, post_id)
+        if change < 0:
             return JsonResponse({'status': 'Yeet has been unliked'}, status=200)
-        else:
-            Likes.objects.create(
-                user_id = user.id,
-                post_id = post_id
-            )
-            return JsonResponse({'status': 'Yeet has been liked'}, status=201)
+        if change == 0:
+            # A concurrent request liked it first, this one inserted nothing
+            return JsonResponse({'status': 'Yeet was already liked'}, status=200)
+        return JsonResponse({'status': 'Yeet has been liked'}, status=201)
     except User.DoesNotExist:
         return JsonResponse({'error': 'User does not exist'}, status=404)
     
@@ -381,17 +413,17 @@ def reyeet_toggle(request):
     try:
         data = json.loads(request.body)
         username = data.get('username')
-        post_id = data.get('post_id')
         user = User.objects.get(username=username)
-        if Retweets.objects.filter(user_id=user.id, post_id=post_id).exists():
-            Retweets.objects.filter(user_id=user.id, post_id=post_id).delete()
+        post_id, error = toggled_post_id(data)
+        if error:
+            return error
+        # The retweet row and the post's retweet_count change together, double taps can't double count
+        change = record_toggle(Retweets, user.id, post_id)
+        if change < 0:
             return JsonResponse({'status': 'Yeet has been unReYeeted'}, status=200)
-        else:
-            Retweets.objects.create(
-                user_id = user.id,
-                post_id = post_id
-            )
-            return JsonResponse({'status': 'Yeet has been ReYeeted'}, status=201)
+        if change == 0:
+            return JsonResponse({'status': 'Yeet was already ReYeeted'}, status=200)
+        return JsonResponse({'status': 'Yeet has been ReYeeted'}, status=201)
     except User.DoesNotExist:
         return JsonResponse({'error': 'User does not exist'}, status=404)
 
@@ -403,24 +435,17 @@ def search_users(request):
         return Response({'error': 'Query parameter required'}, status=400)
     
     try:
-        # Find users whose username or name contains the query string
-        users = User.objects.filter(
-            models.Q(username__icontains=query) | 
-            models.Q(first_name__icontains=query) | 
-            models.Q(last_name__icontains=query)
-        )[:10]  # Limit to 10 results
-        
-        user_data = []
-        for user in users:
-            user_data.append({
-                'id': user.id,
-                'username': user.username,
-                'first_name': user.first_name,
-                'last_name': user.last_name,
-                'email': user.email,
-                # You could add more user info here if needed
-            })
-        
+        # Users the viewer follows rank higher, from the token or ?viewer_id=
+        viewer_id = request.user.id if request.user.is_authenticated else request.GET.get('viewer_id')
+        viewer_id = int(viewer_id) if viewer_id else None
+        # Clamped like page sizes, a negative limit would slice off the end of the results
+        limit = max(1, min(int(request.GET.get('limit', 10)), settings.SEARCH_MAX_RESULTS))
+    except ValueError:
+        return Response({'error': 'viewer_id and limit must be numbers'}, status=400)
+
+    try:
+        # Ranked matches out of the user_search_terms index
+        user_data = search_index.search_users(query, viewer_id, limit)
         return Response(user_data)
     except Exception as e:
         return Response({'error': str(e)}, status=500)
@@ -434,110 +459,28 @@ def user_profile(request, username):
         
         # Get the current logged-in user
         current_user = request.user
-        
-        # Check if current user follows this profile
-        is_following = False
-        if current_user.is_authenticated:
-            is_following = Follows.objects.filter(
-                user_id=current_user.id,
-                following_user_id=profile_user.id
-            ).exists()
-        
-        # Get followers count
-        followers_count = Follows.objects.filter(following_user_id=profile_user.id).count()
-        
-        # Get following count
-        following_count = Follows.objects.filter(user_id=profile_user.id).count()
-        
-        # Get user posts
-        posts = Posts.objects.filter(user_id=profile_user.id).order_by('-created_at')
-        posts_data = []
-        
-        for post in posts:
-            post_data = {
-                'post_id': post.post_id,
-                'user_id': profile_user.id,
-                'username': profile_user.username,
-                'post_content': post.content,
-                'post_timestamp': post.created_at,
-                'latitude': post.latitude,
-                'longitude': post.longitude,
-                'location_name': post.location_name,
-                **get_like_data(post.post_id, current_user.id if current_user.is_authenticated else None),
-                **get_retweet_data(post.post_id, current_user.id if current_user.is_authenticated else None),
-            }
-            posts_data.append(post_data)
-        
-        # Get liked posts
-        liked_posts_data = []
-        if current_user.is_authenticated:
-            likes = Likes.objects.filter(user_id=profile_user.id)
-            for like in likes:
-                post = like.post
-                if post:
-                    post_user = post.user
-                    liked_post_data = {
-                        'post_id': post.post_id,
-                        'user_id': post_user.id,
-                        'username': post_user.username,
-                        'post_content': post.content,
-                        'post_timestamp': post.created_at,
-                        'latitude': post.latitude,
-                        'longitude': post.longitude,
-                        'location_name': post.location_name,
-                        **get_like_data(post.post_id, current_user.id),
-                        **get_retweet_data(post.post_id, current_user.id),
-                    }
-                    liked_posts_data.append(liked_post_data)
-        
-        # Get retweeted posts
-        retweeted_posts_data = []
-        if current_user.is_authenticated:
-            retweets = Retweets.objects.filter(user_id=profile_user.id)
-            for retweet in retweets:
-                post = retweet.post
-                if post:
-                    post_user = post.user
-                    retweeted_post_data = {
-                        'post_id': post.post_id,
-                        'user_id': post_user.id,
-                        'username': post_user.username,
-                        'post_content': post.content,
-                        'post_timestamp': post.created_at,
-                        'latitude': post.latitude,
-                        'longitude': post.longitude,
-                        'location_name': post.location_name,
-                        **get_like_data(post.post_id, current_user.id),
-                        **get_retweet_data(post.post_id, current_user.id),
-                    }
-                    retweeted_posts_data.append(retweeted_post_data)
-        
-        # Build the profile data
-        profile_data = {
-            'id': profile_user.id,
-            'username': profile_user.username,
-            'first_name': profile_user.first_name,
-            'last_name': profile_user.last_name,
-            'email': profile_user.email,
-            'picture': profile_pic(profile_user.id),
-            'date_joined': profile_user.date_joined,
-            'is_following': is_following,
-            'followers_count': followers_count,
-            'following_count': following_count,
-            'posts_count': posts.count(),
-            'posts': posts_data,
-            'liked_posts': liked_posts_data,
-            'retweeted_posts': retweeted_posts_data,
-        }
-        
-        return Response(profile_data)
+        viewer_id = current_user.id if current_user.is_authenticated else None
+        page = get_page_params(request)
+
+        def build():
+            return build_profile(profile_user, viewer_id, page)
+
+        # The viewer's own likes/follows change the flags they see here
+        deps = [version_key(kind, profile_user.id) for kind in ('posts', 'activity', 'profile')]
+        if viewer_id is not None:
+            deps.append(version_key('activity', viewer_id))
+        key = response_key('profile', request, profile_user.id, viewer_id)
+        return cached_response('profile', request, key, deps, build)
     except User.DoesNotExist:
         return Response({'error': 'User not found'}, status=404)
+    except InvalidCursor as e:
+        return Response({'error': str(e)}, status=400)
     except Exception as e:
         return Response({'error': str(e)}, status=500)
 
 # Final - Toggle follow status for a user
 @api_view(['POST'])
+@permission_classes([IsAuthenticated])
 def follow_toggle(request):
     following_username = request.data.get('username')
     
@@ -550,30 +493,39 @@ def follow_toggle(request):
         
         # Get the user to follow/unfollow
         following_user = User.objects.get(username=following_username)
+        if following_user.id == user.id:
+            return Response({'error': "You can't follow yourself"}, status=400)
         
-        # Check if already following
-        follow_relationship = Follows.objects.filter(
-            user_id=user.id, 
-            following_user_id=following_user.id
-        )
-        
-        if follow_relationship.exists():
-            # Unfollow
-            follow_relationship.delete()
-            return Response({'status': 'unfollowed'})
-        else:
-            # Follow
-            new_follow = Follows.objects.create(
-                user_id=user.id,
-                following_user_id=following_user.id,
-                created_at=timezone.now()
-            )
-            return Response({'status': 'followed'})
+        # Follow or unfollow in one go, the inbox changes together with the edge
+        with transaction.atomic():
+            change = toggle_row(Follows, user_id=user.id, following_user_id=following_user.id)
+            follow_changed(user.id, following_user.id, change)
+        if change == 0:
+            # A concurrent request followed first, this one inserted nothing
+            return Response({'status': 'already following'})
+        return Response({'status': 'unfollowed' if change < 0 else 'followed'})
     except User.DoesNotExist:
         return Response({'error': 'User not found'}, status=404)
     except Exception as e:
         return Response({'error': str(e)}, status=500)
 
+# Final - The app's offline queue of likes, reyeets, follows and yeets in one request:
+# {"mutations": [{"key": "<client id>", "op": "like", "post_id": 1}, ...]}, a result per mutation back
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def batch_mutations(request):
+    mutations = request.data.get('mutations') if isinstance(request.data, dict) else None
+    if not isinstance(mutations, list) or not mutations:
+        return Response({'error': 'mutations must be a non-empty list'}, status=400)
+    if len(mutations) > settings.BATCH_MAX_MUTATIONS:
+        return Response({'error': f'At most {settings.BATCH_MAX_MUTATIONS} mutations per request'}, status=400)
+    try:
+        results = apply_batch(request.user, mutations)
+    except BatchConflict:
+        # The same queue is being sent by another request, retrying gets its results
+        return Response({'error': 'These mutations are already being applied, retry'}, status=409)
+    return Response({'results': results})
+
 @api_view(['POST'])
 def submit_feedback(request):
     """
@@ -602,49 +554,115 @@ def get_feedback_stats(request):
     Get feedback statistics for visualization
     """
     try:
-        # Count total likes and dislikes
-        total_likes = FeedbackSurvey.objects.filter(likes_app=True).count()
-        total_dislikes = FeedbackSurvey.objects.filter(likes_app=False).count()
+        def build():
+            # Count total likes and dislikes
+            total_likes = FeedbackSurvey.objects.filter(likes_app=True).count()
+            total_dislikes = FeedbackSurvey.objects.filter(likes_app=False).count()
         
-        # Aggregate reasons for likes
-        like_reasons = {}
-        dislike_reasons = {}
+            # Aggregate reasons for likes
+            like_reasons = {}
+            dislike_reasons = {}
         
-        # Process likes
-        like_feedback = FeedbackSurvey.objects.filter(likes_app=True)
-        for feedback in like_feedback:
-            if feedback.selected_reasons:
-                for reason in feedback.selected_reasons:
-                    if reason in like_reasons:
-                        like_reasons[reason] += 1
-                    else:
-                        like_reasons[reason] = 1
+            # Process likes
+            like_feedback = FeedbackSurvey.objects.filter(likes_app=True)
+            for feedback in like_feedback:
+                if feedback.selected_reasons:
+                    for reason in feedback.selected_reasons:
+                        if reason in like_reasons:
+                            like_reasons[reason] += 1
+                        else:
+                            like_reasons[reason] = 1
         
-        # Process dislikes
-        dislike_feedback = FeedbackSurvey.objects.filter(likes_app=False)
-        for feedback in dislike_feedback:
-            if feedback.selected_reasons:
-                for reason in feedback.selected_reasons:
-                    if reason in dislike_reasons:
-                        dislike_reasons[reason] += 1
-                    else:
-                        dislike_reasons[reason] = 1
+            # Process dislikes
+            dislike_feedback = FeedbackSurvey.objects.filter(likes_app=False)
+            for feedback in dislike_feedback:
+                if feedback.selected_reasons:
+                    for reason in feedback.selected_reasons:
+                        if reason in dislike_reasons:
+                            dislike_reasons[reason] += 1
+                        else:
+                            dislike_reasons[reason] = 1
         
-        # Return the statistics
-        return Response({
-            'total_responses': total_likes + total_dislikes,
-            'likes': {
-                'count': total_likes,
-                'reasons': like_reasons
-            },
-            'dislikes': {
-                'count': total_dislikes,
-                'reasons': dislike_reasons
-            }
-        })
+            # Return the statistics
+            return {
+                'total_responses': total_likes + total_dislikes,
+                'likes': {
+                    'count': total_likes,
+                    'reasons': like_reasons
+                },
+                'dislikes': {
+                    'count': total_dislikes,
+                    'reasons': dislike_reasons
+                }
+            }, ()
+
+        # Only recomputed (and only re-sent, with If-None-Match) after a new survey comes in
+        key = 'response:feedback_stats'
+        return cached_response('feedback_stats', request, key, [version_key('feedback', 'all')], build)
     except Exception as e:
         return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
 
-        
\ No newline at end of file
+        
+
+# Hit/miss counters of the feed/profile response cache, staff only
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def cache_stats(request):
+    return Response(response_cache.stats())
+
+def metrics_allowed(request):
+    # The scraper sends METRICS_TOKEN as a bearer token, people use a staff login
+    token = getattr(settings, 'METRICS_TOKEN', '')
+    if token and hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return True
+    if request.user.is_staff:
+        return True
+    try:
+        result = CachedJWTAuthentication().authenticate(request)
+    except (InvalidToken, AuthenticationFailed):
+        return False
+    return bool(result and result[0].is_staff)
+
+# Per route request metrics of this worker in the Prometheus text format.
+# A plain Django view so a scraper's token doesn't go through the JWT check.
+def prometheus_metrics(request):
+    if not metrics_allowed(request):
+        return HttpResponse('Forbidden', status=403, content_type='text/plain')
+    return HttpResponse(metrics.render_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+# The slow query log (project1/slow_queries.py), most total time first;
+# DELETE empties it, e.g. to see whether a fix took
+@api_view(['GET', 'DELETE'])
+@permission_classes([IsAdminUser])
+def slow_query_log(request):
+    if request.method == 'DELETE':
+        slow_queries.store.clear()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+    return Response({
+        'threshold_ms': getattr(settings, 'SLOW_QUERY_THRESHOLD_MS', 100),
+        'repeat_threshold': getattr(settings, 'SLOW_QUERY_REPEAT_THRESHOLD', 50),
+        'queries': slow_queries.store.report(),
+    })
+
+# Stored request profiles (project1/profiling.py), newest first, staff only
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def list_profiles(request):
+    return Response(profiling.list_profiles())
+
+# One stored profile: ?as=prof (the cProfile dump, the default), json (with
+# the SQL timeline) or text (pstats report by cumulative time)
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def download_profile(request, profile_id):
+    kind = request.GET.get('as', 'prof')
+    if kind not in ('prof', 'json', 'text'):
+        return Response({'error': 'as must be prof, json or text'}, status=400)
+    path = profiling.profile_path(profile_id, '.json' if kind == 'json' else '.prof')
+    if path is None:
+        return Response({'error': 'Profile not found'}, status=404)
+    if kind == 'text':
+        return HttpResponse(profiling.top_functions(path), content_type='text/plain; charset=utf-8')
+    return FileResponse(open(path, 'rb'), as_attachment=kind == 'prof', filename=path.name)
@@ -0,0 +1,175 @@
+import atexit
+import logging
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from . import counters
+from .toggles import COUNTERS, engagement_changed, insert_ignore, toggle_engagement
+
+# Write-behind for likes and reyeets (ENGAGEMENT_WRITE_MODE = 'buffered').
+# A toggle only records the wanted end state of its (table, user, post) in
+# this process and answers; a background thread writes what piled up every
+# ENGAGEMENT_FLUSH_MS, or sooner at ENGAGEMENT_FLUSH_EVENTS, one multi-row
+# INSERT and one DELETE per post. A like and an unlike of the same post in
+# between cancel out and are never written. The toggles are gone if the
+# process dies before a flush; a clean shutdown drains them first.
+
+logger = logging.getLogger(__name__)
+
+
+def buffered():
+    return getattr(settings, 'ENGAGEMENT_WRITE_MODE', 'sync') == 'buffered'
+
+
+def write_events(events):
+    """
+    Write {(model, user_id, post_id): wanted} in one transaction: rows that
+    should be there are inserted, rows that shouldn't are deleted, and each
+    post's counters (or a shard of them) move by the rows that really
+    changed. Returns the rows that changed as {model: [(user_id, post_id)]}.
+    """
+    grouped = defaultdict(lambda: ([], []))
+    for (model, user_id, post_id), wanted in events.items():
+        grouped[model, post_id][0 if wanted else 1].append(user_id)
+
+    deltas = defaultdict(dict)
+    writes = defaultdict(int)
+    changed = defaultdict(list)
+    # No savepoint of its own inside a batch request's transaction
+    with transaction.atomic(savepoint=False):
+        for (model, post_id), (adds, removes) in grouped.items():
+            change = insert_ignore(model(user_id=user_id, post_id=post_id) for user_id in adds)
+            if removes:
+                change -= model.objects.filter(post_id=post_id, user_id__in=removes).delete()[0]
+            if change:
+                deltas[post_id][COUNTERS[model]] = change
+                writes[post_id] += len(adds) + len(removes)
+                changed[model].extend((user_id, post_id) for user_id in adds + removes)
+        for post_id, post_deltas in deltas.items():
+            counters.add(post_id, writes[post_id], **post_deltas)
+        if changed:
+            engagement_changed(changed)
+    return changed
+
+
+class EngagementBuffer:
+    """
+    Pending toggles as {(model, user_id, post_id): [stored, wanted]}, where
+    stored is what the database has (or will have once the flush in
+    progress commits). At most ENGAGEMENT_BUFFER_MAX keys; toggle() returns
+    None when it's full and the caller writes synchronously instead.
+    """
+
+    def __init__(self, background=True):
+        self.background = background
+        self._pending = {}
+        self._flushing = {}
+        # Bumped after every flush, a database read from before it may be stale
+        self._generation = 0
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._worker = None
+
+    def __len__(self):
+        with self._cond:
+            return len(self._pending)
+
+    def _entry(self, key):
+        # Pending entry for key, started from the flush in progress if it has one
+        entry = self._pending.get(key)
+        if entry is None and key in self._flushing:
+            wanted = self._flushing[key][1]
+            entry = self._pending[key] = [wanted, wanted]
+        return entry
+
+    def toggle(self, model, user_id, post_id):
+        """
+        Flip the wanted state of the row, +1 if it is now liked/reyeeted
+        and -1 if not, like toggle_engagement. One read of the row when
+        the buffer doesn't know it yet.
+        """
+        key = (model, user_id, post_id)
+        stored = None
+        while True:
+            with self._cond:
+                entry = self._entry(key)
+                if entry is None and stored is not None and generation == self._generation:
+                    entry = self._pending[key] = [stored, stored]
+                if entry is not None:
+                    entry[1] = not entry[1]
+                    if entry[0] == entry[1]:
+                        del self._pending[key]
+                    elif len(self._pending) >= getattr(settings, 'ENGAGEMENT_FLUSH_EVENTS', 500):
+                        self._cond.notify_all()
+                    self._start_worker()
+                    return 1 if entry[1] else -1
+                if len(self._pending) >= getattr(settings, 'ENGAGEMENT_BUFFER_MAX', 10000):
+                    return None
+                generation = self._generation
+            stored = model.objects.filter(user_id=user_id, post_id=post_id).exists()
+
+    def flush(self):
+        # Write everything pending now, returns how many toggles were written
+        with self._flush_lock:
+            with self._cond:
+                if not self._pending:
+                    return 0
+                self._flushing, self._pending = self._pending, {}
+                events = {key: wanted for key, (_, wanted) in self._flushing.items()}
+            try:
+                write_events(events)
+            except Exception:
+                logger.exception('Engagement flush of %d toggles failed, keeping them for the next one', len(events))
+                with self._cond:
+                    # Newer toggles of the same rows stay on top, the database still has the old state
+                    for key, (stored, wanted) in self._flushing.items():
+                        entry = self._pending.setdefault(key, [stored, wanted])
+                        entry[0] = stored
+                        if entry[0] == entry[1]:
+                            del self._pending[key]
+                    self._flushing = {}
+                return 0
+            with self._cond:
+                self._flushing = {}
+                self._generation += 1
+            return len(events)
+
+    def drain(self):
+        # Flush until nothing is left, for shutdown
+        while self.flush():
+            pass
+
+    def _start_worker(self):
+        if not self.background or self._worker is not None:
+            return
+        self._worker = threading.Thread(target=self._run, name='engagement-write-behind', daemon=True)
+        self._worker.start()
+        atexit.register(self.drain)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending)
+                self._cond.wait_for(
+                    lambda: len(self._pending) >= getattr(settings, 'ENGAGEMENT_FLUSH_EVENTS', 500),
+                    timeout=getattr(settings, 'ENGAGEMENT_FLUSH_MS', 200) / 1000,
+                )
+            close_old_connections()
+            self.flush()
+
+
+engagement_buffer = EngagementBuffer()
+
+
+def record_toggle(model, user_id, post_id):
+    """
+    What the like/reyeet endpoints call: buffered when ENGAGEMENT_WRITE_MODE
+    is 'buffered' and the buffer has room, written right away otherwise.
+    """
+    if buffered():
+        change = engagement_buffer.toggle(model, user_id, post_id)
+        if change is not None:
+            return change
+    return toggle_engagement(model, user_id, post_id)
@@ -21,6 +21,7 @@ warnings.filterwarnings(
 import os
 from pathlib import Path
 from datetime import timedelta
+from django.core.exceptions import ImproperlyConfigured
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -64,6 +65,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'project1.middleware.MetricsMiddleware',
+    'project1.middleware.SlowQueryMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -72,8 +75,9 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
-    'whitenoise.middleware.WhiteNoiseMiddleware',
+    'project1.middleware.StaticFilesMiddleware',
     'allauth.account.middleware.AccountMiddleware',
+    'project1.middleware.ProfilingMiddleware',
 ]
 
 ROOT_URLCONF = 'y.urls'
@@ -110,6 +114,12 @@ DATABASES = {
         'PASSWORD': 'Tooshort32!',
         'HOST': 'localhost',
         'PORT': '3306',
+        # The project1 migrations were written against the existing MySQL
+        # schema and can't build an empty database, so the test database
+        # is created straight from the models.
+        'TEST': {
+            'MIGRATE': False,
+        },
     }
 }
 
@@ -188,8 +198,11 @@ if DEBUG:
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
         #'rest_framework.authentication.SessionAuthentication',
+        # The app sends Bearer JWTs, so they're tried first. The user comes from a
+        # short-lived in-process cache (project1/authentication.py) instead of a
+        # query per request. TokenAuthentication only reads authtoken for a Token header.
+        'project1.authentication.CachedJWTAuthentication',
         'rest_framework.authentication.TokenAuthentication',
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.AllowAny',
@@ -204,6 +217,148 @@ SIMPLE_JWT = {
     'BLACKLIST_AFTER_ROTATION': True,
 }
 
+# Cache backend, picked with CACHE_BACKEND:
+#   locmem - per process, the default for development
+#   file   - shared by the processes on one machine
+#   db     - shared by every worker, a stand-in for memcached/redis (run createcachetable first)
+#   redis  - REDIS_URL, needs the redis package
+CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'locmem')
+CACHE_MAX_ENTRIES = int(os.environ.get('CACHE_MAX_ENTRIES', 10000))
+CACHE_BACKENDS = {
+    'locmem': ('django.core.cache.backends.locmem.LocMemCache', 'y'),
+    'file': ('django.core.cache.backends.filebased.FileBasedCache', str(BASE_DIR / 'cache')),
+    'db': ('django.core.cache.backends.db.DatabaseCache', 'django_cache'),
+    'redis': ('django.core.cache.backends.redis.RedisCache', os.environ.get('REDIS_URL', 'redis://127.0.0.1:6379')),
+}
+CACHES = {
+    'default': {
+        'BACKEND': CACHE_BACKENDS[CACHE_BACKEND][0],
+        'LOCATION': CACHE_BACKENDS[CACHE_BACKEND][1],
+        'TIMEOUT': 300,
+    },
+}
+# Workers see each other's writes (follows, response cache versions) only
+# through a cache they all share, which locmem isn't. It's fine for a single
+# development process, anything else needs file, db or redis.
+SHARED_CACHE = CACHE_BACKEND != 'locmem'
+if not DEBUG and not SHARED_CACHE:
+    raise ImproperlyConfigured('CACHE_BACKEND=locmem is per process, set file, db or redis outside DEBUG')
+if CACHE_BACKEND != 'redis':
+    # Past MAX_ENTRIES a third of the entries are culled. Redis evicts by its own maxmemory policy.
+    CACHES['default']['OPTIONS'] = {'MAX_ENTRIES': CACHE_MAX_ENTRIES, 'CULL_FREQUENCY': 3}
+
+# Versioned response cache for the feed, user posts and profile (project1/response_cache.py).
+# Only with a shared cache: a write bumps its versions there, and a worker
+# with its own locmem copy would keep serving what it built before.
+RESPONSE_CACHE_ENABLED = SHARED_CACHE and os.environ.get('RESPONSE_CACHE_ENABLED', '1') == '1'
+RESPONSE_CACHE_TTL = 300
+# How long an entry's ETag can still be checked after its body expired or was evicted
+RESPONSE_CACHE_VALIDATOR_TTL = 3600
+
+# Cursor pagination for the feed, user posts and profile endpoints
+PAGE_SIZE_DEFAULT = 20
+PAGE_SIZE_MAX = 100
+STREAM_CHUNK_SIZE = 2000    # rows per query when streaming the bulk listings
+
+# Home timeline (fan-out on write) settings
+# Accounts with more followers than this are not fanned out; their posts
+# are pulled and merged into the feed at read time instead.
+TIMELINE_FANOUT_MAX_FOLLOWERS = 5000
+TIMELINE_SIZE = 800             # max entries returned by the feed
+TIMELINE_BACKFILL_POSTS = 200   # posts copied into an inbox on follow
+TIMELINE_BATCH_SIZE = 1000
+# Longest a request waits for another one's recount of the pull path accounts
+TIMELINE_PULL_AUTHORS_LOCK_SECONDS = 30
+
+# How the home feed is read (project1/feed.py): 'timeline' reads the rows
+# fanned out on write, 'sql' joins follows to posts at read time, 'merge'
+# interleaves followed users' posts and reyeets
+FEED_ENGINE = os.environ.get('FEED_ENGINE', 'timeline')
+FEED_MERGE_BATCH = 10       # rows per followed user read at a time by the merge feed
+
+# In-memory social graph (project1/graph.py)
+SOCIAL_GRAPH_MAX_USERS = 50000             # adjacency lists kept per direction
+SOCIAL_GRAPH_VERSION_CHECK_SECONDS = 1.0   # how stale another worker's follows can be
+SOCIAL_GRAPH_TTL = 300                     # seconds before a loaded list is read again anyway
+
+# Cached user info for username/picture lookups (project1/users.py)
+USER_CACHE_MAX_USERS = 50000
+USER_CACHE_TTL = 300        # seconds before another worker's rename shows up here
+USERNAMES_MAX_IDS = 200     # ids per api/usernames/ request
+
+# Users behind JWTs (project1/authentication.py), per process
+AUTH_USER_CACHE_MAX_USERS = 50000
+AUTH_USER_CACHE_TTL = 60    # seconds before another worker's password change or deactivation shows up here
+
+# search_users typeahead (project1/search.py)
+SEARCH_CANDIDATES = 100     # rows read from the term index per lookup before ranking
+SEARCH_MAX_RESULTS = 50
+
+# Per route request metrics (project1/metrics.py), scraped from api/metrics/
+# with METRICS_TOKEN as a bearer token. Requests that run more queries than
+# their route's budget log a warning on the project1.metrics logger.
+METRICS_ENABLED = True
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+QUERY_BUDGET_DEFAULT = 20
+QUERY_BUDGETS = {
+    'get_following_feed': 10,   # the merge engine's cold read, the other engines need 5 or less
+    'get_following_feed_async': 10,
+    'get_user_posts': 8,
+    'user_profile': 15,
+    'user_profile_async': 15,
+    'search_users': 8,
+    'like_toggle': 10,
+    'reyeet_toggle': 10,
+    # Grows with the batch, about two statements per mutation and BATCH_MAX_MUTATIONS of them
+    'batch_mutations': 220,
+}
+
+# Per request profiles (project1/profiling.py), off unless PROFILING_ENABLED=1.
+# A request is profiled when it sends PROFILING_HEADER with a token from the
+# profiling_token command, or at random at PROFILING_SAMPLE_RATE. Staff list
+# and download them at api/profiles/.
+PROFILING_ENABLED = os.environ.get('PROFILING_ENABLED') == '1'
+PROFILING_SAMPLE_RATE = float(os.environ.get('PROFILING_SAMPLE_RATE', 0))
+PROFILING_HEADER = 'X-Profile-Request'
+PROFILING_TOKEN_MAX_AGE = 3600      # seconds a profiling token stays valid
+PROFILING_DIR = BASE_DIR / 'profiles'
+PROFILING_MAX_FILES = 200           # newest profiles kept on disk
+
+# Likes and reyeets: 'sync' writes each toggle in its own request. 'buffered'
+# keeps them in process (project1/write_behind.py) for a background thread to
+# write in batches every ENGAGEMENT_FLUSH_MS, or at ENGAGEMENT_FLUSH_EVENTS
+# pending toggles. Buffered toggles are lost if the process is killed before
+# a flush; a clean shutdown drains them. When ENGAGEMENT_BUFFER_MAX toggles
+# are pending, new ones are written synchronously.
+ENGAGEMENT_WRITE_MODE = os.environ.get('ENGAGEMENT_WRITE_MODE', 'sync')
+ENGAGEMENT_FLUSH_MS = 200
+ENGAGEMENT_FLUSH_EVENTS = 500
+ENGAGEMENT_BUFFER_MAX = 10000
+
+# Sharded counters for hot posts (project1/counters.py). A post whose
+# counters are written COUNTER_SHARD_PROMOTE_WRITES times within
+# COUNTER_SHARD_WINDOW_SECONDS gets COUNTER_SHARDS rows that take its writes
+# in turn; reads add them up, cached for COUNTER_SHARD_SUM_SECONDS.
+COUNTER_SHARDS = 8
+COUNTER_SHARD_PROMOTE_WRITES = 50
+COUNTER_SHARD_WINDOW_SECONDS = 10
+COUNTER_SHARD_SUM_SECONDS = 2
+
+# api/batch/: mutations per request, and days their idempotency keys are
+# kept before prune_idempotency_keys deletes them
+BATCH_MAX_MUTATIONS = 100
+IDEMPOTENCY_KEY_MAX_AGE_DAYS = 7
+
+# Slow query log (project1/slow_queries.py). Statements slower than the
+# threshold, or run SLOW_QUERY_REPEAT_THRESHOLD times in one request, are
+# kept by fingerprint with their caller and EXPLAIN plan; staff read them at
+# api/slow_queries/ and each new one is logged on project1.slow_queries.
+SLOW_QUERY_LOG_ENABLED = os.environ.get('SLOW_QUERY_LOG_ENABLED', '1') == '1'
+SLOW_QUERY_THRESHOLD_MS = float(os.environ.get('SLOW_QUERY_THRESHOLD_MS', 100))
+SLOW_QUERY_REPEAT_THRESHOLD = 50    # runs of one statement in a request that count as a loop
+SLOW_QUERY_MAX_FINGERPRINTS = 500   # least recently seen are dropped first
+SLOW_QUERY_EXPLAIN = True
+
 # Django AllAuth settings
 SITE_ID = 1
 ACCOUNT_EMAIL_VERIFICATION = 'none'
@@ -4,18 +4,30 @@ import axios from 'axios';
 import { useAuth } from '../context/AuthContext';
 import Yeet from './Yeet';
 
+const PAGE_SIZE = 20;
+
 const FollowingFeed = ({ refreshTrigger, onLikeSuccess, onReYeetSuccess }) => {
     const { user } = useAuth();
     const [posts, setPosts] = useState([]);
+    const [nextCursor, setNextCursor] = useState(null);
+    const [loadingMore, setLoadingMore] = useState(false);
+
+    // Get one page of the feed, starting after the cursor if there is one
+    const fetchPage = async (cursor) => {
+        const params = { limit: PAGE_SIZE };
+        if (cursor) params.cursor = cursor;
+        const result = await axios.get(`http://54.147.244.63:8000/api/follow_feed/${user.username}/`, { params });
+        return result.data;
+    };
 
     useEffect(() => {
         if (!user?.username) return;
 
         const fetchFollowingPosts = async () => {
             try {
-                const result = await axios.get(`http://54.147.244.63:8000/api/follow_feed/${user.username}/`)
-                
-                setPosts(result.data);
+                const page = await fetchPage(null);
+                setPosts(page.results);
+                setNextCursor(page.next_cursor);
             } catch (error) {
                 console.error(error);
             }
@@ -24,13 +36,27 @@ const FollowingFeed = ({ refreshTrigger, onLikeSuccess, onReYeetSuccess }) => {
         fetchFollowingPosts();
     }, [user, refreshTrigger]);
 
+    const loadMore = async () => {
+        if (!nextCursor || loadingMore) return;
+        setLoadingMore(true);
+        try {
+            const page = await fetchPage(nextCursor);
+            setPosts(prev => [...prev, ...page.results]);
+            setNextCursor(page.next_cursor);
+        } catch (error) {
+            console.error(error);
+        } finally {
+            setLoadingMore(false);
+        }
+    };
+
     if (!user?.username) {
         return <Text>Loading feed...</Text>;
     }
 
     return (
-        <FlatList 
-            data={posts} 
+        <FlatList
+            data={posts}
             keyExtractor={item => item.post_id.toString()}
             renderItem={({ item }) => (
             <Yeet
@@ -39,10 +65,11 @@ const FollowingFeed = ({ refreshTrigger, onLikeSuccess, onReYeetSuccess }) => {
                 onReYeetSuccess={onReYeetSuccess}
             />
         )}
-            
+        onEndReached={loadMore}
+        onEndReachedThreshold={0.5}
         contentContainerStyle={{ paddingBottom: 120 }}
         />
-            
-)};                
+
+)};
 
 export default FollowingFeed;
\ No newline at end of file
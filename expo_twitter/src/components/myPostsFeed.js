@@ -4,17 +4,30 @@ import axios from 'axios';
 import { useAuth } from '../context/AuthContext';
 import Yeet from './Yeet';
 
+const PAGE_SIZE = 20;
+
 const MyPostsFeed = ({refreshTrigger, onLikeSuccess, onReYeetSuccess}) => {
     const { user } = useAuth();
     const [myPosts, setMyPosts] = useState([]);
+    const [nextCursor, setNextCursor] = useState(null);
+    const [loadingMore, setLoadingMore] = useState(false);
+
+    // Get one page of posts, starting after the cursor if there is one
+    const fetchPage = async (cursor) => {
+        const params = { limit: PAGE_SIZE };
+        if (cursor) params.cursor = cursor;
+        const result = await axios.get(`http://54.147.244.63:8000/api/user_posts/${user.username}/`, { params });
+        return result.data;
+    };
 
     useEffect(() => {
         if (!user?.username) return;
 
         const fetchMyPosts = async () => {
             try {
-                const result = await axios.get(`http://54.147.244.63:8000/api/user_posts/${user.username}`)
-                setMyPosts(result.data);
+                const page = await fetchPage(null);
+                setMyPosts(page.results);
+                setNextCursor(page.next_cursor);
             } catch (error) {
                 console.error('Error fetching posts:', error);
             }
@@ -24,23 +37,39 @@ const MyPostsFeed = ({refreshTrigger, onLikeSuccess, onReYeetSuccess}) => {
 
     }, [user, refreshTrigger]);
 
+    const loadMore = async () => {
+        if (!nextCursor || loadingMore) return;
+        setLoadingMore(true);
+        try {
+            const page = await fetchPage(nextCursor);
+            setMyPosts(prev => [...prev, ...page.results]);
+            setNextCursor(page.next_cursor);
+        } catch (error) {
+            console.error('Error fetching more posts:', error);
+        } finally {
+            setLoadingMore(false);
+        }
+    };
+
     if (!user?.username) {
         return <Text>Loading...</Text>;
     }
 
     return (
-          <FlatList 
-            data={myPosts} 
+          <FlatList
+            data={myPosts}
             keyExtractor={item => item.post_id.toString()}
             renderItem={({ item }) => (
-                <Yeet 
-                    post={{...item}} 
-                    onLikeSuccess={onLikeSuccess} 
+                <Yeet
+                    post={{...item}}
+                    onLikeSuccess={onLikeSuccess}
                     onReYeetSuccess={onReYeetSuccess}
                 />
             )}
+            onEndReached={loadMore}
+            onEndReachedThreshold={0.5}
         />
-            
+
 )};
 
 export default MyPostsFeed;
\ No newline at end of file